@@ -1,20 +1,63 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import subprocess
 import os
 import tempfile
 import uuid
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 import logging
 import asyncio
-from typing import Optional
+import threading
+import time
+import multiprocessing
+import socket
+import sqlite3
+import hashlib
+import json
+import shlex
+import math
+import random
+import statistics
+import re
+import signal
+import atexit
+import sys
+import types
+import html
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+import contextvars
+from contextlib import contextmanager
+import zipfile
+import tarfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import Callable, Iterator, Optional
 import shutil
 import fitz  # PyMuPDF for verification and fallback
 import pytesseract
-from PIL import Image
-import io
+from PIL import Image, ImageOps
+from multipart.multipart import MultipartParser, parse_options_header
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+try:
+    from celery import Celery
+except ImportError:  # celery is only needed when JOB_BACKEND=celery
+    Celery = None
+
+try:
+    import tesserocr
+except ImportError:  # tesserocr is only needed for TESSERACT_INPUT=api
+    tesserocr = None
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 is only needed for STORAGE_BACKEND=s3
+    boto3 = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -38,32 +81,1077 @@ app.add_middleware(
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Create directories for storing files
-UPLOAD_DIR = Path(tempfile.gettempdir()) / "pdf_uploads"
-OUTPUT_DIR = Path(tempfile.gettempdir()) / "pdf_outputs"
-UPLOAD_DIR.mkdir(exist_ok=True)
-OUTPUT_DIR.mkdir(exist_ok=True)
+# Prometheus metrics. Stages run in worker threads of this process by default; with OCR_EXECUTOR=process, several
+# API workers or Celery, set PROMETHEUS_MULTIPROC_DIR so every process writes its samples where /metrics reads them
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram("pdf_ocr_stage_seconds", "Time spent in each pipeline stage", ["stage"],
+                          buckets=STAGE_BUCKETS)
+STRATEGY_SECONDS = Histogram("pdf_ocr_strategy_seconds", "Duration of OCRmyPDF strategy attempts", ["strategy"],
+                             buckets=STAGE_BUCKETS)
+STRATEGY_RUNS = Counter("pdf_ocr_strategy_runs_total", "OCRmyPDF strategy attempts by outcome (success or failure kind)",
+                        ["strategy", "outcome"])
+PAGES_PROCESSED = Counter("pdf_ocr_pages_total", "Pages processed, by classification", ["kind"])
+PAGE_ENGINE_PAGES = Counter("pdf_ocr_page_engine_pages_total", "Page engine results (ocr, cached or failed)",
+                            ["outcome"])
+DOCUMENTS_PROCESSED = Counter("pdf_ocr_documents_total", "Documents processed, by outcome", ["outcome"])
+QUEUE_WAIT_SECONDS = Histogram("pdf_ocr_queue_wait_seconds", "Time documents wait for a worker",
+                               ["queue"], buckets=STAGE_BUCKETS)
+IN_FLIGHT_DOCUMENTS = Gauge("pdf_ocr_in_flight_documents", "Documents admitted to this replica's worker pool",
+                            multiprocess_mode="livesum")
+IN_FLIGHT_PAGES = Gauge("pdf_ocr_in_flight_pages", "Pages admitted to this replica's worker pool",
+                        multiprocess_mode="livesum")
+JOBS_BY_STATE = Gauge("pdf_ocr_jobs", "Jobs in the job store, by state", ["state"], multiprocess_mode="max")
+
+# Optional span tracing: one Chrome trace file (chrome://tracing, Perfetto) per document in TRACE_DIR
+TRACE_DIR = os.environ.get("TRACE_DIR")
+# Only documents that took at least this long are exported
+TRACE_MIN_SECONDS = float(os.environ.get("TRACE_MIN_SECONDS", 0))
+_current_trace = contextvars.ContextVar("pdf_ocr_trace", default=None)
+if TRACE_DIR:
+    Path(TRACE_DIR).mkdir(parents=True, exist_ok=True)
+
+
+class Trace:
+    """Spans of one document, exported in Chrome trace event format"""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, started_at: float, seconds: float, thread: Optional[str] = None, **attrs):
+        with self._lock:
+            self.spans.append({
+                "name": name, "ph": "X", "ts": int(started_at * 1e6), "dur": max(1, int(seconds * 1e6)),
+                "pid": os.getpid(), "tid": thread or threading.current_thread().name,
+                "args": {key: value for key, value in attrs.items() if value is not None}
+            })
+
+    def export(self):
+        path = Path(TRACE_DIR) / f"{self.trace_id}.json"
+        temp_path = path.with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            json.dump({"traceEvents": self.spans, "displayTimeUnit": "ms"}, f)
+        os.replace(temp_path, path)
+
+
+@contextmanager
+def traced_document(trace_id: str, name: str, **attrs):
+    """Collect the spans of one document's processing and export them when TRACE_DIR is set"""
+    if not TRACE_DIR:
+        yield None
+        return
+    trace = Trace(trace_id)
+    token = _current_trace.set(trace)
+    started_at, started = time.time(), time.perf_counter()
+    try:
+        yield trace
+    finally:
+        seconds = time.perf_counter() - started
+        trace.add(name, started_at, seconds, **attrs)
+        _current_trace.reset(token)
+        if seconds >= TRACE_MIN_SECONDS:
+            try:
+                trace.export()
+            except OSError as e:
+                logger.warning(f"Could not export trace {trace_id}: {e}")
+
+
+def run_traced(trace_id: str, name: str, func, *args):
+    """Run a pipeline function under a document trace (picklable entry point for the worker pool)"""
+    with traced_document(trace_id, name):
+        return func(*args)
+
+
+@contextmanager
+def stage(name: str, **attrs):
+    """Time a pipeline stage into the stage histogram and, while tracing, a span of the current trace"""
+    started_at, started = time.time(), time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, started_at, seconds, **attrs)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+# Create directories for storing files; with STORAGE_BACKEND=s3 they only hold work in progress
+UPLOAD_DIR = Path(os.environ.get("UPLOAD_DIR", str(Path(tempfile.gettempdir()) / "pdf_uploads")))
+OUTPUT_DIR = Path(os.environ.get("OUTPUT_DIR", str(Path(tempfile.gettempdir()) / "pdf_outputs")))
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+# Where uploads and results are kept so every replica can serve them: "local" (UPLOAD_DIR and OUTPUT_DIR,
+# mounted as shared volumes) or "s3" (any S3-compatible object store)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+S3_BUCKET = os.environ.get("S3_BUCKET", "pdf-ocr")
+S3_PREFIX = os.environ.get("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
+S3_REGION = os.environ.get("S3_REGION") or None
+# Internal nginx location for OUTPUT_DIR: local downloads are answered with X-Accel-Redirect and sent by nginx
+DOWNLOAD_ACCEL_PREFIX = os.environ.get("DOWNLOAD_ACCEL_PREFIX", "")
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Uploads are streamed to disk, so the limit does not translate into memory per request
+MAX_FILE_SIZE = int(os.environ.get("MAX_FILE_SIZE", 200 * 1024 * 1024))
+MAX_FORM_FIELD_SIZE = 64 * 1024
+# Batches: all files and archives of one request together, and how many PDFs they may contain
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 2 * 1024 ** 3))
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", 10000))
+
+# Dependency checks run in the background; /health and /ready only read the last result
+HEALTH_CHECK_TTL = float(os.environ.get("HEALTH_CHECK_TTL", 300))
+# /ready fails when the upload or output volume has less free space than this
+READY_MIN_FREE_BYTES = int(os.environ.get("READY_MIN_FREE_BYTES", 1024 ** 3))
 
 # File cleanup after 1 hour to manage storage
-FILE_CLEANUP_HOURS = 1
-
-def cleanup_old_files():
-    """Clean up files older than FILE_CLEANUP_HOURS"""
-    import time
-    current_time = time.time()
-    cutoff_time = current_time - (FILE_CLEANUP_HOURS * 3600)
-    
-    for directory in [UPLOAD_DIR, OUTPUT_DIR]:
-        if directory.exists():
-            for file_path in directory.iterdir():
-                if file_path.is_file() and file_path.stat().st_mtime < cutoff_time:
+FILE_CLEANUP_HOURS = float(os.environ.get("FILE_CLEANUP_HOURS", 1))
+OUTPUT_MAX_BYTES = int(os.environ.get("OUTPUT_MAX_BYTES", 5 * 1024 ** 3))
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 0))
+# Byte quota per storage area (0 = unlimited), enforced least recently used first
+STORAGE_QUOTAS = {"uploads": UPLOAD_MAX_BYTES, "outputs": OUTPUT_MAX_BYTES}
+# Expiry index of stored files; keep it on the same volume as UPLOAD_DIR/OUTPUT_DIR when those are shared
+STORAGE_INDEX_PATH = os.environ.get("STORAGE_INDEX_PATH",
+                                    str(Path(tempfile.gettempdir()) / "pdf_storage_index.sqlite3"))
+JANITOR_INTERVAL = float(os.environ.get("JANITOR_INTERVAL", 60))
+
+# Content-addressed cache of finished searchable PDFs
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", str(Path(tempfile.gettempdir()) / "pdf_cache")))
+CACHE_DIR.mkdir(exist_ok=True)
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 2 * 1024 ** 3))
+CACHE_MAX_AGE_HOURS = float(os.environ.get("CACHE_MAX_AGE_HOURS", 24 * 7))
+
+# Per-page cache of tesseract word boxes, keyed by page content and render parameters
+PAGE_CACHE_DIR = Path(os.environ.get("PAGE_CACHE_DIR", str(Path(tempfile.gettempdir()) / "pdf_page_cache")))
+PAGE_CACHE_DIR.mkdir(exist_ok=True)
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 1024 ** 3))
+
+# Pages finished so far by incremental jobs, served before the whole document is done
+JOB_PAGES_DIR = Path(os.environ.get("JOB_PAGES_DIR", str(Path(tempfile.gettempdir()) / "pdf_job_pages")))
+JOB_PAGES_DIR.mkdir(exist_ok=True)
+
+# Render resolution for the PyMuPDF OCR paths: "auto" picks a scale per page from its source image
+# resolution and text height, a number forces a fixed DPI
+OCR_DPI = os.environ.get("OCR_DPI", "auto")
+OCR_MIN_DPI = int(os.environ.get("OCR_MIN_DPI", 150))
+OCR_MAX_DPI = int(os.environ.get("OCR_MAX_DPI", 400))
+OCR_TARGET_LINE_PX = int(os.environ.get("OCR_TARGET_LINE_PX", 40))
+# Optional page preprocessing before OCR: any of "deskew", "binarize", "crop"
+OCR_PREPROCESS = tuple(step for step in os.environ.get("OCR_PREPROCESS", "").replace(" ", "").split(",") if step)
+# Tesseract models to OCR with ("eng+fra"), or "auto" to detect them per document; uploads may override it
+OCR_LANGUAGE = os.environ.get("OCR_LANGUAGE", "eng")
+# Language detection looks at this many sample pages, rendered at this resolution
+OCR_DETECT_PAGES = int(os.environ.get("OCR_DETECT_PAGES", 3))
+OCR_DETECT_DPI = int(os.environ.get("OCR_DETECT_DPI", 150))
+
+# Effective OCR settings; part of every result cache key
+OCR_SETTINGS = {"language": OCR_LANGUAGE, "strategy": "auto", "dpi": OCR_DPI, "preprocess": list(OCR_PREPROCESS)}
+
+# OCR worker pool: "thread" or "process" executor with a bounded admission queue
+OCR_EXECUTOR = os.environ.get("OCR_EXECUTOR", "thread")
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", 2))
+OCR_QUEUE_SIZE = int(os.environ.get("OCR_QUEUE_SIZE", 8))
+OCR_RETRY_AFTER = int(os.environ.get("OCR_RETRY_AFTER", 30))
+# Pages admitted across all in-flight documents; a single larger document is still admitted when nothing else runs
+OCR_MAX_PAGES_IN_FLIGHT = int(os.environ.get("OCR_MAX_PAGES_IN_FLIGHT", 1000))
+
+
+def _run_in_worker(func, args: tuple) -> tuple[str, float, float, object]:
+    """Run a pipeline call inside a pool worker and report which worker ran it"""
+    worker_id = f"{os.getpid()}:{threading.current_thread().name}"
+    started = time.time()
+    result = func(*args)
+    return worker_id, started, time.time(), result
+
+
+class OCRWorkerPool:
+    """Bounded executor that keeps blocking OCR work off the event loop"""
+
+    def __init__(self, kind: str, max_workers: int, max_queued: int, max_pages: int = 0):
+        self.kind = kind
+        self.max_workers = max(1, max_workers)
+        self.max_queued = max(0, max_queued)
+        self.max_pages = max(0, max_pages)
+        self.executor = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.pages_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_queue_wait = 0.0
+        self.workers = {}
+
+    def start(self):
+        if self.executor is not None:
+            return
+        if self.kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ocr-worker")
+        logger.info(f"OCR worker pool started: {self.max_workers} {self.kind} workers, queue size {self.max_queued}")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def try_admit(self, pages: int = 0) -> bool:
+        """Reserve a slot for one document, or refuse when workers and queue or the page budget are full"""
+        with self._lock:
+            over_pages = (self.max_pages and self.pages_in_flight
+                          and self.pages_in_flight + pages > self.max_pages)
+            if self.in_flight >= self.max_workers + self.max_queued or over_pages:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.pages_in_flight += pages
+            return True
+
+    def add_pages(self, pages: int):
+        """Count pages of an admitted document once they are known"""
+        with self._lock:
+            self.pages_in_flight += pages
+
+    def release(self, pages: int = 0):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            self.pages_in_flight = max(0, self.pages_in_flight - pages)
+
+    def has_capacity(self) -> bool:
+        """Whether a new upload would be admitted right now"""
+        with self._lock:
+            if self.max_pages and self.pages_in_flight >= self.max_pages:
+                return False
+            return self.in_flight < self.max_workers + self.max_queued
+
+    def idle_workers(self) -> int:
+        with self._lock:
+            if self.max_pages and self.pages_in_flight >= self.max_pages:
+                return 0
+            return max(0, self.max_workers - self.in_flight)
+
+    async def run(self, func, *args):
+        """Run a blocking function on the pool; the caller must hold an admitted slot"""
+        self.start()
+        loop = asyncio.get_running_loop()
+        submitted = time.time()
+        try:
+            worker_id, started, finished, result = await loop.run_in_executor(
+                self.executor, _run_in_worker, func, args
+            )
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+
+        QUEUE_WAIT_SECONDS.labels("worker_pool").observe(max(0.0, started - submitted))
+        with self._lock:
+            self.completed += 1
+            self.total_queue_wait += max(0.0, started - submitted)
+            worker = self.workers.setdefault(worker_id, {"tasks": 0, "busy_seconds": 0.0})
+            worker["tasks"] += 1
+            worker["busy_seconds"] = round(worker["busy_seconds"] + (finished - started), 3)
+            worker["last_task_at"] = finished
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = min(self.in_flight, self.max_workers)
+            return {
+                "executor": self.kind,
+                "max_workers": self.max_workers,
+                "max_queued": self.max_queued,
+                "active": active,
+                "queued": self.in_flight - active,
+                "pages_in_flight": self.pages_in_flight,
+                "max_pages_in_flight": self.max_pages,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_queue_wait_seconds": round(self.total_queue_wait / self.completed, 3) if self.completed else 0.0,
+                "workers": {worker_id: dict(info) for worker_id, info in self.workers.items()},
+            }
+
+
+ocr_pool = OCRWorkerPool(OCR_EXECUTOR, OCR_WORKERS, OCR_QUEUE_SIZE, OCR_MAX_PAGES_IN_FLIGHT)
+
+
+def count_pdf_pages(path: str) -> int:
+    """Page count used for admission (of every PDF for a batch directory); 0 when the file cannot be opened as a PDF"""
+    if os.path.isdir(path):
+        return sum(count_pdf_pages(str(pdf_path)) for pdf_path in Path(path).glob("*.pdf"))
+    try:
+        with fitz.open(path) as doc:
+            return len(doc)
+    except Exception:
+        return 0
+
+# Asynchronous jobs: "local" runs them on this replica's worker pool, "celery" hands them to Celery workers
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "local")
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", str(Path(tempfile.gettempdir()) / "pdf_jobs.sqlite3"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1.0))
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 1800))
+JOB_EVENT_POLL_INTERVAL = float(os.environ.get("JOB_EVENT_POLL_INTERVAL", 0.5))
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+JOB_COLUMNS = [
+    "job_id", "state", "original_filename", "input_path", "output_path", "file_size",
+    "pages_done", "pages_total", "message", "has_selectable_text", "character_count",
+    "worker", "created_at", "started_at", "finished_at", "updated_at", "cache_key", "incremental",
+    "output_format", "batch", "language"
+]
+
+# Columns added after the first release, created on existing job stores at startup
+JOB_MIGRATIONS = {
+    "cache_key": "TEXT",
+    "incremental": "INTEGER DEFAULT 0",
+    "output_format": "TEXT DEFAULT 'pdf'",
+    "batch": "INTEGER DEFAULT 0",
+    "language": "TEXT"
+}
+
+
+class JobStore:
+    """SQLite-backed job table shared by every API replica and OCR worker"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    original_filename TEXT,
+                    input_path TEXT,
+                    output_path TEXT,
+                    file_size INTEGER DEFAULT 0,
+                    pages_done INTEGER DEFAULT 0,
+                    pages_total INTEGER DEFAULT 0,
+                    message TEXT,
+                    has_selectable_text INTEGER DEFAULT 0,
+                    character_count INTEGER DEFAULT 0,
+                    worker TEXT,
+                    created_at REAL,
+                    started_at REAL,
+                    finished_at REAL,
+                    updated_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    data TEXT,
+                    created_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, event_id)")
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in JOB_MIGRATIONS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, job_id: str, original_filename: str, input_path: str, output_path: str, file_size: int,
+               cache_key: Optional[str] = None, incremental: bool = False, output_format: str = "pdf",
+               batch: bool = False, language: Optional[str] = None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, state, original_filename, input_path, output_path, file_size, "
+                "cache_key, incremental, output_format, batch, language, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, original_filename, input_path, output_path, file_size, cache_key, int(incremental),
+                 output_format, int(batch), language, now, now)
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id: str, **fields):
+        fields = {key: value for key, value in fields.items() if key in JOB_COLUMNS}
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def claim_next(self, worker: str) -> Optional[str]:
+        """Atomically take the oldest queued job (or one whose lease expired) for this worker"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT job_id FROM jobs WHERE state = 'queued' "
+                "OR (state = 'running' AND updated_at < ?) ORDER BY created_at LIMIT 1",
+                (now - JOB_LEASE_SECONDS,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, started_at = ?, updated_at = ? WHERE job_id = ?",
+                (worker, now, now, row["job_id"])
+            )
+            conn.execute("COMMIT")
+            return row["job_id"]
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def counts(self) -> dict:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        return {row["state"]: row["n"] for row in rows}
+
+    def add_event(self, job_id: str, stage: str, status: str, **data):
+        """Append a progress event (stage started/progress/completed/failed) for a job"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO job_events (job_id, stage, status, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, stage, status, json.dumps(data), time.time())
+            )
+
+    def events(self, job_id: str, after_id: int = 0) -> list[dict]:
+        """Events of a job newer than after_id, oldest first"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM job_events WHERE job_id = ? AND event_id > ? ORDER BY event_id",
+                (job_id, after_id)
+            ).fetchall()
+        return [{"id": row["event_id"], "stage": row["stage"], "status": row["status"],
+                 "created_at": row["created_at"], **json.loads(row["data"] or "{}")} for row in rows]
+
+
+job_store = JobStore(JOB_DB_PATH)
+
+celery_app = None
+if JOB_BACKEND == "celery":
+    if Celery is None:
+        raise RuntimeError("JOB_BACKEND=celery requires the celery package")
+    celery_app = Celery("pdf_ocr", broker=REDIS_URL, backend=REDIS_URL)
+    celery_app.conf.update(task_acks_late=True, worker_prefetch_multiplier=1)
+
+
+def _link_or_copy(source: str, destination: str):
+    """Hard-link a file when possible so cache hits cost no extra disk space"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def evict_directory(directory: Path, max_age_seconds: float, max_bytes: int = 0) -> tuple[int, int]:
+    """Remove files past max_age_seconds, then the least recently used ones until under max_bytes"""
+    cutoff_time = time.time() - max_age_seconds
+    entries = []
+    removed = freed = 0
+    
+    if not directory.exists():
+        return removed, freed
+    
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if mtime >= cutoff_time and (not max_bytes or total <= max_bytes):
+            break
+        try:
+            os.remove(path)
+            removed += 1
+            freed += size
+            total -= size
+        except FileNotFoundError:
+            total -= size
+        except Exception as e:
+            logger.error(f"Error cleaning up {path}: {e}")
+    
+    return removed, freed
+
+
+def result_cache_key(input_hash: str, settings: dict) -> str:
+    """Cache key for a document: hash of its bytes plus the effective OCR settings"""
+    return hashlib.sha256(f"{input_hash}:{json.dumps(settings, sort_keys=True)}".encode()).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed store of searchable PDFs and their verification stats"""
+
+    def __init__(self, directory: Path, max_bytes: int, max_age_hours: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_hours * 3600
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        return self.directory / f"{key}.pdf", self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached result metadata, or None on a miss"""
+        pdf_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            now = time.time()
+            os.utime(pdf_path, (now, now))  # refresh the entry for LRU eviction
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            self.hits += 1
+        return meta
+
+    def materialize(self, key: str, output_path: str):
+        """Place the cached PDF at output_path so it can be downloaded like a fresh result"""
+        _link_or_copy(str(self._paths(key)[0]), output_path)
+
+    def put(self, key: str, output_path: str, meta: dict):
+        pdf_path, meta_path = self._paths(key)
+        try:
+            _link_or_copy(output_path, str(pdf_path))
+            tmp_path = meta_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, meta_path)
+            with self._lock:
+                self.stores += 1
+        except Exception as e:
+            logger.warning(f"Could not cache result {key[:12]}: {e}")
+
+    def evict(self) -> int:
+        """Drop entries past the age limit, then least recently used ones over the size budget"""
+        cutoff_time = time.time() - self.max_age_seconds
+        entries = []
+        for pdf_path in self.directory.glob("*.pdf"):
+            try:
+                st = pdf_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, pdf_path))
+        
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for mtime, size, pdf_path in entries:
+            if mtime >= cutoff_time and total <= self.max_bytes:
+                break
+            for path in (pdf_path, pdf_path.with_suffix(".json")):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= size
+            evicted += 1
+        
+        with self._lock:
+            self.evictions += evicted
+        if evicted:
+            logger.info(f"Evicted {evicted} cached result(s)")
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "max_bytes": self.max_bytes,
+                "max_age_hours": self.max_age_seconds / 3600
+            }
+
+
+result_cache = ResultCache(CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_AGE_HOURS)
+
+
+def _remove_local(path: str) -> bool:
+    """Remove a local file or directory; False when it is already gone"""
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+class LocalStorage:
+    """Uploads and results in UPLOAD_DIR and OUTPUT_DIR; replicas share them by mounting the same volumes"""
+
+    name = "local"
+    remote = False
+
+    def __init__(self, directories: dict[str, Path]):
+        self.directories = directories
+
+    def path(self, area: str, name: str) -> Path:
+        return self.directories[area] / name
+
+    def locator(self, area: str, name: str) -> str:
+        """Identifier of a stored entry in the storage index"""
+        return str(self.path(area, name))
+
+    def publish(self, area: str, name: str, path: str, keep: bool = False):
+        """Make a finished file or directory available to every replica (a no-op when it is written in place)"""
+        target = self.path(area, name)
+        if Path(path) == target:
+            return
+        if keep:
+            _link_or_copy(path, str(target))
+        else:
+            os.replace(path, target)
+
+    def materialize(self, area: str, name: str, path: str):
+        """Make a stored entry available at the local path; shared volumes already have it there"""
+        if Path(path) != self.path(area, name) and not os.path.exists(path):
+            _link_or_copy(str(self.path(area, name)), path)
+
+    def stat(self, area: str, name: str) -> Optional[dict]:
+        try:
+            st = os.stat(self.path(area, name))
+        except FileNotFoundError:
+            return None
+        # nginx's ETag format, so validators stay the same when downloads move behind X-Accel-Redirect
+        return {"size": st.st_size, "modified": st.st_mtime, "etag": f'"{int(st.st_mtime):x}-{st.st_size:x}"'}
+
+    def local_path(self, area: str, name: str) -> Optional[str]:
+        """Path the file can be sent from without copying it through Python, if there is one"""
+        return str(self.path(area, name))
+
+    def iter_bytes(self, area: str, name: str, start: int, end: int) -> Iterator[bytes]:
+        """Bytes start..end (inclusive) of a stored file, in DOWNLOAD_CHUNK_SIZE chunks"""
+        with open(self.path(area, name), "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def read_bytes(self, area: str, name: str) -> bytes:
+        return self.path(area, name).read_bytes()
+
+    def list(self, area: str, prefix: str) -> list[str]:
+        """Names of the files stored under prefix, a directory name ending in a slash"""
+        directory = self.path(area, prefix)
+        if not directory.is_dir():
+            return []
+        return [f"{prefix}{entry.name}" for entry in os.scandir(directory) if entry.is_file()]
+
+    def remove(self, locator: str) -> bool:
+        return _remove_local(locator)
+
+    def delete(self, area: str, name: str) -> bool:
+        return self.remove(self.locator(area, name))
+
+    def describe(self) -> dict:
+        return {"backend": self.name, **{f"{area}_dir": str(directory) for area, directory in self.directories.items()}}
+
+
+class S3Storage:
+    """Uploads and results in an S3-compatible bucket (AWS S3, MinIO, ...); local directories only hold work in progress
+
+    Files are uploaded from and downloaded to disk by boto3's transfer manager in multipart chunks, so a result
+    is never held in memory. Directories (batch uploads) are stored as one object per file under name/.
+    """
+
+    name = "s3"
+    remote = True
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use: page and OCRmyPDF worker processes import this module but never touch storage
+        if self._client is None:
+            # Path-style addressing works with MinIO and other stand-ins without wildcard DNS
+            self._client = boto3.client(
+                "s3", endpoint_url=self.endpoint_url, region_name=self.region,
+                config=BotoConfig(s3={"addressing_style": "path" if self.endpoint_url else "auto"})
+            )
+        return self._client
+
+    @staticmethod
+    def _is_missing(error: "ClientError") -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def key(self, area: str, name: str) -> str:
+        return f"{self.prefix}{area}/{name}"
+
+    def locator(self, area: str, name: str) -> str:
+        return f"s3://{self.bucket}/{self.key(area, name)}"
+
+    def _list(self, prefix: str) -> Iterator[str]:
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
+
+    def publish(self, area: str, name: str, path: str, keep: bool = False):
+        """Upload a finished file, or every file of a directory, and drop the local copy unless keep is set"""
+        key = self.key(area, name)
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for filename in files:
+                    file_path = os.path.join(root, filename)
+                    relative = os.path.relpath(file_path, path).replace(os.sep, "/")
+                    self.client.upload_file(file_path, self.bucket, f"{key}/{relative}")
+        else:
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            self.client.upload_file(path, self.bucket, key, ExtraArgs={"ContentType": content_type})
+        if not keep:
+            _remove_local(path)
+
+    def materialize(self, area: str, name: str, path: str):
+        """Download a stored file or directory to the local path unless this replica already has it"""
+        if os.path.exists(path):
+            return
+        key = self.key(area, name)
+        found = False
+        for object_key in self._list(key):
+            if object_key == key:
+                destination = path
+            elif object_key.startswith(f"{key}/"):
+                destination = os.path.join(path, *object_key[len(key) + 1:].split("/"))
+            else:
+                continue
+            os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+            self.client.download_file(self.bucket, object_key, destination)
+            found = True
+        if not found:
+            raise FileNotFoundError(self.locator(area, name))
+
+    def stat(self, area: str, name: str) -> Optional[dict]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(area, name))
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return {"size": head["ContentLength"], "modified": head["LastModified"].timestamp(), "etag": head["ETag"]}
+
+    def local_path(self, area: str, name: str) -> Optional[str]:
+        return None
+
+    def iter_bytes(self, area: str, name: str, start: int, end: int) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=self.key(area, name),
+                                      Range=f"bytes={start}-{end}")["Body"]
+        try:
+            yield from body.iter_chunks(DOWNLOAD_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def read_bytes(self, area: str, name: str) -> bytes:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(area, name))["Body"].read()
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(self.locator(area, name)) from e
+            raise
+
+    def list(self, area: str, prefix: str) -> list[str]:
+        area_prefix = self.key(area, "")
+        return [key[len(area_prefix):] for key in self._list(self.key(area, prefix))]
+
+    def remove(self, locator: str) -> bool:
+        """Delete an object and everything stored under it; other locators are local work files"""
+        bucket_prefix = f"s3://{self.bucket}/"
+        if not locator.startswith(bucket_prefix):
+            return _remove_local(locator)
+        key = locator[len(bucket_prefix):]
+        keys = [key, *self._list(f"{key}/")]
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": object_key} for object_key in keys[start:start + 1000]], "Quiet": True
+            })
+        return True
+
+    def delete(self, area: str, name: str) -> bool:
+        return self.remove(self.locator(area, name))
+
+    def describe(self) -> dict:
+        return {"backend": self.name, "bucket": self.bucket, "prefix": self.prefix, "endpoint_url": self.endpoint_url}
+
+
+def create_storage():
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION)
+    if STORAGE_BACKEND != "local":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return LocalStorage({"uploads": UPLOAD_DIR, "outputs": OUTPUT_DIR, "job_pages": JOB_PAGES_DIR})
+
+
+storage = create_storage()
+
+
+class StorageIndex:
+    """SQLite index of stored files and directories with their expiry, so cleanup never walks the volumes
+
+    Files are registered when they are written (an insert on the request path) and the janitor removes expired
+    entries and enforces per-area byte quotas from the index alone. Entries are local paths or, for results kept
+    in an object store, its locators; removal goes through the storage backend.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stored_files (
+                    path TEXT PRIMARY KEY,
+                    area TEXT NOT NULL,
+                    bytes INTEGER DEFAULT 0,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS stored_files_expiry ON stored_files (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS stored_files_area_access ON stored_files (area, accessed_at)")
+        self._lock = threading.Lock()
+        self.removed = 0
+        self.freed = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def track(self, path, area: str, ttl_seconds: Optional[float] = None, size: Optional[int] = None):
+        """Register a file or directory for expiry after ttl_seconds (FILE_CLEANUP_HOURS by default)"""
+        now = time.time()
+        ttl_seconds = FILE_CLEANUP_HOURS * 3600 if ttl_seconds is None else ttl_seconds
+        if size is None:
+            try:
+                size = os.path.getsize(path) if not os.path.isdir(path) else 0
+            except OSError:
+                size = 0
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO stored_files (path, area, bytes, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (path) DO UPDATE SET bytes = excluded.bytes, expires_at = excluded.expires_at, "
+                    "accessed_at = excluded.accessed_at",
+                    (str(path), area, size, now + ttl_seconds, now)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not index {path}: {e}")
+
+    def touch(self, path):
+        """Mark a file as used, so byte quotas evict it after less recently used ones"""
+        try:
+            with self._connect() as conn:
+                conn.execute("UPDATE stored_files SET accessed_at = ? WHERE path = ?", (time.time(), str(path)))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not update {path} in the storage index: {e}")
+
+    def forget(self, path):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM stored_files WHERE path = ?", (str(path),))
+
+    def _remove(self, conn: sqlite3.Connection, rows) -> tuple[int, int]:
+        removed = freed = 0
+        for row in rows:
+            try:
+                if storage.remove(row["path"]):
+                    removed += 1
+                    freed += row["bytes"]
+            except Exception as e:
+                logger.error(f"Error cleaning up {row['path']}: {e}")
+                continue
+            conn.execute("DELETE FROM stored_files WHERE path = ?", (row["path"],))
+        with self._lock:
+            self.removed += removed
+            self.freed += freed
+        return removed, freed
+
+    def expire(self, batch_size: int = 1000) -> tuple[int, int]:
+        """Remove everything past its expiry, oldest first; returns (removed, bytes freed)"""
+        removed = freed = 0
+        with self._connect() as conn:
+            while True:
+                rows = conn.execute(
+                    "SELECT path, bytes FROM stored_files WHERE expires_at <= ? ORDER BY expires_at LIMIT ?",
+                    (time.time(), batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                batch_removed, batch_freed = self._remove(conn, rows)
+                removed += batch_removed
+                freed += batch_freed
+                if len(rows) < batch_size:
+                    break
+        return removed, freed
+
+    def enforce_quota(self, area: str, max_bytes: int, batch_size: int = 100) -> tuple[int, int]:
+        """Remove the least recently used entries of an area until it fits in max_bytes"""
+        removed = freed = 0
+        if not max_bytes:
+            return removed, freed
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM stored_files WHERE area = ?",
+                                 (area,)).fetchone()[0]
+            while total > max_bytes:
+                rows = conn.execute(
+                    "SELECT path, bytes FROM stored_files WHERE area = ? ORDER BY accessed_at LIMIT ?",
+                    (area, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                over = []
+                for row in rows:
+                    if total <= max_bytes:
+                        break
+                    over.append(row)
+                    total -= row["bytes"]
+                batch_removed, batch_freed = self._remove(conn, over)
+                removed += batch_removed
+                freed += batch_freed
+        return removed, freed
+
+    def reconcile(self, area: str, directory: Path, ttl_seconds: float) -> int:
+        """Index entries of a directory that are not tracked yet (left from before a restart), expiring by mtime"""
+        added = 0
+        if not directory.exists():
+            return added
+        with self._connect() as conn:
+            known = {row["path"] for row in conn.execute("SELECT path FROM stored_files WHERE area = ?", (area,))}
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.path in known:
+                        continue
                     try:
-                        file_path.unlink()
-                        logger.info(f"Cleaned up old file: {file_path.name}")
-                    except Exception as e:
-                        logger.error(f"Error cleaning up {file_path}: {e}")
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    size = st.st_size if entry.is_file() else 0
+                    conn.execute(
+                        "INSERT OR IGNORE INTO stored_files (path, area, bytes, expires_at, accessed_at) "
+                        "VALUES (?, ?, ?, ?, ?)", (entry.path, area, size, st.st_mtime + ttl_seconds, st.st_mtime)
+                    )
+                    added += 1
+        return added
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT area, COUNT(*) AS files, COALESCE(SUM(bytes), 0) AS bytes, MIN(expires_at) AS next_expiry "
+                "FROM stored_files GROUP BY area"
+            ).fetchall()
+        with self._lock:
+            return {
+                "areas": {row["area"]: {"files": row["files"], "bytes": row["bytes"],
+                                        "next_expiry": row["next_expiry"]} for row in rows},
+                "quotas": dict(STORAGE_QUOTAS),
+                "removed": self.removed,
+                "freed_bytes": self.freed
+            }
+
+
+storage_index = StorageIndex(STORAGE_INDEX_PATH)
+
+
+def store_file(path, area: str = "outputs", size: Optional[int] = None, keep: bool = False):
+    """Publish a finished file or directory to the storage backend and index it for expiry"""
+    name = os.path.basename(path)
+    if size is None:
+        size = os.path.getsize(path) if not os.path.isdir(path) else 0
+    with stage("store", area=area, bytes=size):
+        storage.publish(area, name, str(path), keep)
+    storage_index.track(storage.locator(area, name), area, size=size)
+    if keep and storage.locator(area, name) != str(path):
+        storage_index.track(path, area, size=size)
+
+
+def open_stored_pdf(area: str, name: str) -> fitz.Document:
+    """Open a stored PDF in place, or from its bytes when it lives in an object store"""
+    local_path = storage.local_path(area, name)
+    if local_path is not None:
+        return fitz.open(local_path)
+    return fitz.open(stream=storage.read_bytes(area, name), filetype="pdf")
+
+
+def run_storage_janitor():
+    """Expire indexed uploads, outputs and job pages, enforce byte quotas, and evict the caches"""
+    removed, freed = storage_index.expire()
+    for area, max_bytes in STORAGE_QUOTAS.items():
+        over_removed, over_freed = storage_index.enforce_quota(area, max_bytes)
+        removed += over_removed
+        freed += over_freed
+    if removed:
+        logger.info(f"🧹 Cleaned up {removed} old file(s) ({freed} bytes)")
+    
+    result_cache.evict()
+    evict_directory(PAGE_CACHE_DIR, CACHE_MAX_AGE_HOURS * 3600, PAGE_CACHE_MAX_BYTES)
 
-def check_dependencies():
+
+def reconcile_storage():
+    """Index what is already on disk at startup: files from before a restart and pages of crashed jobs"""
+    ttl_seconds = FILE_CLEANUP_HOURS * 3600
+    added = sum(storage_index.reconcile(area, directory, ttl_seconds)
+                for area, directory in (("uploads", UPLOAD_DIR), ("outputs", OUTPUT_DIR),
+                                        ("job_pages", JOB_PAGES_DIR)))
+    if added:
+        logger.info(f"Indexed {added} file(s) already in storage")
+
+
+async def storage_janitor():
+    """Run the storage janitor in the background every JANITOR_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(JANITOR_INTERVAL)
+        try:
+            await asyncio.to_thread(run_storage_janitor)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Storage janitor error: {e}")
+
+def check_dependencies(verbose: bool = True):
     """Check if required OCR dependencies are available"""
     dependencies = {
         'ocrmypdf': 'ocrmypdf --version',
@@ -76,7 +1164,8 @@ def check_dependencies():
         try:
             result = subprocess.run(cmd.split(), capture_output=True, text=True, timeout=10)
             if result.returncode == 0:
-                logger.info(f"✓ {name} is available")
+                if verbose:
+                    logger.info(f"✓ {name} is available")
             else:
                 missing.append(name)
         except (subprocess.SubprocessError, FileNotFoundError, subprocess.TimeoutExpired):
@@ -84,348 +1173,2772 @@ def check_dependencies():
     
     return missing
 
-def create_searchable_pdf_with_ocrmypdf(input_pdf_path: str, output_pdf_path: str) -> tuple[bool, str]:
-    """Create a searchable PDF using OCRmyPDF with fallback strategies"""
-    try:
-        cleanup_old_files()
-        
-        strategies = [
-            {
-                'name': 'Basic OCR',
-                'cmd': [
-                    'ocrmypdf',
-                    '--language', 'eng',
-                    '--force-ocr',
-                    input_pdf_path,
-                    output_pdf_path
-                ]
-            },
-            {
-                'name': 'OCR with optimization',
-                'cmd': [
-                    'ocrmypdf',
-                    '--language', 'eng',
-                    '--force-ocr',
-                    '--optimize', '1',
-                    '--rotate-pages',
-                    input_pdf_path,
-                    output_pdf_path
-                ]
-            },
-            {
-                'name': 'OCR with background removal',
-                'cmd': [
-                    'ocrmypdf',
-                    '--language', 'eng',
-                    '--force-ocr',
-                    '--remove-background',
-                    '--optimize', '1',
-                    input_pdf_path,
-                    output_pdf_path
-                ]
+# Last dependency check; refreshed every HEALTH_CHECK_TTL seconds by dependency_monitor
+dependency_status = {"missing": [], "checked_at": None}
+
+
+def refresh_dependency_status(verbose: bool = False) -> list[str]:
+    """Re-run the dependency checks and log when the set of missing dependencies changes"""
+    missing = check_dependencies(verbose)
+    if dependency_status["checked_at"] is not None and missing != dependency_status["missing"]:
+        if missing:
+            logger.warning(f"Missing dependencies: {', '.join(missing)}")
+        else:
+            logger.info("All dependencies are available again")
+    dependency_status.update(missing=missing, checked_at=time.time())
+    return missing
+
+
+async def dependency_monitor():
+    """Refresh the cached dependency status in the background"""
+    while True:
+        await asyncio.sleep(HEALTH_CHECK_TTL)
+        try:
+            await asyncio.to_thread(refresh_dependency_status)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Dependency check failed: {e}")
+
+
+def disk_headroom() -> dict:
+    """Free bytes on the upload and output volumes"""
+    headroom = {}
+    for name, directory in (("upload_dir", UPLOAD_DIR), ("output_dir", OUTPUT_DIR)):
+        try:
+            headroom[name] = shutil.disk_usage(directory).free
+        except OSError:
+            headroom[name] = 0
+    return headroom
+
+# Page classification: pages with at least this much text are not scanned
+MIN_PAGE_TEXT_CHARS = 50
+# Pages with text whose images cover at least this share of the page are "mixed"
+MIXED_IMAGE_COVERAGE = 0.5
+
+
+def inspect_pages(input_pdf_path: str) -> list[dict]:
+    """Classify every page and count the characters and words of the text it already has"""
+    pages = []
+    with stage("classify"), fitz.open(input_pdf_path) as doc:
+        for page in doc:
+            text = page.get_text().strip()
+            info = {"kind": "scanned", "characters": len(text), "words": len(text.split())}
+            pages.append(info)
+            if len(text) < MIN_PAGE_TEXT_CHARS:
+                continue
+            
+            page_area = abs(page.rect) or 1.0
+            covered = 0.0
+            for image in page.get_image_info():
+                covered += abs(fitz.Rect(image["bbox"]) & page.rect)
+            info["kind"] = "mixed" if covered / page_area >= MIXED_IMAGE_COVERAGE else "digital"
+    for kind, count in summarize_page_kinds([info["kind"] for info in pages]).items():
+        if count:
+            PAGES_PROCESSED.labels(kind).inc(count)
+    return pages
+
+
+def classify_pages(input_pdf_path: str) -> list[str]:
+    """Classify every page as "digital" (has a text layer), "scanned" (needs OCR) or "mixed" (text over a scan)"""
+    return [info["kind"] for info in inspect_pages(input_pdf_path)]
+
+
+def pdf_text_stats(pages: list[dict]) -> dict[int, dict]:
+    """Text stats of the pages that keep their own text layer, from inspect_pages"""
+    return {page_num: {"source": "pdf", "characters": info["characters"], "words": info["words"],
+                       "mean_confidence": None}
+            for page_num, info in enumerate(pages) if info["kind"] != "scanned"}
+
+
+def summarize_page_kinds(page_kinds: list[str]) -> dict:
+    return {kind: page_kinds.count(kind) for kind in ("digital", "scanned", "mixed")}
+
+
+def format_page_ranges(page_numbers: list[int]) -> str:
+    """Format 0-based page numbers as the 1-based ranges ocrmypdf --pages expects, e.g. 1-3,7"""
+    ranges = []
+    for page_num in sorted(page_numbers):
+        if ranges and ranges[-1][1] == page_num:
+            ranges[-1][1] = page_num + 1
+        else:
+            ranges.append([page_num + 1, page_num + 1])
+    return ",".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+# Page-parallel OCR engine for the PyMuPDF/pytesseract paths
+OCR_PAGE_WORKERS = int(os.environ.get("OCR_PAGE_WORKERS", os.cpu_count() or 1))
+OCR_PAGE_CHUNK = int(os.environ.get("OCR_PAGE_CHUNK", 4))
+TESSERACT_THREADS = int(os.environ.get("TESSERACT_THREADS", 1))
+# "api" keeps warm tesseract engines in each page worker (needs tesserocr); "stdin" streams raw pixels to a
+# tesseract process per page as PNM; "file" goes through pytesseract's temp files; "auto" prefers "api"
+TESSERACT_INPUT = os.environ.get("TESSERACT_INPUT", "auto")
+if TESSERACT_INPUT == "auto":
+    TESSERACT_INPUT = "api" if tesserocr is not None else "stdin"
+# Languages each page worker loads when it starts, so the first page in that language pays no model load
+TESSERACT_PRELOAD_LANGS = [lang for lang in os.environ.get("TESSERACT_PRELOAD_LANGS", "eng,fra,deu,spa").split(",")
+                           if lang.strip()]
+TESSERACT_MAX_ENGINES = int(os.environ.get("TESSERACT_MAX_ENGINES", 8))
+
+_page_pool = None
+_page_pool_lock = threading.Lock()
+page_cache_stats = {"hits": 0, "misses": 0}
+dpi_profile = {}
+
+
+def mean_word_confidence(data: dict) -> Optional[float]:
+    confidences = [float(conf) for conf, text in zip(data.get("conf", []), data.get("text", []))
+                   if str(text).strip() and float(conf) >= 0]
+    return sum(confidences) / len(confidences) if confidences else None
+
+
+def record_dpi_profile(results: list[dict]):
+    """Accumulate render/OCR time and confidence per render DPI for freshly OCRed pages"""
+    with _page_pool_lock:
+        for result in results:
+            if result["data"] is None or result["cached"]:
+                continue
+            bucket = dpi_profile.setdefault(int(round(result["zoom"] * 72)), {
+                "pages": 0, "render_seconds": 0.0, "ocr_seconds": 0.0, "confidence_sum": 0.0, "confidence_pages": 0
+            })
+            bucket["pages"] += 1
+            bucket["render_seconds"] += result["render_seconds"]
+            bucket["ocr_seconds"] += result["ocr_seconds"]
+            confidence = mean_word_confidence(result["data"])
+            if confidence is not None:
+                bucket["confidence_sum"] += confidence
+                bucket["confidence_pages"] += 1
+
+
+def dpi_profile_stats() -> dict:
+    with _page_pool_lock:
+        return {
+            str(dpi): {
+                "pages": bucket["pages"],
+                "avg_render_seconds": round(bucket["render_seconds"] / bucket["pages"], 3),
+                "avg_ocr_seconds": round(bucket["ocr_seconds"] / bucket["pages"], 3),
+                "avg_confidence": round(bucket["confidence_sum"] / bucket["confidence_pages"], 1)
+                if bucket["confidence_pages"] else None
             }
-        ]
-        
-        for i, strategy in enumerate(strategies):
+            for dpi, bucket in sorted(dpi_profile.items())
+        }
+
+
+def _init_page_worker(tesseract_threads: int):
+    """Limit tesseract's OpenMP threads so page workers do not oversubscribe cores, then warm the engines"""
+    os.environ["OMP_THREAD_LIMIT"] = str(tesseract_threads)
+    if TESSERACT_INPUT == "api":
+        for lang in TESSERACT_PRELOAD_LANGS:
             try:
-                logger.info(f"Trying strategy {i+1}: {strategy['name']}")
-                
-                if os.path.exists(output_pdf_path):
-                    os.remove(output_pdf_path)
-                
-                result = subprocess.run(
-                    strategy['cmd'],
-                    capture_output=True,
-                    text=True,
-                    timeout=300,
-                    cwd=tempfile.gettempdir()
-                )
-                
-                if result.returncode == 0:
-                    logger.info(f"✅ {strategy['name']} completed successfully")
-                    return True, f"Success using {strategy['name']}"
-                else:
-                    error_msg = result.stderr.strip() if result.stderr else "Unknown error"
-                    logger.warning(f"❌ {strategy['name']} failed: {error_msg}")
-                    
-                    if i == len(strategies) - 1:
-                        return False, f"All OCR strategies failed. Last error: {error_msg}"
-                    
-                    continue
-                    
-            except subprocess.TimeoutExpired:
-                logger.warning(f"⏰ {strategy['name']} timed out")
-                continue
+                tesseract_engine(lang.strip(), '--oem 3 --psm 6')
             except Exception as e:
-                logger.warning(f"💥 {strategy['name']} crashed: {str(e)}")
+                logger.warning(f"⚠️ Could not preload tesseract model {lang}: {e}")
+
+
+def get_page_pool() -> ProcessPoolExecutor:
+    """Shared process pool used to OCR pages of every document in flight"""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            # spawn, not fork: the API process is multi-threaded by the time the pool is created
+            _page_pool = ProcessPoolExecutor(
+                max_workers=max(1, OCR_PAGE_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_page_worker,
+                initargs=(TESSERACT_THREADS,)
+            )
+            logger.info(f"Page OCR pool started: {OCR_PAGE_WORKERS} processes, "
+                        f"{TESSERACT_THREADS} tesseract thread(s) each, {TESSERACT_INPUT} input")
+        return _page_pool
+
+
+def shutdown_page_pool():
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is not None:
+            _page_pool.shutdown(wait=False, cancel_futures=True)
+            _page_pool = None
+
+
+def page_content_hash(doc, page) -> str:
+    """Hash what a page looks like: geometry, content streams, images, forms and fonts"""
+    digest = hashlib.sha256(f"{tuple(page.rect)}|{page.rotation}".encode())
+    for xref in page.get_contents():
+        digest.update(doc.xref_stream_raw(xref) or b"")
+    for item in page.get_images(full=True) + page.get_xobjects():
+        digest.update(doc.xref_stream_raw(item[0]) or b"")
+    for font in page.get_fonts(full=True):
+        digest.update(f"{font[3]}|{font[4]}".encode())
+    return digest.hexdigest()
+
+
+def page_cache_key(page_hash: str, render_key: str, lang: str, config: str) -> str:
+    return hashlib.sha256(f"{page_hash}:{render_key}:{lang}:{config}".encode()).hexdigest()
+
+
+def load_cached_page(key: str) -> Optional[dict]:
+    path = PAGE_CACHE_DIR / f"{key}.json"
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        now = time.time()
+        os.utime(path, (now, now))
+        return cached
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def store_cached_page(key: str, width: int, height: int, zoom: float, data: dict):
+    path = PAGE_CACHE_DIR / f"{key}.json"
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"width": width, "height": height, "zoom": zoom, "data": data}, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"Could not cache page OCR {key[:12]}: {e}")
+
+
+def render_page(page, zoom: float):
+    """Render a page as an 8-bit grayscale pixmap, which is all tesseract needs"""
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+
+
+def pixmap_to_image(pix) -> Image.Image:
+    """Wrap a pixmap's sample buffer in a PIL image without encoding or copying it"""
+    mode = {1: "L", 3: "RGB", 4: "RGBA"}[pix.n]
+    image = Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+    image._source_pixmap = pix  # the sample buffer is only valid while the pixmap is alive
+    return image
+
+
+TSV_HEADER = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n"
+
+# Warm engines of the calling thread (one thread per page worker process), keyed by (lang, config) in least
+# recently used order; a tesseract engine must not be shared by concurrent pages
+_tesseract_engines = threading.local()
+
+
+def parse_tesseract_config(config: str) -> dict:
+    """Split a tesseract command line config into engine options and -c variables"""
+    options = {"oem": 3, "psm": 3, "dpi": None, "variables": {}}
+    args = shlex.split(config)
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        value = args[i + 1] if i + 1 < len(args) else None
+        if arg in ("--oem", "--psm", "--dpi") and value is not None:
+            options[arg[2:]] = int(value)
+        elif arg == "-c" and value is not None and "=" in value:
+            name, _, variable = value.partition("=")
+            options["variables"][name] = variable
+        else:
+            raise ValueError(f"Unsupported tesseract option for the API engine: {arg}")
+        i += 2
+    return options
+
+
+def tesseract_engine(lang: str, config: str) -> tuple:
+    """Long-lived (engine, dpi) of this thread for lang and config, loading the model only on first use"""
+    engines = getattr(_tesseract_engines, "engines", None)
+    if engines is None:
+        engines = _tesseract_engines.engines = {}
+    key = (lang, config)
+    engine = engines.pop(key, None)
+    if engine is None:
+        if tesserocr is None:
+            raise RuntimeError("TESSERACT_INPUT=api needs the tesserocr package")
+        options = parse_tesseract_config(config)
+        started = time.perf_counter()
+        engine = (tesserocr.PyTessBaseAPI(lang=lang, psm=options["psm"], oem=options["oem"],
+                                          variables=options["variables"]), options["dpi"])
+        logger.info(f"🔥 Tesseract engine ready for {lang} ({config}) in {time.perf_counter() - started:.2f}s")
+        while len(engines) >= max(1, TESSERACT_MAX_ENGINES):
+            engines.pop(next(iter(engines)))[0].End()
+    engines[key] = engine
+    return engine
+
+
+def tesseract_api_image_to_data(image, lang: str, config: str) -> dict:
+    """OCR pixels in memory with a warm engine, returning pytesseract's DICT layout"""
+    engine, dpi = tesseract_engine(lang, config)
+    if isinstance(image, Image.Image):
+        channels = len(image.getbands())
+        engine.SetImageBytes(image.tobytes(), image.width, image.height, channels, image.width * channels)
+    else:
+        engine.SetImageBytes(bytes(image.samples_mv), image.width, image.height, image.n, image.stride)
+    if dpi:
+        engine.SetSourceResolution(dpi)
+    try:
+        tsv = engine.GetTSVText(0)
+    finally:
+        engine.Clear()
+    return pytesseract.pytesseract.file_to_dict(TSV_HEADER + tsv, '\t', -1)
+
+
+def tesseract_image_to_data(image, lang: str, config: str, timeout: float = 0) -> dict:
+    """Run tesseract on a pixmap or PIL image piped as raw PNM samples, returning pytesseract's DICT layout"""
+    if isinstance(image, Image.Image) and image.mode not in ("L", "RGB"):
+        image = image.convert("L")
+    
+    if TESSERACT_INPUT == "api":
+        return tesseract_api_image_to_data(image, lang, config)
+    
+    if TESSERACT_INPUT == "file":
+        return pytesseract.image_to_data(
+            image if isinstance(image, Image.Image) else pixmap_to_image(image),
+            lang=lang,
+            config=config,
+            output_type=pytesseract.Output.DICT
+        )
+    
+    if isinstance(image, Image.Image):
+        width, height, channels = image.width, image.height, len(image.getbands())
+        samples, stride = memoryview(image.tobytes()), image.width * channels
+    else:
+        width, height, channels = image.width, image.height, image.n
+        samples, stride = image.samples_mv, image.stride
+    
+    magic = {1: b"P5", 3: b"P6"}[channels]
+    header = b"%s\n%d %d\n255\n" % (magic, width, height)
+    cmd = [pytesseract.pytesseract.tesseract_cmd, 'stdin', 'stdout', '-l', lang,
+           '-c', 'tessedit_create_tsv=1', *shlex.split(config), 'tsv']
+    
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        proc.stdin.write(header)
+        row_bytes = width * channels
+        if stride == row_bytes:
+            proc.stdin.write(samples)
+        else:
+            for row in range(height):
+                proc.stdin.write(samples[row * stride:row * stride + row_bytes])
+    except BrokenPipeError:
+        pass
+    
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout or None)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise RuntimeError("tesseract timed out")
+    
+    if proc.returncode != 0:
+        raise RuntimeError(f"tesseract failed: {stderr.decode('utf-8', errors='replace').strip()}")
+    
+    return pytesseract.pytesseract.file_to_dict(stdout.decode('utf-8'), '\t', -1)
+
+
+def otsu_threshold(image: Image.Image) -> int:
+    """Gray level that best separates ink from paper in an 8-bit grayscale image"""
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    sum_all = sum(level * count for level, count in enumerate(histogram))
+    sum_background = weight_background = 0
+    best_variance, threshold = 0.0, 127
+    for level, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += level * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_variance, threshold = variance, level
+    return threshold
+
+
+def _ink_mask(image: Image.Image) -> Image.Image:
+    threshold = otsu_threshold(image)
+    return image.point(lambda v: 255 if v <= threshold else 0)
+
+
+def _row_profile(mask: Image.Image) -> list[float]:
+    """Share of ink in each row, computed by box-filtering the mask down to one column"""
+    return [value / 255 for value in mask.resize((1, mask.height), Image.BOX).getdata()]
+
+
+def estimate_line_height(mask: Image.Image) -> Optional[float]:
+    """Median height in pixels of the ink row runs in a mask, i.e. the typical text line height"""
+    runs, run = [], 0
+    for share in _row_profile(mask):
+        if share > 0.02:
+            run += 1
+        elif run:
+            runs.append(run)
+            run = 0
+    if run:
+        runs.append(run)
+    runs = [run for run in runs if run >= 2]
+    return float(statistics.median(runs)) if runs else None
+
+
+def estimate_skew(mask: Image.Image, max_angle: float = 5.0, step: float = 0.5) -> float:
+    """Rotation angle (degrees) that makes text rows sharpest in the row profile"""
+    best_angle, best_score = 0.0, -1.0
+    steps = int(max_angle / step)
+    # Smallest rotations first, so a page without a clear winner stays unrotated
+    for angle in sorted((i * step for i in range(-steps, steps + 1)), key=abs):
+        rotated = mask.rotate(angle, resample=Image.NEAREST, fillcolor=0)
+        score = sum(share * share for share in _row_profile(rotated))
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def source_image_dpi(page) -> Optional[float]:
+    """Effective resolution of the largest image drawn on the page"""
+    best = None
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"])
+        if bbox.is_empty or not info.get("width"):
+            continue
+        if best is None or abs(bbox) > abs(best[0]):
+            best = (bbox, 72.0 * info["width"] / bbox.width)
+    return best[1] if best else None
+
+
+def plan_page_render(page, dpi, preprocess: tuple) -> dict:
+    """Pick the render scale for a page and, if deskewing, its rotation"""
+    plan = {"zoom": (float(dpi) / 72) if dpi != "auto" else None, "angle": 0.0,
+            "source_dpi": None, "line_height_pt": None}
+    if plan["zoom"] is not None and "deskew" not in preprocess:
+        return plan
+    
+    # Cheap 72 DPI probe: one pixel per point
+    probe = pixmap_to_image(render_page(page, 1.0))
+    mask = _ink_mask(probe)
+    
+    if plan["zoom"] is None:
+        plan["source_dpi"] = source_image_dpi(page)
+        plan["line_height_pt"] = estimate_line_height(mask)
+        if plan["line_height_pt"]:
+            target_dpi = 72.0 * OCR_TARGET_LINE_PX / plan["line_height_pt"]
+        else:
+            target_dpi = 216.0
+        if plan["source_dpi"]:
+            # Rendering far above the scan's own resolution adds pixels but no detail
+            target_dpi = min(target_dpi, max(plan["source_dpi"] * 1.5, OCR_MIN_DPI))
+        # Quarter-step scales keep the DPI profile buckets meaningful
+        min_zoom = math.ceil(OCR_MIN_DPI / 72 * 4) / 4
+        max_zoom = max(min_zoom, math.floor(OCR_MAX_DPI / 72 * 4) / 4)
+        plan["zoom"] = max(min_zoom, min(max_zoom, round(target_dpi / 72 * 4) / 4))
+    
+    if "deskew" in preprocess:
+        plan["angle"] = estimate_skew(mask)
+    
+    return plan
+
+
+def preprocess_page_image(image: Image.Image, angle: float, preprocess: tuple) -> tuple[Image.Image, dict]:
+    """Apply deskew, binarization and margin cropping; return the image and how to map boxes back"""
+    transform = {"angle": 0.0, "center": (image.width / 2, image.height / 2), "offset": (0, 0)}
+    
+    if "deskew" in preprocess and angle:
+        image = image.rotate(angle, resample=Image.BILINEAR, fillcolor=255)
+        transform["angle"] = angle
+    
+    if "binarize" in preprocess:
+        threshold = otsu_threshold(image)
+        image = image.point(lambda v: 255 if v > threshold else 0)
+    
+    if "crop" in preprocess:
+        bbox = ImageOps.invert(image).point(lambda v: 255 if v > 96 else 0).getbbox()
+        if bbox:
+            pad = 16
+            x0, y0 = max(0, bbox[0] - pad), max(0, bbox[1] - pad)
+            x1, y1 = min(image.width, bbox[2] + pad), min(image.height, bbox[3] + pad)
+            image = image.crop((x0, y0, x1, y1))
+            transform["offset"] = (x0, y0)
+    
+    return image, transform
+
+
+def map_boxes_to_render(data: dict, transform: dict):
+    """Move word boxes from the preprocessed image back into the coordinates of the page render"""
+    dx, dy = transform["offset"]
+    theta = -math.radians(transform["angle"])
+    cx, cy = transform["center"]
+    for i in range(len(data.get("left", []))):
+        x, y = data["left"][i] + dx, data["top"][i] + dy
+        if theta:
+            # Same inverse mapping PIL uses for rotate(), applied to the box center
+            mx, my = x + data["width"][i] / 2 - cx, y + data["height"][i] / 2 - cy
+            x = math.cos(theta) * mx + math.sin(theta) * my + cx - data["width"][i] / 2
+            y = -math.sin(theta) * mx + math.cos(theta) * my + cy - data["height"][i] / 2
+        data["left"][i], data["top"][i] = int(round(x)), int(round(y))
+
+
+def _empty_page_result(page_num: int, zoom: Optional[float]) -> dict:
+    return {"page": page_num, "zoom": zoom, "width": 0, "height": 0, "data": None, "error": None, "cached": False,
+            "render_seconds": 0.0, "ocr_seconds": 0.0, "stats": None}
+
+
+def _ocr_page_range(input_pdf_path: str, page_numbers: list[int], dpi, preprocess: tuple,
+                    lang: str, config: str) -> list[dict]:
+    """Render, preprocess and OCR a shard of pages"""
+    render_key = f"{dpi}|{'+'.join(preprocess)}"
+    results = []
+    with fitz.open(input_pdf_path) as doc:
+        for page_num in page_numbers:
+            result = _empty_page_result(page_num, None)
+            try:
+                page = doc[page_num]
+                key = page_cache_key(page_content_hash(doc, page), render_key, lang, config)
+                cached = load_cached_page(key)
+                if cached is not None:
+                    result.update(width=cached["width"], height=cached["height"], zoom=cached["zoom"],
+                                  data=cached["data"], cached=True, stats=ocr_text_stats(cached["data"]))
+                    results.append(result)
+                    continue
+                
+                result["started_at"] = time.time()
+                started = time.perf_counter()
+                plan = plan_page_render(page, dpi, preprocess)
+                pix = render_page(page, plan["zoom"])
+                result["zoom"], result["width"], result["height"] = plan["zoom"], pix.width, pix.height
+                image, transform = pix, None
+                if preprocess:
+                    image, transform = preprocess_page_image(pixmap_to_image(pix), plan["angle"], preprocess)
+                result["render_seconds"] = time.perf_counter() - started
+                
+                started = time.perf_counter()
+                result["data"] = tesseract_image_to_data(image, lang, config)
+                result["ocr_seconds"] = time.perf_counter() - started
+                if transform:
+                    map_boxes_to_render(result["data"], transform)
+                result["stats"] = ocr_text_stats(result["data"])
+                
+                store_cached_page(key, result["width"], result["height"], result["zoom"], result["data"])
+            except Exception as e:
+                result["error"] = str(e)
+            results.append(result)
+    return results
+
+
+def ocr_pages(input_pdf_path: str, lang: str = 'eng', config: str = '--oem 3 --psm 6',
+              progress: Optional[Callable[[int, int], None]] = None,
+              page_kinds: Optional[list[str]] = None,
+              dpi=None, preprocess: Optional[tuple] = None,
+              on_page: Optional[Callable[[dict], None]] = None) -> list[dict]:
+    """OCR the scanned pages of a PDF across the page pool and return results for every page in page order"""
+    if page_kinds is None:
+        page_kinds = classify_pages(input_pdf_path)
+    total_pages = len(page_kinds)
+    dpi = dpi or OCR_DPI
+    preprocess = OCR_PREPROCESS if preprocess is None else tuple(preprocess)
+    
+    # Pages that already carry text keep it; their results have no OCR data
+    by_page = {page_num: _empty_page_result(page_num, None)
+               for page_num, kind in enumerate(page_kinds) if kind != "scanned"}
+    to_ocr = [page_num for page_num, kind in enumerate(page_kinds) if kind == "scanned"]
+    
+    # Contiguous shards amortize opening the document in each worker
+    chunk = max(1, min(OCR_PAGE_CHUNK, -(-len(to_ocr) // max(1, OCR_PAGE_WORKERS))))
+    shards = [to_ocr[start:start + chunk] for start in range(0, len(to_ocr), chunk)]
+    
+    def on_results(shard_index: int, shard_results: list[dict]):
+        for result in shard_results:
+            by_page[result["page"]] = result
+            if on_page:
+                on_page(result)
+        if progress:
+            progress(len(by_page), total_pages)
+    
+    with stage("page_engine", pages=len(to_ocr)):
+        run_page_shards([(input_pdf_path, shard) for shard in shards], dpi, preprocess, lang, config, on_results)
+    results = [by_page[page_num] for page_num in range(total_pages)]
+    record_page_results(results)
+    return results
+
+
+def run_page_shards(shards: list[tuple[str, list[int]]], dpi, preprocess: tuple, lang: str, config: str,
+                    on_results: Callable[[int, list[dict]], None]):
+    """OCR (document, pages) shards across the page pool, handing each shard's results over as it completes"""
+    if len(shards) <= 1 or OCR_PAGE_WORKERS <= 1:
+        for shard_index, (input_pdf_path, page_numbers) in enumerate(shards):
+            on_results(shard_index, _ocr_page_range(input_pdf_path, page_numbers, dpi, preprocess, lang, config))
+        return
+    
+    pool = get_page_pool()
+    futures = {pool.submit(_ocr_page_range, input_pdf_path, page_numbers, dpi, preprocess, lang, config): shard_index
+               for shard_index, (input_pdf_path, page_numbers) in enumerate(shards)}
+    try:
+        for future in as_completed(futures):
+            on_results(futures[future], future.result())
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def record_page_results(results: list[dict]):
+    """Account page cache hits and per-page timings of finished page engine results"""
+    trace = current_trace()
+    for result in results:
+        if result["error"]:
+            PAGE_ENGINE_PAGES.labels("failed").inc()
+        elif result["cached"]:
+            PAGE_ENGINE_PAGES.labels("cached").inc()
+        elif result["data"] is not None:
+            PAGE_ENGINE_PAGES.labels("ocr").inc()
+            STAGE_SECONDS.labels("render").observe(result["render_seconds"])
+            STAGE_SECONDS.labels("tesseract").observe(result["ocr_seconds"])
+            if trace is not None and result.get("started_at"):
+                # Page workers are other processes; their spans are rebuilt from the timings they report
+                thread = f"page worker (page {result['page'] + 1})"
+                trace.add("render", result["started_at"], result["render_seconds"], thread, page=result["page"] + 1,
+                          dpi=int(round(result["zoom"] * 72)))
+                trace.add("tesseract", result["started_at"] + result["render_seconds"], result["ocr_seconds"],
+                          thread, page=result["page"] + 1)
+    
+    hits = sum(1 for result in results if result["cached"])
+    misses = sum(1 for result in results if result["data"] is not None and not result["cached"])
+    with _page_pool_lock:
+        page_cache_stats["hits"] += hits
+        page_cache_stats["misses"] += misses
+    if hits:
+        logger.info(f"Reused cached OCR for {hits}/{hits + misses} page(s)")
+    
+    record_dpi_profile(results)
+
+
+# Frequent short words per language, enough to tell Latin-script models apart on a few sample pages
+LANGUAGE_STOPWORDS = {
+    "eng": {"the", "and", "of", "to", "in", "is", "that", "for", "with", "was", "on", "are", "this", "by", "be",
+            "not", "from", "have", "which", "you"},
+    "fra": {"le", "la", "les", "et", "des", "du", "un", "une", "est", "pour", "que", "qui", "dans", "pas", "sur",
+            "au", "avec", "ce", "il", "sont"},
+    "deu": {"der", "die", "und", "das", "ist", "den", "nicht", "mit", "von", "zu", "ein", "eine", "sich", "auf",
+            "dem", "des", "auch", "es", "wird", "sind"},
+    "spa": {"el", "los", "las", "y", "del", "que", "por", "con", "una", "es", "para", "se", "al", "lo", "como",
+            "su", "pero", "sus", "este", "está"},
+    "ita": {"il", "di", "che", "della", "per", "non", "sono", "gli", "nel", "alla", "anche", "come", "più", "questo",
+            "delle", "dei", "una", "ed", "sul", "è"},
+    "por": {"os", "do", "da", "em", "não", "uma", "para", "com", "que", "dos", "das", "ao", "se", "mais", "como",
+            "foi", "pela", "pelo", "são", "também"},
+    "nld": {"de", "het", "een", "van", "en", "niet", "dat", "is", "op", "te", "zijn", "voor", "met", "die", "ook",
+            "aan", "er", "bij", "naar", "worden"},
+}
+# Tesseract OSD script names and the models that read them, most widely used first
+SCRIPT_LANGUAGES = {
+    "Latin": ["eng", "fra", "deu", "spa", "ita", "por", "nld"],
+    "Cyrillic": ["rus", "ukr", "bul", "srp"],
+    "Greek": ["ell"],
+    "Arabic": ["ara", "fas", "urd"],
+    "Hebrew": ["heb"],
+    "Devanagari": ["hin", "mar", "nep"],
+    "Han": ["chi_sim", "chi_tra"],
+    "Japanese": ["jpn"],
+    "Katakana": ["jpn"],
+    "Hiragana": ["jpn"],
+    "Hangul": ["kor"],
+    "Thai": ["tha"],
+}
+
+_installed_languages = None
+
+
+def installed_languages() -> set[str]:
+    """Tesseract models available here, listed once per process (empty when tesseract is missing)"""
+    global _installed_languages
+    if _installed_languages is None:
+        try:
+            _installed_languages = set(pytesseract.get_languages(config="")) - {"osd"}
+        except Exception as e:
+            logger.warning(f"⚠️ Could not list tesseract languages: {e}")
+            return set()
+    return _installed_languages
+
+
+def parse_language_spec(spec: Optional[str]) -> str:
+    """Normalize a language request ("eng,fra", "eng+fra" or "auto") to tesseract's "eng+fra" form"""
+    spec = (spec or "").strip()
+    if not spec:
+        return OCR_LANGUAGE
+    if spec.lower() == "auto":
+        return "auto"
+    languages = [lang for lang in re.split(r"[+,\s]+", spec) if lang]
+    installed = installed_languages()
+    unknown = [lang for lang in languages
+               if not re.fullmatch(r"[A-Za-z_]+", lang) or (installed and lang not in installed)]
+    if unknown:
+        raise ValueError(f"Unknown OCR language(s) {', '.join(unknown)}, installed: {', '.join(sorted(installed))}")
+    return "+".join(dict.fromkeys(languages))
+
+
+def tesseract_osd(image) -> Optional[dict]:
+    """Rotation that uprights a rendered page and its script, or None when it has too little text to tell"""
+    try:
+        if TESSERACT_INPUT == "api":
+            engine, _ = tesseract_engine("osd", "--psm 0")
+            engine.SetImageBytes(bytes(image.samples_mv), image.width, image.height, image.n, image.stride)
+            try:
+                osd = engine.DetectOrientationScript()
+            finally:
+                engine.Clear()
+            if not osd:
+                return None
+            # tesserocr reports the page's orientation; the CLI's "rotate" is the correction that undoes it
+            return {"rotate": (360 - osd["orient_deg"]) % 360, "script": osd["script_name"],
+                    "script_conf": osd["script_conf"]}
+        osd = pytesseract.image_to_osd(pixmap_to_image(image), config="--psm 0", output_type=pytesseract.Output.DICT)
+        return {"rotate": osd["rotate"], "script": osd["script"], "script_conf": osd["script_conf"]}
+    except Exception as e:
+        logger.debug(f"OSD found no answer: {e}")
+        return None
+
+
+def score_languages(text: str, candidates: list[str]) -> dict[str, int]:
+    """Stopword hits of each candidate language in text"""
+    words = re.findall(r"[^\W\d_]+", text.lower())
+    return {lang: sum(1 for word in words if word in LANGUAGE_STOPWORDS[lang])
+            for lang in candidates if lang in LANGUAGE_STOPWORDS}
+
+
+def detect_languages(input_pdf_path: str, page_kinds: list[str]) -> dict:
+    """Pick the models for a document from a few sample pages
+
+    Pages with a text layer give their text for free. Scanned samples are rendered at OCR_DETECT_DPI, run through
+    OSD for their script and recognized once with that script's main model; stopwords then decide between the
+    script's installed languages. Languages with at least a third of the best score are kept, for mixed documents.
+    """
+    fallback = OCR_LANGUAGE if OCR_LANGUAGE != "auto" else "eng"
+    installed = installed_languages()
+    detected = {"language": fallback, "script": None, "rotate": None, "pages_sampled": 0, "scores": {}}
+    if not installed or not page_kinds:
+        return detected
+    
+    count = min(len(page_kinds), max(1, OCR_DETECT_PAGES))
+    sample = sorted({int((i + 0.5) * len(page_kinds) / count) for i in range(count)})
+    texts, scans, scripts, rotations = [], [], {}, []
+    with fitz.open(input_pdf_path) as doc:
+        for page_num in sample:
+            page = doc[page_num]
+            if page_kinds[page_num] != "scanned":
+                texts.append(page.get_text())
+                continue
+            pix = render_page(page, OCR_DETECT_DPI / 72)
+            scans.append(pix)
+            osd = tesseract_osd(pix)
+            if osd:
+                scripts[osd["script"]] = scripts.get(osd["script"], 0.0) + float(osd["script_conf"])
+                rotations.append(int(osd["rotate"]))
+    detected["pages_sampled"] = len(sample)
+    
+    if scripts:
+        detected["script"] = max(scripts, key=scripts.get)
+        detected["rotate"] = max(set(rotations), key=rotations.count)
+        candidates = [lang for lang in SCRIPT_LANGUAGES.get(detected["script"], []) if lang in installed]
+    else:
+        candidates = [lang for lang in SCRIPT_LANGUAGES["Latin"] if lang in installed]
+    if not candidates:
+        return detected
+    
+    if len(candidates) > 1 and candidates[0] in LANGUAGE_STOPWORDS:
+        for pix in scans:
+            data = tesseract_image_to_data(pix, candidates[0], "--oem 3 --psm 6")
+            texts.append(" ".join(str(word) for word in data["text"]))
+        scores = score_languages(" ".join(texts), candidates)
+        detected["scores"] = {lang: score for lang, score in scores.items() if score}
+        best = max(scores.values(), default=0)
+        if best >= 3:
+            ranked = sorted(scores, key=scores.get, reverse=True)
+            detected["language"] = "+".join(lang for lang in ranked[:3] if scores[lang] * 3 >= best)
+            return detected
+    detected["language"] = candidates[0]
+    return detected
+
+
+def resolve_language(lang: str, input_pdf_path: str, page_kinds: list[str],
+                     on_event: Optional[Callable[..., None]] = None) -> str:
+    """The models to OCR a document with: lang itself, or the detected ones when lang is "auto" """
+    if lang != "auto":
+        return lang
+    started = time.monotonic()
+    try:
+        with stage("language"):
+            detected = detect_languages(input_pdf_path, page_kinds)
+    except Exception as e:
+        logger.warning(f"⚠️ Language detection failed, using the default: {e}")
+        detected = {"language": OCR_LANGUAGE if OCR_LANGUAGE != "auto" else "eng", "script": None, "rotate": None,
+                    "pages_sampled": 0, "scores": {}}
+    logger.info(f"🌐 Detected language {detected['language']} (script {detected['script'] or 'from text layer'}, "
+                f"{detected['pages_sampled']} sample page(s))")
+    if on_event:
+        on_event("language", "completed", seconds=round(time.monotonic() - started, 3), **detected)
+    return detected["language"]
+
+
+OCRMYPDF_TIMEOUT = int(os.environ.get("OCRMYPDF_TIMEOUT", 300))
+OCRMYPDF_PAGE_TIMEOUT = int(os.environ.get("OCRMYPDF_PAGE_TIMEOUT", 120))
+# Cores shared by all OCRmyPDF runs in this process; each document gets a share as its --jobs
+OCR_CORE_BUDGET = int(os.environ.get("OCR_CORE_BUDGET", os.cpu_count() or 1))
+
+# Keyword arguments for ocrmypdf.ocr() on top of the language, mode, pages and jobs
+OCR_STRATEGIES = {
+    "basic": {"name": "Basic OCR", "options": {}},
+    "optimized": {"name": "OCR with optimization", "options": {"optimize": 1, "rotate_pages": True}},
+    "background": {"name": "OCR with background removal", "options": {"remove_background": True, "optimize": 1}},
+    "plain_pdf": {"name": "OCR without PDF/A conversion", "options": {"output_type": "pdf"}}
+}
+DEFAULT_STRATEGY_ORDER = ["basic", "optimized", "background", "plain_pdf"]
+
+# Strategies to jump to for a failure kind; None means another full OCRmyPDF run cannot help
+FAILURE_STRATEGIES = {
+    "ghostscript": ["plain_pdf"],
+    "timeout": None,
+    "encrypted": None,
+    "invalid_input": None,
+    "missing_dependency": None
+}
+
+# ocrmypdf prefixes log lines emitted while working on a page with its 1-based page number
+OCRMYPDF_PAGE_LOG = re.compile(r"^\s*(\d+) (.*)$")
+OCRMYPDF_PAGE_FAILURE = re.compile(r"error|exception|failed|too long", re.IGNORECASE)
+
+
+class CoreBudget:
+    """Splits a fixed number of cores between the OCRmyPDF runs in progress"""
+
+    def __init__(self, total: int):
+        self.total = max(1, total)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.documents = 0
+
+    def acquire(self, pages: int) -> int:
+        """Cores (ocrmypdf jobs) for a document starting now: a fair share of the budget, capped by what is free"""
+        with self._lock:
+            self.documents += 1
+            share = max(1, self.total // self.documents)
+            free = max(1, self.total - self.in_use)
+            jobs = max(1, min(share, free, pages or 1))
+            self.in_use += jobs
+            return jobs
+
+    def release(self, jobs: int):
+        with self._lock:
+            self.documents = max(0, self.documents - 1)
+            self.in_use = max(0, self.in_use - jobs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cores": self.total, "cores_in_use": self.in_use, "documents": self.documents}
+
+
+# Each process serves its documents one at a time, so a process executor divides the cores between its workers
+core_budget = CoreBudget(OCR_CORE_BUDGET if OCR_EXECUTOR == "thread" else OCR_CORE_BUDGET // OCR_WORKERS)
+
+
+class _OCRmyPDFLogCapture(logging.Handler):
+    """Collect ocrmypdf log lines the way its CLI prints them, prefixed with the 1-based page number"""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.lines = []
+
+    def emit(self, record):
+        pageno = getattr(record, "pageno", None)
+        prefix = f"{pageno:5d} " if isinstance(pageno, int) else ""
+        self.lines.append(prefix + record.getMessage())
+
+
+def _ocrmypdf_worker_main(conn):
+    """Long-lived OCRmyPDF process: imports ocrmypdf and its plugins once, then runs one document per request"""
+    # Own process group, so a timeout can kill ocrmypdf together with its tesseract and ghostscript children
+    os.setpgrp()
+    try:
+        import ocrmypdf
+    except ImportError as e:
+        ocrmypdf = None
+        import_error = str(e)
+    
+    if ocrmypdf is not None:
+        class PipeProgressBar:
+            """ocrmypdf progress bar that forwards whole-page steps to the parent process"""
+
+            def __init__(self, *, total=None, desc=None, unit=None, unit_scale=1.0, **kwargs):
+                self.desc = desc or "OCR"
+                self.scale = unit_scale or 1.0
+                self.total = int(total * self.scale) if total else 0
+                self.done = 0.0
+                self.sent = -1
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, exc_type, exc_value, traceback):
+                return False
+
+            def update(self, n=1, *, completed=None):
+                self.done = completed if completed is not None else self.done + (n or 1) * self.scale
+                if int(self.done) != self.sent:
+                    self.sent = int(self.done)
+                    conn.send(("progress", self.desc, self.sent, self.total))
+
+        # ocrmypdf loads plugins by module name (also in its forked page workers), so register one in sys.modules
+        progress_plugin = types.ModuleType("pdf_ocr_progress_plugin")
+        progress_plugin.get_progressbar_class = ocrmypdf.hookimpl(tryfirst=True)(lambda: PipeProgressBar)
+        sys.modules[progress_plugin.__name__] = progress_plugin
+    
+    ocrmypdf_logger = logging.getLogger("ocrmypdf")
+    ocrmypdf_logger.setLevel(logging.INFO)
+    
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if ocrmypdf is None:
+            conn.send(("result", 3, f"ocrmypdf is not installed: {import_error}"))
+            continue
+        
+        input_pdf_path, output_pdf_path, options = task
+        capture = _OCRmyPDFLogCapture()
+        ocrmypdf_logger.addHandler(capture)
+        try:
+            returncode = int(ocrmypdf.ocr(input_pdf_path, output_pdf_path, plugins=[progress_plugin.__name__],
+                                          progress_bar=False, **options))
+        except ocrmypdf.exceptions.ExitCodeException as e:
+            returncode = int(e.exit_code)
+            capture.lines.append(f"{type(e).__name__}: {e}")
+        except Exception as e:
+            returncode = int(ocrmypdf.ExitCode.other_error)
+            capture.lines.append(f"{type(e).__name__}: {e}")
+        finally:
+            ocrmypdf_logger.removeHandler(capture)
+        conn.send(("result", returncode, "\n".join(capture.lines)))
+
+
+class OCRmyPDFRunner:
+    """Warm OCRmyPDF worker processes driven through ocrmypdf.ocr(), one document at a time each"""
+
+    def __init__(self):
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._idle = []
+        self._busy = set()
+        self.started = 0
+        self.killed = 0
+
+    def _spawn(self) -> tuple:
+        parent_conn, child_conn = self._context.Pipe()
+        # Not a daemon: ocrmypdf starts its own worker processes
+        process = self._context.Process(target=_ocrmypdf_worker_main, args=(child_conn,), name="ocrmypdf-worker")
+        process.start()
+        child_conn.close()
+        with self._lock:
+            self.started += 1
+        return process, parent_conn
+
+    def _kill(self, worker: tuple):
+        process, conn = worker
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            process.kill()
+        process.join(5)
+        conn.close()
+        with self._lock:
+            self.killed += 1
+
+    def run(self, input_pdf_path: str, output_pdf_path: str, options: dict, timeout: float,
+            progress: Optional[Callable[[str, int, int], None]] = None) -> tuple[Optional[int], str]:
+        """Run ocrmypdf.ocr() on an idle worker; the return code is None when it timed out"""
+        with self._lock:
+            worker = self._idle.pop() if self._idle else None
+        if worker is None or not worker[0].is_alive():
+            worker = self._spawn()
+        with self._lock:
+            self._busy.add(worker)
+        
+        try:
+            process, conn = worker
+            conn.send((input_pdf_path, output_pdf_path, options))
+            deadline = time.monotonic() + timeout
+            while True:
+                if not conn.poll(max(0.0, deadline - time.monotonic())):
+                    self._kill(worker)
+                    return None, ""
+                message = conn.recv()
+                if message[0] == "result":
+                    break
+                if progress:
+                    try:
+                        progress(*message[1:])
+                    except Exception as e:
+                        # A failing progress sink must not abandon the run in the middle of a document
+                        logger.warning(f"OCRmyPDF progress callback failed: {e}")
+            _, returncode, log = message
+        except (EOFError, OSError) as e:
+            self._kill(worker)
+            return 15, f"OCRmyPDF worker died: {e}"  # ocrmypdf ExitCode.other_error
+        except BaseException:
+            # Anything else leaves the worker mid-document: kill it rather than orphan it
+            self._kill(worker)
+            raise
+        finally:
+            with self._lock:
+                self._busy.discard(worker)
+        
+        with self._lock:
+            self._idle.append(worker)
+        return returncode, log
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._idle = self._idle + list(self._busy), []
+            self._busy.clear()
+        for worker in workers:
+            self._kill(worker)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"idle_workers": len(self._idle), "busy_workers": len(self._busy),
+                    "started": self.started, "killed": self.killed}
+
+
+ocrmypdf_runner = OCRmyPDFRunner()
+atexit.register(ocrmypdf_runner.shutdown)
+
+
+class StrategyStats:
+    """Outcome counts and durations per OCRmyPDF strategy and document traits, kept next to the job store"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS strategy_stats (
+                    traits TEXT NOT NULL,
+                    strategy TEXT NOT NULL,
+                    outcome TEXT NOT NULL,
+                    runs INTEGER DEFAULT 0,
+                    seconds REAL DEFAULT 0,
+                    PRIMARY KEY (traits, strategy, outcome)
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, traits: str, strategy: str, outcome: str, seconds: float):
+        """Count one run; outcome is "success" or the failure kind"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO strategy_stats (traits, strategy, outcome, runs, seconds) VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT (traits, strategy, outcome) DO UPDATE SET runs = runs + 1, seconds = seconds + ?",
+                (traits, strategy, outcome, seconds, seconds)
+            )
+
+    def rank(self, traits: str, candidates: list[str]) -> list[str]:
+        """Order candidate strategies by their smoothed success rate on documents with these traits"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT strategy, SUM(runs) AS runs, SUM(CASE WHEN outcome = 'success' THEN runs ELSE 0 END) AS ok "
+                "FROM strategy_stats WHERE traits = ? GROUP BY strategy", (traits,)
+            ).fetchall()
+        scores = {row["strategy"]: (row["ok"] + 1) / (row["runs"] + 2) for row in rows}
+        return sorted(candidates, key=lambda key: (-scores.get(key, 0.5), candidates.index(key)))
+
+    def summary(self) -> dict:
+        """Success rate, mean duration and failure kinds per strategy, plus success rates per document traits"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM strategy_stats").fetchall()
+        strategies, by_traits = {}, {}
+        for row in rows:
+            entry = strategies.setdefault(row["strategy"], {"runs": 0, "successes": 0, "seconds": 0.0,
+                                                            "success_seconds": 0.0, "failures": {}})
+            traits = by_traits.setdefault(row["traits"], {}).setdefault(row["strategy"], {"runs": 0, "successes": 0})
+            entry["runs"] += row["runs"]
+            entry["seconds"] += row["seconds"]
+            traits["runs"] += row["runs"]
+            if row["outcome"] == "success":
+                entry["successes"] += row["runs"]
+                entry["success_seconds"] += row["seconds"]
+                traits["successes"] += row["runs"]
+            else:
+                entry["failures"][row["outcome"]] = entry["failures"].get(row["outcome"], 0) + row["runs"]
+        return {
+            "strategies": {
+                key: {
+                    "name": OCR_STRATEGIES.get(key, {}).get("name", key),
+                    "runs": entry["runs"],
+                    "success_rate": round(entry["successes"] / entry["runs"], 3),
+                    "avg_seconds": round(entry["seconds"] / entry["runs"], 2),
+                    "avg_success_seconds": round(entry["success_seconds"] / entry["successes"], 2)
+                    if entry["successes"] else None,
+                    "failures": entry["failures"]
+                }
+                for key, entry in strategies.items()
+            },
+            "by_traits": {
+                traits: {key: round(value["successes"] / value["runs"], 3) for key, value in entries.items()}
+                for traits, entries in by_traits.items()
+            }
+        }
+
+
+strategy_stats = StrategyStats(JOB_DB_PATH)
+
+
+def document_traits(input_pdf_path: str, page_kinds: list[str]) -> str:
+    """Coarse document profile that strategy outcomes are learned against, e.g. scanned/short/tagged"""
+    if "mixed" in page_kinds:
+        kind = "mixed"
+    elif "digital" in page_kinds:
+        kind = "partial"
+    else:
+        kind = "scanned"
+    
+    pages = len(page_kinds)
+    size = "single" if pages <= 1 else "short" if pages <= 10 else "medium" if pages <= 100 else "long"
+    traits = [kind, size]
+    
+    try:
+        with fitz.open(input_pdf_path) as doc:
+            if doc.xref_get_key(doc.pdf_catalog(), "MarkInfo/Marked")[1] == "true":
+                traits.append("tagged")
+    except Exception:
+        pass
+    return "/".join(traits)
+
+
+def ocrmypdf_failed_pages(stderr: str) -> list[int]:
+    """0-based pages that ocrmypdf reported an error or a tesseract timeout for"""
+    pages = set()
+    for line in (stderr or "").splitlines():
+        match = OCRMYPDF_PAGE_LOG.match(line)
+        if match and OCRMYPDF_PAGE_FAILURE.search(match.group(2)):
+            pages.add(int(match.group(1)) - 1)
+    return sorted(pages)
+
+
+def classify_ocrmypdf_failure(returncode: Optional[int], stderr: str) -> tuple[str, list[int]]:
+    """Map an OCRmyPDF failure to a kind that decides the next strategy, plus the pages it blamed"""
+    failed_pages = ocrmypdf_failed_pages(stderr)
+    text = (stderr or "").lower()
+    
+    if returncode is None:
+        return "timeout", failed_pages
+    if returncode == 8:
+        return "encrypted", failed_pages
+    if returncode == 3:
+        return "missing_dependency", failed_pages
+    if returncode == 10 or "ghostscript" in text:
+        return "ghostscript", failed_pages
+    if returncode == 2:
+        return "invalid_input", failed_pages
+    if failed_pages:
+        return "bad_page", failed_pages
+    return "other", failed_pages
+
+
+def run_ocrmypdf(strategy: str, mode_options: dict, jobs: int, input_pdf_path: str, output_pdf_path: str,
+                 progress: Optional[Callable[[str, int, int], None]] = None,
+                 lang: str = "eng") -> tuple[Optional[int], str]:
+    """Run one OCRmyPDF strategy in a warm worker process; the return code is None when it timed out"""
+    if os.path.exists(output_pdf_path):
+        os.remove(output_pdf_path)
+    
+    options = {
+        "language": lang.split("+"),
+        "tesseract_timeout": OCRMYPDF_PAGE_TIMEOUT,
+        "jobs": jobs,
+        **mode_options,
+        **OCR_STRATEGIES[strategy]["options"]
+    }
+    return ocrmypdf_runner.run(input_pdf_path, output_pdf_path, options, OCRMYPDF_TIMEOUT, progress)
+
+
+def page_event_reporter(on_event: Optional[Callable[..., None]]) -> Optional[Callable[[dict], None]]:
+    """Turn page engine results into per-page progress events with render and OCR timings"""
+    if on_event is None:
+        return None
+    
+    def report(result: dict):
+        on_event("page", "failed" if result["error"] else "completed", page=result["page"] + 1,
+                 dpi=int(round(result["zoom"] * 72)) if result["zoom"] else None, cached=result["cached"],
+                 render_seconds=round(result["render_seconds"], 3), ocr_seconds=round(result["ocr_seconds"], 3),
+                 error=result["error"])
+    return report
+
+
+def fill_pages_with_text_layer(input_pdf_path: str, output_pdf_path: str, page_numbers: list[int],
+                               on_event: Optional[Callable[..., None]] = None, lang: str = "eng",
+                               text_stats: Optional[dict] = None) -> int:
+    """OCR the given pages with the page engine and write their text into an existing output PDF"""
+    with fitz.open(input_pdf_path) as doc:
+        page_kinds = ["scanned" if page_num in page_numbers else "digital" for page_num in range(len(doc))]
+    
+    page_results = ocr_pages(input_pdf_path, lang=lang, page_kinds=page_kinds, on_page=page_event_reporter(on_event))
+    words = 0
+    temp_path = f"{output_pdf_path}.fill"
+    with fitz.open(output_pdf_path) as doc:
+        with stage("text_layer"):
+            for page_result in page_results:
+                if page_result["page"] in page_numbers and page_result["data"] is not None:
+                    words += write_text_layer(doc, doc[page_result["page"]], page_result)
+                if page_result["page"] in page_numbers:
+                    record_page_stats(text_stats, page_result)
+        with stage("save"):
+            doc.save(temp_path, garbage=3, deflate=True)
+    os.replace(temp_path, output_pdf_path)
+    return words
+
+
+def observe_strategy_attempt(strategy: str, outcome: str, seconds: float):
+    """Export one OCRmyPDF attempt as metrics and, while tracing, a span"""
+    STRATEGY_SECONDS.labels(strategy).observe(seconds)
+    STRATEGY_RUNS.labels(strategy, outcome).inc()
+    trace = current_trace()
+    if trace is not None:
+        trace.add(f"ocrmypdf: {strategy}", time.time() - seconds, seconds, outcome=outcome)
+
+
+def create_searchable_pdf_with_ocrmypdf(input_pdf_path: str, output_pdf_path: str,
+                                        page_kinds: Optional[list[str]] = None,
+                                        on_event: Optional[Callable[..., None]] = None,
+                                        lang: str = "eng", text_stats: Optional[dict] = None) -> tuple[bool, str]:
+    """Create a searchable PDF using OCRmyPDF, choosing the next strategy from how the previous one failed
+
+    text_stats, when given, receives the characters and words of every page OCRmyPDF recognized (from its sidecar
+    text) and of pages the page engine filled in.
+    """
+    sidecar_path = f"{output_pdf_path}.txt"
+    try:
+        if page_kinds is None:
+            page_kinds = classify_pages(input_pdf_path)
+        
+        pages_to_ocr = [page_num for page_num, kind in enumerate(page_kinds) if kind != "digital"]
+        if not pages_to_ocr:
+            shutil.copyfile(input_pdf_path, output_pdf_path)
+            logger.info(f"⏭️ All {len(page_kinds)} pages already have a text layer, skipping OCR")
+            return True, "Skipped OCR, every page already has selectable text"
+        
+        # Mixed pages get their old OCR text replaced (redo_ocr); pure scans are OCRed from scratch (force_ocr).
+        # Pages outside pages= are copied through untouched.
+        redo = "mixed" in page_kinds
+        candidates = list(DEFAULT_STRATEGY_ORDER)
+        if redo:
+            # remove_background cannot be combined with redo_ocr
+            candidates.remove("background")
+        
+        traits = document_traits(input_pdf_path, page_kinds)
+        queue = strategy_stats.rank(traits, candidates)
+        logger.info(f"Page classification: {summarize_page_kinds(page_kinds)}, OCRing {len(pages_to_ocr)} page(s), "
+                    f"traits {traits}, strategy order {queue}")
+        
+        # Pages OCRmyPDF choked on are left to the page engine instead of failing the whole document
+        isolated_pages = []
+        last_error = "Unknown error"
+        
+        def report_progress(step: str, pages_done: int, pages_total: int):
+            on_event("ocr", "progress", strategy=name, step=step, pages_done=pages_done, pages_total=pages_total)
+        
+        while queue:
+            strategy = queue.pop(0)
+            name = OCR_STRATEGIES[strategy]['name']
+            ocr_pages_now = [page_num for page_num in pages_to_ocr if page_num not in isolated_pages]
+            
+            if ocr_pages_now:
+                mode_options = {"redo_ocr": True} if redo else {"force_ocr": True}
+                if text_stats is not None:
+                    mode_options["sidecar"] = sidecar_path
+                if len(ocr_pages_now) < len(page_kinds):
+                    mode_options["pages"] = format_page_ranges(ocr_pages_now)
+                
+                jobs = core_budget.acquire(len(ocr_pages_now))
+                logger.info(f"Trying strategy: {name} ({jobs} job(s))")
+                if on_event:
+                    on_event("ocr", "started", strategy=name, pages=len(ocr_pages_now), jobs=jobs)
+                started = time.monotonic()
+                try:
+                    returncode, stderr = run_ocrmypdf(strategy, mode_options, jobs, input_pdf_path, output_pdf_path,
+                                                      report_progress if on_event else None, lang)
+                finally:
+                    core_budget.release(jobs)
+                seconds = time.monotonic() - started
+            else:
+                shutil.copyfile(input_pdf_path, output_pdf_path)
+                returncode, stderr, seconds = 0, "", 0.0
+            
+            if returncode == 0:
+                strategy_stats.record(traits, strategy, "success", seconds)
+                observe_strategy_attempt(strategy, "success", seconds)
+                logger.info(f"✅ {name} completed successfully in {seconds:.1f}s")
+                if on_event:
+                    on_event("ocr", "completed", strategy=name, seconds=round(seconds, 3))
+                if text_stats is not None:
+                    # redo_ocr keeps the real text of mixed pages, which the sidecar leaves out: read those back
+                    text_stats.update(sidecar_text_stats(sidecar_path, [page_num for page_num in ocr_pages_now
+                                                                        if page_kinds[page_num] == "scanned"]))
+                    for page_num in ocr_pages_now:
+                        if page_kinds[page_num] == "mixed":
+                            text_stats.pop(page_num, None)
+                
+                # Pages tesseract gave up on were copied without text
+                skipped = [page_num for page_num in ocrmypdf_failed_pages(stderr)
+                           if page_num in pages_to_ocr and page_num not in isolated_pages]
+                retry_pages = [page_num for page_num in isolated_pages + skipped if page_kinds[page_num] == "scanned"]
+                if retry_pages:
+                    logger.info(f"🔁 OCRing {len(retry_pages)} page(s) OCRmyPDF could not handle: "
+                                f"{format_page_ranges(retry_pages)}")
+                    fill_pages_with_text_layer(input_pdf_path, output_pdf_path, retry_pages, on_event, lang, text_stats)
+                    return True, f"Success using {name}, page engine for pages {format_page_ranges(retry_pages)}"
+                return True, f"Success using {name}"
+            
+            kind, failed_pages = classify_ocrmypdf_failure(returncode, stderr)
+            strategy_stats.record(traits, strategy, kind, seconds)
+            observe_strategy_attempt(strategy, kind, seconds)
+            last_error = stderr.strip().splitlines()[-1] if stderr.strip() else f"{kind} (exit {returncode})"
+            
+            if kind == "timeout":
+                logger.warning(f"⏰ {name} timed out after {seconds:.0f}s")
+            else:
+                logger.warning(f"❌ {name} failed ({kind}): {last_error}")
+            if on_event:
+                on_event("ocr", "failed", strategy=name, failure=kind, seconds=round(seconds, 3))
+            
+            if kind == "bad_page":
+                new_pages = [page_num for page_num in failed_pages if page_num not in isolated_pages]
+                if new_pages:
+                    # Same strategy again without the failing pages
+                    isolated_pages += new_pages
+                    queue.insert(0, strategy)
+                continue
+            
+            preferred = FAILURE_STRATEGIES.get(kind, [])
+            if preferred is None:
+                logger.info(f"⏭️ Skipping remaining OCRmyPDF strategies after {kind} failure")
+                return False, f"OCRmyPDF failed ({kind}): {last_error}"
+            preferred = [key for key in preferred if key in queue]
+            queue = preferred + [key for key in queue if key not in preferred]
+        
+        return False, f"All OCR strategies failed. Last error: {last_error}"
+            
+    except Exception as e:
+        error_msg = f"Error running OCRmyPDF: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+    finally:
+        try:
+            os.remove(sidecar_path)
+        except OSError:
+            pass
+
+
+# Words below this tesseract confidence are left out of the text layer
+OCR_MIN_CONFIDENCE = 40
+OCR_FONT_NAME = "OCRText"
+
+_ocr_font = None
+
+
+def get_ocr_font() -> fitz.Font:
+    """Font embedded for the invisible text layer (built-in Helvetica metrics, embedded once per document)"""
+    global _ocr_font
+    if _ocr_font is None:
+        _ocr_font = fitz.Font("helv")
+    return _ocr_font
+
+
+def group_ocr_lines(data: dict, min_confidence: float = OCR_MIN_CONFIDENCE) -> list[list[dict]]:
+    """Group tesseract words into lines, in reading order, keeping confident non-empty words"""
+    lines = {}
+    for i in range(len(data.get("text", []))):
+        text = str(data["text"][i]).strip()
+        if not text or float(data["conf"][i]) <= min_confidence:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append({
+            "text": text,
+            "left": data["left"][i],
+            "top": data["top"][i],
+            "width": data["width"][i],
+            "height": data["height"][i],
+            "conf": float(data["conf"][i])
+        })
+    return [sorted(words, key=lambda word: word["left"]) for words in lines.values()]
+
+
+def ocr_text_stats(data: Optional[dict]) -> dict:
+    """Characters, words and mean confidence of the text layer write_text_layer builds from tesseract words"""
+    lines = group_ocr_lines(data) if data else []
+    words = [word for line in lines for word in line]
+    # Words are joined by spaces and lines by newlines, as get_text() reads them back
+    characters = sum(len(word["text"]) for word in words) + len(words) - len(lines) + max(0, len(lines) - 1)
+    return {"source": "ocr", "characters": characters, "words": len(words),
+            "mean_confidence": round(sum(word["conf"] for word in words) / len(words), 1) if words else None}
+
+
+def record_page_stats(text_stats: Optional[dict], page_result: dict):
+    """Keep the emitted stats of a page engine result, or zero for a page that failed"""
+    if text_stats is None:
+        return
+    if page_result["error"]:
+        text_stats[page_result["page"]] = {"source": "failed", "characters": 0, "words": 0, "mean_confidence": None}
+    elif page_result["stats"] is not None:
+        text_stats[page_result["page"]] = page_result["stats"]
+
+
+def sidecar_text_stats(sidecar_path: str, page_numbers: list[int]) -> dict[int, dict]:
+    """Text stats of the pages OCRmyPDF recognized, from its sidecar text (one form feed per page)"""
+    try:
+        with open(sidecar_path, encoding="utf-8", errors="replace") as f:
+            pages = f.read().split("\f")
+    except OSError:
+        return {}
+    stats = {}
+    for page_num in page_numbers:
+        if page_num >= len(pages):
+            continue
+        text = pages[page_num].strip()
+        if text.startswith("[OCR skipped on page"):
+            continue
+        stats[page_num] = {"source": "ocrmypdf", "characters": len(text), "words": len(text.split()),
+                           "mean_confidence": None}
+    return stats
+
+
+def summarize_text_stats(page_stats: list[Optional[dict]]) -> dict:
+    """Document totals of per-page text stats; the mean confidence is weighted by words"""
+    words = sum(stats["words"] for stats in page_stats if stats)
+    scored = [stats for stats in page_stats if stats and stats["mean_confidence"] is not None]
+    scored_words = sum(stats["words"] for stats in scored)
+    return {
+        "character_count": sum(stats["characters"] for stats in page_stats if stats),
+        "word_count": words,
+        "mean_confidence": round(sum(stats["mean_confidence"] * stats["words"] for stats in scored) / scored_words, 1)
+        if scored_words else None
+    }
+
+
+def _pdf_hex_string(font: fitz.Font, text: str) -> str:
+    """Encode text as 2-byte glyph ids for the Identity-H encoded embedded font"""
+    fallback = font.has_glyph(ord("?"))
+    return "<" + "".join(f"{font.has_glyph(ord(char)) or fallback:04x}" for char in text) + ">"
+
+
+def write_text_layer(doc, page, page_result: dict) -> int:
+    """Add all recognized words of a page as a single invisible (render mode 3) text object"""
+    data = page_result["data"]
+    if not data or not page_result["width"] or not page_result["height"]:
+        return 0
+    
+    lines = group_ocr_lines(data)
+    if not lines:
+        return 0
+    
+    font = get_ocr_font()
+    page.insert_font(fontname=OCR_FONT_NAME, fontbuffer=font.buffer)
+    
+    # Render pixels -> visible page space -> PDF user space (handles /Rotate and the mediabox origin)
+    scale_x = page.rect.width / page_result["width"]
+    scale_y = page.rect.height / page_result["height"]
+    to_pdf = ~(page.transformation_matrix * page.rotation_matrix)
+    em_height = font.ascender - font.descender
+    
+    ops = ["q", "BT", "3 Tr", f"/{OCR_FONT_NAME} 1 Tf"]
+    words_written = 0
+    for line in lines:
+        top = min(word["top"] for word in line) * scale_y
+        bottom = max(word["top"] + word["height"] for word in line) * scale_y
+        font_size = max((bottom - top) / em_height, 1.0)
+        baseline = bottom + font.descender * font_size
+        
+        for index, word in enumerate(line):
+            natural_width = font.text_length(word["text"], fontsize=font_size)
+            box_width = word["width"] * scale_x
+            horizontal_scale = 100.0 * box_width / natural_width if natural_width else 100.0
+            matrix = fitz.Matrix(font_size, 0, 0, -font_size, word["left"] * scale_x, baseline) * to_pdf
+            text = word["text"] + (" " if index < len(line) - 1 else "")
+            ops.append(f"{horizontal_scale:.2f} Tz "
+                       f"{matrix.a:.4f} {matrix.b:.4f} {matrix.c:.4f} {matrix.d:.4f} {matrix.e:.3f} {matrix.f:.3f} Tm "
+                       f"{_pdf_hex_string(font, text)} Tj")
+            words_written += 1
+    ops += ["ET", "Q"]
+    
+    # Keep the page's own graphics state from leaking into the text object
+    page.wrap_contents()
+    xref = doc.get_new_xref()
+    doc.update_object(xref, "<<>>")
+    doc.update_stream(xref, "\n".join(ops).encode("ascii"))
+    contents = page.get_contents() + [xref]
+    doc.xref_set_key(page.xref, "Contents", "[" + " ".join(f"{c} 0 R" for c in contents) + "]")
+    
+    return words_written
+
+
+def create_invisible_text_layer(input_pdf_path: str, output_pdf_path: str,
+                                progress: Optional[Callable[[int, int], None]] = None,
+                                page_kinds: Optional[list[str]] = None,
+                                on_event: Optional[Callable[..., None]] = None,
+                                page_sink: Optional[Callable[[dict], None]] = None,
+                                lang: str = "eng", text_stats: Optional[dict] = None) -> tuple[bool, str]:
+    """Create invisible text layer using PDF content streams; page_sink receives each page as soon as it is OCRed
+
+    text_stats, when given, receives the characters, words and mean confidence of every OCRed page.
+    """
+    doc = None
+    report_page = page_event_reporter(on_event)
+    
+    def on_page(result: dict):
+        # Store the page before announcing it, so clients reacting to the event can fetch it
+        if page_sink:
+            page_sink(result)
+        if report_page:
+            report_page(result)
+    
+    try:
+        doc = fitz.open(input_pdf_path)
+        if on_event:
+            on_event("ocr", "started", strategy="Page engine",
+                     pages=page_kinds.count("scanned") if page_kinds else None)
+        started = time.monotonic()
+        page_results = ocr_pages(input_pdf_path, lang=lang, config='--oem 3 --psm 6',
+                                 progress=progress, page_kinds=page_kinds, on_page=on_page)
+        if on_event:
+            on_event("ocr", "completed", strategy="Page engine", seconds=round(time.monotonic() - started, 3))
+        
+        started = time.monotonic()
+        words = 0
+        with stage("text_layer"):
+            for page_result in page_results:
+                if page_result["error"]:
+                    logger.warning(f"Error processing page {page_result['page'] + 1}: {page_result['error']}")
+                    record_page_stats(text_stats, page_result)
+                    continue
+                
+                if page_result["data"] is not None:
+                    try:
+                        words += write_text_layer(doc, doc[page_result["page"]], page_result)
+                        record_page_stats(text_stats, page_result)
+                    except Exception as stream_error:
+                        logger.warning(f"Content stream insertion failed: {stream_error}")
+                        continue
+        
+        # Linearized, so viewers can show the first pages while the rest downloads
+        with stage("save"):
+            doc.save(output_pdf_path, garbage=4, deflate=True, clean=True, linear=True)
+        if on_event:
+            on_event("text_layer", "completed", words=words, seconds=round(time.monotonic() - started, 3))
+        return True, "Success using invisible text layer"
+        
+    except Exception as e:
+        logger.error(f"Text layer method failed: {str(e)}")
+        return False, f"Text layer method failed: {str(e)}"
+    finally:
+        if doc:
+            doc.close()
+
+def create_searchable_pdf_fallback(input_pdf_path: str, output_pdf_path: str,
+                                   progress: Optional[Callable[[int, int], None]] = None,
+                                   page_kinds: Optional[list[str]] = None,
+                                   lang: str = "eng", text_stats: Optional[dict] = None) -> tuple[bool, str]:
+    """Fallback method using PyMuPDF with completely invisible text overlays"""
+    doc = None
+    try:
+        logger.info("Using PyMuPDF fallback method with invisible overlays...")
+        doc = fitz.open(input_pdf_path)
+        
+        # Get OCR data with improved settings
+        page_results = ocr_pages(
+            input_pdf_path,
+            lang=lang,
+            config='--oem 3 --psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,!?:;-()[]{}\\"\\\'\\ ',
+            progress=progress,
+            page_kinds=page_kinds
+        )
+        
+        for page_result in page_results:
+            page_num = page_result["page"]
+            try:
+                if page_result["error"]:
+                    raise RuntimeError(page_result["error"])
+                
+                if page_result["data"] is not None:
+                    write_text_layer(doc, doc[page_num], page_result)
+                    record_page_stats(text_stats, page_result)
+                    
+            except Exception as page_error:
+                logger.warning(f"Error processing page {page_num + 1}: {str(page_error)}")
+                continue
+        
+        # Save with optimization
+        doc.save(
+            output_pdf_path, 
+            garbage=4, 
+            deflate=True, 
+            clean=True,
+            linear=True
+        )
+        
+        logger.info("PyMuPDF fallback completed with invisible text overlays")
+        return True, "Success using invisible text overlays"
+        
+    except Exception as e:
+        logger.error(f"Invisible overlay method failed: {str(e)}")
+        return False, f"Invisible overlay method failed: {str(e)}"
+    finally:
+        if doc:
+            doc.close()
+
+
+# Random pages read back from every output to check the emitted text stats; 0 only reads pages without stats
+VERIFY_SAMPLE_PAGES = int(os.environ.get("VERIFY_SAMPLE_PAGES", 0))
+
+
+def verify_text_stats(pdf_path: str, page_stats: list[Optional[dict]], sample: int = VERIFY_SAMPLE_PAGES) -> dict:
+    """Read back the text of pages without stats plus a random sample of the others, correcting page_stats
+
+    A sampled page whose text differs from its emitted stats by more than half (and 20 characters) counts as a
+    mismatch; its stats are replaced by what was read back.
+    """
+    unknown = [page_num for page_num, stats in enumerate(page_stats) if stats is None]
+    known = [page_num for page_num, stats in enumerate(page_stats) if stats is not None]
+    sampled = random.sample(known, min(max(0, sample), len(known)))
+    mismatched = []
+    try:
+        if unknown or sampled:
+            with fitz.open(pdf_path) as doc:
+                for page_num in sorted(unknown + sampled):
+                    text = doc[page_num].get_text().strip()
+                    found = {"characters": len(text), "words": len(text.split())}
+                    stats = page_stats[page_num]
+                    if stats is None:
+                        page_stats[page_num] = {"source": "pdf", **found, "mean_confidence": None}
+                    elif abs(found["characters"] - stats["characters"]) > max(20, stats["characters"] // 2):
+                        mismatched.append(page_num + 1)
+                        page_stats[page_num] = {**stats, **found}
+    except Exception as e:
+        logger.error(f"Error verifying PDF: {str(e)}")
+    if mismatched:
+        logger.warning(f"⚠️ Text stats of page(s) {', '.join(map(str, mismatched))} did not match {pdf_path}")
+    return {"pages_read": len(unknown) + len(sampled), "pages_sampled": len(sampled), "mismatched_pages": mismatched}
+
+def job_pages_dir(job_id: str) -> Path:
+    return JOB_PAGES_DIR / job_id
+
+
+def store_job_page(job_id: str, result: dict):
+    """Persist one finished page of a job (OCR word boxes, or no data / PDF words for pages with their own text)
+
+    The running replica reads its local copy; with a remote store every page is also published there, so the
+    page, text/hOCR and partial endpoints work on other replicas while the job runs.
+    """
+    directory = job_pages_dir(job_id)
+    try:
+        directory.mkdir()
+        storage_index.track(directory, "job_pages")
+        if storage.remote:
+            storage_index.track(storage.locator("job_pages", job_id), "job_pages")
+    except FileExistsError:
+        pass
+    path = directory / f"{result['page']:05d}.json"
+    temp_path = path.with_suffix(".tmp")
+    with open(temp_path, "w") as f:
+        json.dump({key: result.get(key) for key in ("page", "zoom", "width", "height", "data", "pdf_words")}, f)
+    os.replace(temp_path, path)
+    if storage.remote:
+        storage.publish("job_pages", f"{job_id}/{path.name}", str(path), keep=True)
+
+
+def load_job_page(job_id: str, page_num: int) -> Optional[dict]:
+    name = f"{page_num:05d}.json"
+    try:
+        with open(job_pages_dir(job_id) / name) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        if not storage.remote:
+            return None
+    try:
+        return json.loads(storage.read_bytes("job_pages", f"{job_id}/{name}"))
+    except (OSError, ValueError):
+        return None
+
+
+def ready_job_pages(job_id: str) -> set[int]:
+    """0-based pages of an incremental job that are finished"""
+    names = storage.list("job_pages", f"{job_id}/") if storage.remote else []
+    directory = job_pages_dir(job_id)
+    if directory.exists():
+        names += [path.name for path in directory.glob("*.json")]
+    return {int(PurePosixPath(name).stem) for name in names if name.endswith(".json")}
+
+
+def remove_job_pages(job_id: str):
+    shutil.rmtree(job_pages_dir(job_id), ignore_errors=True)
+    if storage.remote:
+        try:
+            storage.delete("job_pages", job_id)
+        except Exception as e:
+            logger.warning(f"Could not remove stored pages of {job_id}: {e}")
+
+
+def job_input_path(job: dict) -> str:
+    """Local path of a job's upload, fetched from the store when another replica received it"""
+    path = job["input_path"]
+    if not os.path.exists(path):
+        storage.materialize("uploads", os.path.basename(path), path)
+        storage_index.track(path, "uploads")
+    return path
+
+
+def pdf_page_lines(page) -> list[list[dict]]:
+    """Words of a PDF page that already has text, grouped into lines like group_ocr_lines (in points)"""
+    return pdf_word_lines(page.get_text("words", sort=True))
+
+
+def pdf_word_lines(pdf_words: list) -> list[list[dict]]:
+    """Group PyMuPDF word tuples (x0, y0, x1, y1, text, block, line, word) into lines"""
+    lines = {}
+    for x0, y0, x1, y1, text, block_num, line_num, _ in pdf_words:
+        lines.setdefault((block_num, line_num), []).append({
+            "text": text, "left": x0, "top": y0, "width": x1 - x0, "height": y1 - y0, "conf": 100.0
+        })
+    return list(lines.values())
+
+
+def lines_to_text(lines: list[list[dict]]) -> str:
+    return "\n".join(" ".join(word["text"] for word in words) for words in lines)
+
+
+HOCR_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" '
+    '"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n'
+    '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">\n'
+    ' <head>\n'
+    '  <title></title>\n'
+    '  <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>\n'
+    '  <meta name="ocr-system" content="pdf-ocr-service"/>\n'
+    "  <meta name='ocr-capabilities' content='ocr_page ocr_line ocrx_word'/>\n"
+    ' </head>\n'
+    ' <body>\n'
+)
+HOCR_FOOTER = ' </body>\n</html>\n'
+
+
+def hocr_page(page_num: int, width: float, height: float, dpi: int, lines: list[list[dict]]) -> str:
+    """hOCR ocr_page element for one page; boxes are in pixels at dpi (72 for words taken from the PDF itself)"""
+    def bbox(left, top, right, bottom):
+        return f"bbox {int(round(left))} {int(round(top))} {int(round(right))} {int(round(bottom))}"
+    
+    page_id = page_num + 1
+    body = []
+    for line_index, words in enumerate(lines, start=1):
+        line_box = bbox(min(w["left"] for w in words), min(w["top"] for w in words),
+                        max(w["left"] + w["width"] for w in words), max(w["top"] + w["height"] for w in words))
+        spans = [
+            f"<span class='ocrx_word' id='word_{page_id}_{line_index}_{word_index}' "
+            f"title='{bbox(w['left'], w['top'], w['left'] + w['width'], w['top'] + w['height'])}; "
+            f"x_wconf {int(round(w['conf']))}'>{html.escape(w['text'])}</span>"
+            for word_index, w in enumerate(words, start=1)
+        ]
+        body.append(f"   <span class='ocr_line' id='line_{page_id}_{line_index}' title='{line_box}'>"
+                    + " ".join(spans) + "</span>")
+    return (
+        f"  <div class='ocr_page' id='page_{page_id}' "
+        f"title='{bbox(0, 0, width, height)}; ppageno {page_num}; scan_res {dpi} {dpi}'>\n"
+        + "".join(line + "\n" for line in body)
+        + '  </div>\n'
+    )
+
+
+def build_hocr(page_num: int, width: float, height: float, dpi: int, lines: list[list[dict]]) -> str:
+    """hOCR document for one page"""
+    return HOCR_HEADER + hocr_page(page_num, width, height, dpi, lines) + HOCR_FOOTER
+
+
+def job_page_content(job: dict, page_num: int) -> Optional[dict]:
+    """Text lines of one job page once it is done: from the output PDF, or the page store while running"""
+    pdf_output = (job["output_format"] or "pdf") == "pdf"
+    if job["state"] == "completed" and pdf_output:
+        doc = open_stored_pdf("outputs", os.path.basename(job["output_path"]))
+    else:
+        stored = load_job_page(job["job_id"], page_num) if job["incremental"] or not pdf_output else None
+        if stored is None:
+            return None
+        if stored["data"] is not None:
+            lines = group_ocr_lines(stored["data"])
+            return {"lines": lines, "text": lines_to_text(lines), "width": stored["width"],
+                    "height": stored["height"], "dpi": int(round(stored["zoom"] * 72))}
+        if stored.get("pdf_words") is not None:
+            lines = pdf_word_lines(stored["pdf_words"])
+            return {"lines": lines, "text": lines_to_text(lines), "width": stored["width"],
+                    "height": stored["height"], "dpi": 72}
+        doc = fitz.open(job_input_path(job))
+    
+    with doc:
+        page = doc[page_num]
+        return {"lines": pdf_page_lines(page), "text": page.get_text(), "width": page.rect.width,
+                "height": page.rect.height, "dpi": 72}
+
+
+def assemble_partial_pdf(job: dict) -> tuple[bytes, int]:
+    """Searchable PDF of the leading run of finished pages of an incremental job, and how many pages it holds"""
+    ready = ready_job_pages(job["job_id"])
+    pages_ready = 0
+    while pages_ready in ready:
+        pages_ready += 1
+    if not pages_ready:
+        return b"", 0
+    
+    with fitz.open(job_input_path(job)) as doc:
+        if pages_ready < len(doc):
+            doc.select(list(range(pages_ready)))
+        for page_num in range(pages_ready):
+            stored = load_job_page(job["job_id"], page_num)
+            if stored and stored["data"] is not None:
+                write_text_layer(doc, doc[page_num], stored)
+        # Cheap save: this is rebuilt on every request while the job runs
+        return doc.tobytes(garbage=1, deflate=True), pages_ready
+
+
+# Output formats other than pdf skip PDF assembly: pages go to the page store and are rendered from there
+OUTPUT_FORMATS = {
+    "pdf": {"media_type": "application/pdf", "extension": "pdf"},
+    "text": {"media_type": "text/plain", "extension": "txt"},
+    "hocr": {"media_type": "application/xhtml+xml", "extension": "hocr"},
+    "json": {"media_type": "application/x-ndjson", "extension": "ndjson"}
+}
+
+
+def ocr_data_words(data: dict) -> list[dict]:
+    """Every recognized word of a pytesseract.image_to_data result, with its box (pixels) and confidence"""
+    words = []
+    for i in range(len(data.get("text", []))):
+        text = str(data["text"][i]).strip()
+        if not text:
+            continue
+        words.append({
+            "text": text, "left": data["left"][i], "top": data["top"][i], "width": data["width"][i],
+            "height": data["height"][i], "conf": float(data["conf"][i]), "block": data["block_num"][i],
+            "par": data["par_num"][i], "line": data["line_num"][i], "word": data["word_num"][i]
+        })
+    return words
+
+
+def render_page_output(output_format: str, stored: dict) -> str:
+    """One page of a text, hOCR or NDJSON document from its page store record"""
+    page_num = stored["page"]
+    width, height = stored["width"], stored["height"]
+    if stored["data"] is not None:
+        source, dpi = "ocr", int(round(stored["zoom"] * 72))
+        lines = group_ocr_lines(stored["data"])
+    else:
+        # Pages with their own text (or failed pages) carry PDF words in points
+        source, dpi = "pdf", 72
+        lines = pdf_word_lines(stored.get("pdf_words") or [])
+    
+    if output_format == "text":
+        # Form feed between pages, as tesseract's own text output does
+        return lines_to_text(lines) + "\n\f"
+    if output_format == "hocr":
+        return hocr_page(page_num, width, height, dpi, lines)
+    
+    if source == "ocr":
+        words = ocr_data_words(stored["data"])
+    else:
+        words = [{"text": text, "left": round(x0, 2), "top": round(y0, 2), "width": round(x1 - x0, 2),
+                  "height": round(y1 - y0, 2), "conf": None, "block": block_num, "par": 0, "line": line_num,
+                  "word": word_num}
+                 for x0, y0, x1, y1, text, block_num, line_num, word_num in stored.get("pdf_words") or []]
+    return json.dumps({"page": page_num + 1, "source": source, "dpi": dpi, "width": width, "height": height,
+                       "words": words}) + "\n"
+
+
+def output_header(output_format: str) -> str:
+    return HOCR_HEADER if output_format == "hocr" else ""
+
+
+def output_footer(output_format: str) -> str:
+    return HOCR_FOOTER if output_format == "hocr" else ""
+
+
+def extract_pages(input_pdf_path: str, pages_key: str,
+                  progress: Optional[Callable[[int, int], None]] = None,
+                  on_event: Optional[Callable[..., None]] = None,
+                  lang: str = OCR_LANGUAGE) -> dict:
+    """Recognize every page into the page store under pages_key, without building or saving a PDF"""
+    started = time.monotonic()
+    pages = inspect_pages(input_pdf_path)
+    page_kinds = [info["kind"] for info in pages]
+    if on_event:
+        on_event("classify", "completed", seconds=round(time.monotonic() - started, 3),
+                 pages_total=len(page_kinds), **summarize_page_kinds(page_kinds))
+    lang = resolve_language(lang, input_pdf_path, page_kinds, on_event)
+    
+    # Pages that keep their own text are ready straight away
+    with fitz.open(input_pdf_path) as doc:
+        for page_num, kind in enumerate(page_kinds):
+            if kind != "scanned":
+                page = doc[page_num]
+                store_job_page(pages_key, {
+                    **_empty_page_result(page_num, None), "width": page.rect.width, "height": page.rect.height,
+                    "pdf_words": [list(word) for word in page.get_text("words", sort=True)]
+                })
+    
+    report_page = page_event_reporter(on_event)
+    
+    def on_page(result: dict):
+        store_job_page(pages_key, result)
+        if report_page:
+            report_page(result)
+    
+    if on_event:
+        on_event("ocr", "started", strategy="Page engine", pages=page_kinds.count("scanned"))
+    started = time.monotonic()
+    page_results = ocr_pages(input_pdf_path, lang=lang, progress=progress, page_kinds=page_kinds, on_page=on_page)
+    if on_event:
+        on_event("ocr", "completed", strategy="Page engine", seconds=round(time.monotonic() - started, 3))
+    
+    failed = sum(1 for page_result in page_results if page_result["error"])
+    message = "Success using page engine" + (f" ({failed} page(s) failed)" if failed else "")
+    text_stats = pdf_text_stats(pages)
+    for page_result in page_results:
+        record_page_stats(text_stats, page_result)
+    page_stats = [text_stats.get(page_num) for page_num in range(len(page_kinds))]
+    DOCUMENTS_PROCESSED.labels("success").inc()
+    return {"success": True, "message": message, "pages_total": len(page_kinds), "language": lang,
+            "page_classification": summarize_page_kinds(page_kinds), **summarize_text_stats(page_stats),
+            "pages": [{"page": page_num + 1, **(stats or {})} for page_num, stats in enumerate(page_stats)]}
+
+
+def write_document_output(output_format: str, pages_key: str, pages_total: int, output_path: str) -> int:
+    """Concatenate the stored pages into a text, hOCR or NDJSON file and return its character count"""
+    characters = 0
+    temp_path = f"{output_path}.tmp"
+    with stage("output", format=output_format), open(temp_path, "w", encoding="utf-8") as f:
+        f.write(output_header(output_format))
+        for page_num in range(pages_total):
+            stored = load_job_page(pages_key, page_num) or {
+                **_empty_page_result(page_num, None), "pdf_words": []
+            }
+            chunk = render_page_output(output_format, stored)
+            characters += len(chunk)
+            f.write(chunk)
+        f.write(output_footer(output_format))
+    os.replace(temp_path, output_path)
+    return characters
+
+
+async def stream_document_output(output_format: str, pages_key: str, pages_total: int,
+                                 is_finished: Callable[[], bool]):
+    """Yield a text, hOCR or NDJSON document page by page, waiting for each page to reach the page store"""
+    yield output_header(output_format)
+    for page_num in range(pages_total):
+        while True:
+            stored = await asyncio.to_thread(load_job_page, pages_key, page_num)
+            if stored is not None:
+                break
+            if await asyncio.to_thread(is_finished):
+                # Re-check: the page may have been stored just before processing ended
+                stored = await asyncio.to_thread(load_job_page, pages_key, page_num)
+                if stored is None:
+                    logger.warning(f"Output of {pages_key} ended before page {page_num + 1}")
+                    if output_format == "json":
+                        yield json.dumps({"page": page_num + 1, "error": "Processing ended before this page"}) + "\n"
+                    return
+                break
+            await asyncio.sleep(JOB_EVENT_POLL_INTERVAL)
+        yield render_page_output(output_format, stored)
+    yield output_footer(output_format)
+
+
+def process_pdf(input_pdf_path: str, output_pdf_path: str,
+                progress: Optional[Callable[[int, int], None]] = None,
+                on_event: Optional[Callable[..., None]] = None,
+                page_sink: Optional[Callable[[dict], None]] = None,
+                lang: str = OCR_LANGUAGE) -> dict:
+    """Run the full OCR pipeline (strategy chain, fallback, verification) for one document
+
+    With a page_sink the page engine is used directly and every page is handed to the sink as soon as it is
+    ready (pages that keep their own text immediately), so it can be served before the document is done.
+    """
+    started = time.monotonic()
+    pages = inspect_pages(input_pdf_path)
+    page_kinds = [info["kind"] for info in pages]
+    if on_event:
+        on_event("classify", "completed", seconds=round(time.monotonic() - started, 3),
+                 pages_total=len(page_kinds), **summarize_page_kinds(page_kinds))
+    lang = resolve_language(lang, input_pdf_path, page_kinds, on_event)
+    
+    # Per-page text stats as the writers produce them; pages left without stats are read back from the output
+    text_stats = pdf_text_stats(pages)
+    if page_sink:
+        for page_num, kind in enumerate(page_kinds):
+            if kind != "scanned":
+                page_sink(_empty_page_result(page_num, None))
+        success, message = create_invisible_text_layer(input_pdf_path, output_pdf_path, progress, page_kinds,
+                                                       on_event, page_sink, lang, text_stats)
+    else:
+        success, message = create_searchable_pdf_with_ocrmypdf(input_pdf_path, output_pdf_path, page_kinds,
+                                                               on_event, lang, text_stats)
+
+    if not success and not page_sink:
+        logger.info("Trying pure text layer method...")
+        text_stats = pdf_text_stats(pages)
+        success, message = create_invisible_text_layer(input_pdf_path, output_pdf_path, progress, page_kinds,
+                                                       on_event, lang=lang, text_stats=text_stats)
+
+    result = {"success": success, "message": message, "has_selectable_text": False, "character_count": 0,
+              "word_count": 0, "mean_confidence": None, "pages_total": len(page_kinds), "language": lang,
+              "page_classification": summarize_page_kinds(page_kinds), "pages": [], "verification": None}
+    if success and os.path.exists(output_pdf_path):
+        started = time.monotonic()
+        page_stats = [text_stats.get(page_num) for page_num in range(len(page_kinds))]
+        with stage("verify"):
+            verification = verify_text_stats(output_pdf_path, page_stats)
+        result.update(summarize_text_stats(page_stats), verification=verification,
+                      pages=[{"page": page_num + 1, **(stats or {})} for page_num, stats in enumerate(page_stats)])
+        result["has_selectable_text"] = result["character_count"] > 50
+        logger.info(f"📝 Text layer: {result['character_count']} characters, {result['word_count']} words, "
+                    f"{verification['pages_read']} page(s) read back")
+        if on_event:
+            on_event("verify", "completed", seconds=round(time.monotonic() - started, 3),
+                     has_selectable_text=result["has_selectable_text"], character_count=result["character_count"],
+                     word_count=result["word_count"], mean_confidence=result["mean_confidence"], **verification)
+
+    DOCUMENTS_PROCESSED.labels("success" if success else "failed").inc()
+    return result
+
+BATCH_ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def batch_member_name(name: str) -> str:
+    """Archive member path made safe to reuse inside the results archive"""
+    parts = [part for part in PurePosixPath(name.replace("\\", "/")).parts if part not in ("", ".", "..", "/")]
+    return "/".join(parts) or "document.pdf"
+
+
+def expand_batch_upload(batch_dir: Path, files: list[dict]) -> list[dict]:
+    """Turn uploaded PDFs and ZIP/tar archives into numbered PDFs in batch_dir, listed in batch.json
+
+    Archive members are copied to numbered files, never extracted by name, and are bounded by MAX_FILE_SIZE
+    each, MAX_BATCH_SIZE together and MAX_BATCH_FILES in number.
+    """
+    documents = []
+    total = 0
+    
+    def add_document(name: str, source, size: int):
+        nonlocal total
+        if len(documents) >= MAX_BATCH_FILES:
+            raise HTTPException(status_code=413, detail=f"A batch may contain at most {MAX_BATCH_FILES} PDFs")
+        if size > MAX_FILE_SIZE or total + size > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=413, detail=f"{name} exceeds the batch size limits")
+        path = batch_dir / f"{len(documents):05d}.pdf"
+        with open(path, "wb") as out:
+            # Declared sizes can lie; stop copying at the limit
+            copied = 0
+            while chunk := source.read(1024 * 1024):
+                copied += len(chunk)
+                if copied > MAX_FILE_SIZE:
+                    raise HTTPException(status_code=413, detail=f"{name} exceeds the batch size limits")
+                out.write(chunk)
+        total += copied
+        documents.append({"index": len(documents), "name": batch_member_name(name), "path": str(path),
+                          "size": copied})
+    
+    for file in files:
+        lower_name = file["filename"].lower()
+        try:
+            if lower_name.endswith(".pdf"):
+                with open(file["path"], "rb") as source:
+                    add_document(file["filename"], source, file["size"])
+            elif lower_name.endswith(".zip"):
+                with zipfile.ZipFile(file["path"]) as archive:
+                    for member in archive.infolist():
+                        if member.is_dir() or not member.filename.lower().endswith(".pdf") \
+                                or member.filename.startswith("__MACOSX/"):
+                            continue
+                        with archive.open(member) as source:
+                            add_document(member.filename, source, member.file_size)
+            else:
+                with tarfile.open(file["path"]) as archive:
+                    for member in archive:
+                        if not member.isfile() or not member.name.lower().endswith(".pdf"):
+                            continue
+                        with archive.extractfile(member) as source:
+                            add_document(member.name, source, member.size)
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise HTTPException(status_code=400, detail=f"Could not read archive {file['filename']}: {e}")
+        finally:
+            try:
+                os.remove(file["path"])
+            except FileNotFoundError:
+                pass
+    
+    with open(batch_dir / "batch.json", "w") as f:
+        json.dump(documents, f)
+    return documents
+
+
+def batch_manifest_path(batch_id: str) -> Path:
+    return OUTPUT_DIR / f"{batch_id}_manifest.json"
+
+
+def _write_json_atomic(path: Path, data):
+    temp_path = path.with_suffix(".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def batch_throughput(documents: list[dict], seconds: float) -> dict:
+    """Batch-level counts and throughput: pages/sec and docs/sec over the processing time so far"""
+    finished = [document for document in documents if document["status"] in ("completed", "failed")]
+    pages_done = sum(document["pages"] for document in finished)
+    return {
+        "documents": len(documents),
+        "documents_completed": sum(1 for document in documents if document["status"] == "completed"),
+        "documents_failed": sum(1 for document in documents if document["status"] == "failed"),
+        "pages_done": pages_done,
+        "seconds": round(seconds, 3),
+        "pages_per_second": round(pages_done / seconds, 2) if seconds > 0 else 0.0,
+        "documents_per_second": round(len(finished) / seconds, 2) if seconds > 0 else 0.0
+    }
+
+
+def assemble_batch_document(document: dict, page_results: dict[int, dict], page_count: int,
+                            output_format: str, output_path: str, page_stats: list[Optional[dict]]) -> int:
+    """Write one batch document's output from its page engine results and return its character count
+
+    For PDFs the count comes from page_stats, the emitted text stats of every page, instead of reading it back.
+    """
+    if output_format == "pdf":
+        ocr_results = [result for result in page_results.values() if result["data"] is not None]
+        if not ocr_results:
+            # Every page already has its text
+            _link_or_copy(document["path"], output_path)
+        else:
+            with fitz.open(document["path"]) as doc:
+                with stage("text_layer"):
+                    for result in ocr_results:
+                        write_text_layer(doc, doc[result["page"]], result)
+                with stage("save"):
+                    doc.save(output_path, garbage=3, deflate=True)
+        return summarize_text_stats(page_stats)["character_count"]
+    
+    chunks = [output_header(output_format)]
+    with fitz.open(document["path"]) as doc:
+        for page_num in range(page_count):
+            stored = page_results.get(page_num)
+            if stored is None or stored["data"] is None:
+                page = doc[page_num]
+                stored = {**_empty_page_result(page_num, None), "width": page.rect.width,
+                          "height": page.rect.height,
+                          "pdf_words": [list(word) for word in page.get_text("words", sort=True)]}
+            chunks.append(render_page_output(output_format, stored))
+    chunks.append(output_footer(output_format))
+    content = "".join(chunks)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return len(content)
+
+
+def process_batch(batch_id: str, batch_dir: str, output_path: str, output_format: str,
+                  progress: Optional[Callable[[int, int], None]] = None,
+                  on_event: Optional[Callable[..., None]] = None,
+                  lang: str = OCR_LANGUAGE) -> dict:
+    """OCR every document of a batch as one unit of work and pack the outputs and a manifest into a ZIP
+
+    The scanned pages of all documents are sharded onto the page pool together, so many small PDFs keep every
+    worker busy instead of running one strategy chain per file. Each document is assembled as soon as its last
+    shard is back; the manifest in the store is updated as documents finish. With lang "auto" every document
+    gets its own detected models, and the shards are run per language.
+    """
+    started = time.monotonic()
+    with open(Path(batch_dir) / "batch.json") as f:
+        documents = json.load(f)
+    out_dir = Path(batch_dir) / "out"
+    out_dir.mkdir(exist_ok=True)
+    extension = OUTPUT_FORMATS[output_format]["extension"]
+    
+    entries = [{"name": document["name"], "status": "queued", "pages": 0, "pages_ocr": 0, "pages_failed": 0,
+                "character_count": 0, "word_count": 0, "mean_confidence": None, "language": None, "output": None,
+                "error": None} for document in documents]
+    page_kinds, pdf_stats = {}, {}
+    for document, entry in zip(documents, entries):
+        try:
+            pages = inspect_pages(document["path"])
+            page_kinds[document["index"]] = [info["kind"] for info in pages]
+            pdf_stats[document["index"]] = pdf_text_stats(pages)
+            entry["pages"] = len(pages)
+            entry["language"] = resolve_language(lang, document["path"], page_kinds[document["index"]])
+        except Exception as e:
+            entry.update(status="failed", error=f"Could not read PDF: {e}")
+    pages_total = sum(entry["pages"] for entry in entries)
+    if on_event:
+        on_event("classify", "completed", seconds=round(time.monotonic() - started, 3), documents=len(documents),
+                 pages_total=pages_total)
+    
+    manifest_path = batch_manifest_path(batch_id)
+    manifest_written = 0.0
+    
+    def write_manifest(force: bool = False):
+        nonlocal manifest_written
+        # Rewritten at most once a second: batches can hold thousands of documents
+        if not force and time.monotonic() - manifest_written < 1.0:
+            return
+        _write_json_atomic(manifest_path, {"output_format": output_format, "pages_total": pages_total,
+                                           "stats": batch_throughput(entries, time.monotonic() - started),
+                                           "documents": entries})
+        # Other replicas answer GET /batches/{id} from the store
+        storage.publish("outputs", manifest_path.name, str(manifest_path), keep=True)
+        manifest_written = time.monotonic()
+    
+    # Contiguous per-document shards; small documents are one shard each
+    shards, shard_documents, remaining, page_results = [], [], {}, {}
+    for index, kinds in page_kinds.items():
+        to_ocr = [page_num for page_num, kind in enumerate(kinds) if kind == "scanned"]
+        remaining[index] = 0
+        page_results[index] = {}
+        for start in range(0, len(to_ocr), max(1, OCR_PAGE_CHUNK)):
+            shards.append((documents[index]["path"], to_ocr[start:start + OCR_PAGE_CHUNK]))
+            shard_documents.append(index)
+            remaining[index] += 1
+    
+    pages_done = 0
+    
+    def finish_document(index: int):
+        nonlocal pages_done
+        entry = entries[index]
+        results = page_results.pop(index)
+        entry["pages_ocr"] = sum(1 for result in results.values() if result["data"] is not None)
+        entry["pages_failed"] = sum(1 for result in results.values() if result["error"])
+        output_file = out_dir / f"{index:05d}.{extension}"
+        text_stats = pdf_stats.pop(index)
+        for result in results.values():
+            record_page_stats(text_stats, result)
+        page_stats = [text_stats.get(page_num) for page_num in range(entry["pages"])]
+        try:
+            entry["character_count"] = assemble_batch_document(documents[index], results, entry["pages"],
+                                                               output_format, str(output_file), page_stats)
+            text_summary = summarize_text_stats(page_stats)
+            entry.update(word_count=text_summary["word_count"], mean_confidence=text_summary["mean_confidence"])
+            entry.update(status="completed", output=str(PurePosixPath(entry["name"]).with_suffix(f".{extension}")))
+        except Exception as e:
+            logger.warning(f"Batch {batch_id}: {entry['name']} failed: {e}")
+            entry.update(status="failed", error=str(e))
+        DOCUMENTS_PROCESSED.labels(entry["status"] if entry["status"] == "failed" else "success").inc()
+        pages_done += entry["pages"] - len(results)
+        if progress:
+            progress(pages_done, pages_total)
+        if on_event:
+            on_event("document", entry["status"], name=entry["name"], pages=entry["pages"],
+                     pages_ocr=entry["pages_ocr"], error=entry["error"])
+        write_manifest()
+    
+    def on_results(shard_index: int, shard_results: list[dict]):
+        nonlocal pages_done
+        index = shard_documents[shard_index]
+        for result in shard_results:
+            page_results[index][result["page"]] = result
+        # Account each shard as it arrives so finished documents hold no page results until the batch ends
+        record_page_results(shard_results)
+        pages_done += len(shard_results)
+        remaining[index] -= 1
+        if remaining[index] == 0:
+            finish_document(index)
+        elif progress:
+            progress(pages_done, pages_total)
+    
+    write_manifest(force=True)
+    for index in [index for index, count in remaining.items() if count == 0]:
+        finish_document(index)
+    if on_event:
+        on_event("ocr", "started", strategy="Page engine", pages=sum(len(pages) for _, pages in shards))
+    ocr_started = time.monotonic()
+    with stage("page_engine", pages=sum(len(pages) for _, pages in shards)):
+        shard_languages = [entries[index]["language"] for index in shard_documents]
+        for language in dict.fromkeys(shard_languages):
+            indices = [shard_index for shard_index, shard_language in enumerate(shard_languages)
+                       if shard_language == language]
+            run_page_shards([shards[shard_index] for shard_index in indices], OCR_DPI, OCR_PREPROCESS, language,
+                            "--oem 3 --psm 6",
+                            lambda group_index, results, indices=indices: on_results(indices[group_index], results))
+    if on_event:
+        on_event("ocr", "completed", strategy="Page engine", seconds=round(time.monotonic() - ocr_started, 3))
+    
+    # Results archive: every output under its original name (numbered on clashes) plus the manifest
+    temp_path = f"{output_path}.tmp"
+    used_names = set()
+    with zipfile.ZipFile(temp_path, "w") as archive:
+        for index, entry in enumerate(entries):
+            if entry["status"] != "completed":
                 continue
-        
-        return False, "All OCR strategies failed"
-            
-    except Exception as e:
-        error_msg = f"Error running OCRmyPDF: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-def create_invisible_text_layer(input_pdf_path: str, output_pdf_path: str) -> tuple[bool, str]:
-    """Create invisible text layer using PDF content streams"""
-    import fitz
+            if entry["output"] in used_names:
+                entry["output"] = f"{index:05d}_{entry['output']}"
+            used_names.add(entry["output"])
+            archive.write(out_dir / f"{index:05d}.{extension}", entry["output"],
+                          compress_type=zipfile.ZIP_STORED if output_format == "pdf" else zipfile.ZIP_DEFLATED)
+        write_manifest(force=True)
+        archive.write(manifest_path, "manifest.json", compress_type=zipfile.ZIP_DEFLATED)
+    os.replace(temp_path, output_path)
+    
+    stats = batch_throughput(entries, time.monotonic() - started)
+    logger.info(f"📦 Batch {batch_id}: {stats['documents_completed']}/{stats['documents']} documents, "
+                f"{stats['pages_per_second']} pages/s, {stats['documents_per_second']} docs/s")
+    return {
+        "success": stats["documents_completed"] > 0,
+        "message": f"{stats['documents_completed']} of {stats['documents']} documents processed"
+                   + (f", {stats['documents_failed']} failed" if stats["documents_failed"] else ""),
+        "has_selectable_text": any(entry["character_count"] for entry in entries),
+        "character_count": sum(entry["character_count"] for entry in entries),
+        "pages_total": pages_total,
+        "stats": stats
+    }
+
+
+def cached_result_meta(result: dict) -> dict:
+    """Metadata stored next to a cached PDF so a hit can answer without reopening it"""
+    return {
+        "message": result["message"],
+        "has_selectable_text": result["has_selectable_text"],
+        "character_count": result["character_count"],
+        "word_count": result.get("word_count"),
+        "mean_confidence": result.get("mean_confidence"),
+        "pages_total": result["pages_total"],
+        "pages": result.get("pages", [])
+    }
+
+def run_ocr_job(job_id: str) -> dict:
+    """Process one queued job, recording progress and the outcome in the job store"""
+    with traced_document(job_id, "job"):
+        return _run_ocr_job(job_id)
+
+def _run_ocr_job(job_id: str) -> dict:
+    job = job_store.get(job_id)
+    if job is None:
+        logger.error(f"Job {job_id} not found")
+        return {"success": False, "message": "Job not found"}
+    
+    started_at = job["started_at"] or time.time()
+    QUEUE_WAIT_SECONDS.labels("jobs").observe(max(0.0, started_at - job["created_at"]))
+    trace = current_trace()
+    if trace is not None:
+        trace.add("queue", job["created_at"], max(0.0, started_at - job["created_at"]))
+    job_store.update(job_id, state="running", worker=job["worker"] or INSTANCE_ID, started_at=started_at)
+    job_store.add_event(job_id, "job", "started", worker=INSTANCE_ID,
+                        queue_seconds=round(max(0.0, started_at - job["created_at"]), 3))
+    
+    def report_progress(pages_done: int, pages_total: int):
+        job_store.update(job_id, pages_done=pages_done, pages_total=pages_total)
+    
+    def report_event(stage: str, status: str, **data):
+        job_store.add_event(job_id, stage, status, **data)
     
-    doc = None
     try:
-        doc = fitz.open(input_pdf_path)
+        # Queued on another replica: fetch the upload from the store
+        storage.materialize("uploads", os.path.basename(job["input_path"]), job["input_path"])
+        if job["batch"]:
+            pages_total = count_pdf_pages(job["input_path"])
+        else:
+            with fitz.open(job["input_path"]) as doc:
+                pages_total = len(doc)
+        report_progress(0, pages_total)
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            existing_text = page.get_text().strip()
-            
-            if not existing_text or len(existing_text) < 50:
-                # Get OCR data
-                mat = fitz.Matrix(3.0, 3.0)
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
-                image = Image.open(io.BytesIO(img_data)).convert('RGB')
-                
-                ocr_data = pytesseract.image_to_data(
-                    image, 
-                    lang='eng', 
-                    config='--oem 3 --psm 6',
-                    output_type=pytesseract.Output.DICT
-                )
-                
-                # Build invisible text content stream
-                img_w, img_h = image.size
-                pdf_rect = page.rect
-                x_scale = pdf_rect.width / (img_w / 3.0)
-                y_scale = pdf_rect.height / (img_h / 3.0)
-                
-                # Create content stream for invisible text
-                content_stream = []
-                content_stream.append("BT")  # Begin text
-                content_stream.append("3 Tr")  # Set rendering mode to invisible (3)
-                content_stream.append("/Helv 12 Tf")  # Set font
-                
-                n_boxes = len(ocr_data['level'])
-                for i in range(n_boxes):
-                    text = ocr_data['text'][i].strip()
-                    confidence = int(ocr_data['conf'][i]) if ocr_data['conf'][i] != '-1' else 0
-                    
-                    if text and confidence > 40:
-                        (x, y, w, h) = (
-                            ocr_data['left'][i], 
-                            ocr_data['top'][i], 
-                            ocr_data['width'][i], 
-                            ocr_data['height'][i]
-                        )
-                        
-                        # Calculate PDF coordinates
-                        pdf_x = x * x_scale
-                        pdf_y = pdf_rect.height - (y * y_scale)  # Flip Y coordinate
-                        font_size = max(min(h * y_scale * 0.85, 72), 4)
-                        
-                        # Add text positioning and content
-                        content_stream.append(f"{font_size} TL")  # Set leading
-                        content_stream.append(f"{pdf_x} {pdf_y} Td")  # Move to position
-                        content_stream.append(f"({text}) Tj")  # Show text
-                
-                content_stream.append("ET")  # End text
-                
-                # Insert the invisible text stream
-                text_content = "\n".join(content_stream)
-                
-                try:
-                    # Insert the content stream into the page
-                    page.wrap_contents()
-                    new_content = page.read_contents().decode('utf-8', errors='ignore')
-                    new_content += "\n" + text_content
-                    page.set_contents(new_content.encode('utf-8'))
-                    
-                except Exception as stream_error:
-                    logger.warning(f"Content stream insertion failed: {stream_error}")
-                    continue
+        output_format = job["output_format"] or "pdf"
+        lang = job["language"] or OCR_LANGUAGE
+        if job["batch"]:
+            result = process_batch(job_id, job["input_path"], job["output_path"], output_format,
+                                   report_progress, report_event, lang)
+            pages_total = result["pages_total"]
+        elif output_format != "pdf":
+            result = extract_pages(job["input_path"], job_id, report_progress, report_event, lang)
+            started = time.monotonic()
+            result["character_count"] = write_document_output(output_format, job_id, pages_total, job["output_path"])
+            result["has_selectable_text"] = result["character_count"] > 0
+            report_event("output", "completed", format=output_format, seconds=round(time.monotonic() - started, 3),
+                         bytes=os.path.getsize(job["output_path"]))
+        else:
+            page_sink = (lambda page_result: store_job_page(job_id, page_result)) if job["incremental"] else None
+            result = process_pdf(job["input_path"], job["output_path"], report_progress, report_event, page_sink, lang)
         
-        doc.save(output_pdf_path, garbage=4, deflate=True, clean=True)
-        return True, "Success using invisible text layer"
+        if result["success"] and os.path.exists(job["output_path"]):
+            if job["cache_key"]:
+                result_cache.put(job["cache_key"], job["output_path"], cached_result_meta(result))
+            # Stored before the job is reported done, so any replica can serve the download
+            store_file(job["output_path"])
+            if job["batch"]:
+                store_file(batch_manifest_path(job_id))
+            job_store.update(
+                job_id, state="completed", pages_done=pages_total, message=result["message"],
+                has_selectable_text=int(result["has_selectable_text"]),
+                character_count=result["character_count"], language=result.get("language", lang),
+                finished_at=time.time()
+            )
+            logger.info(f"✅ Job {job_id} completed ({result['message']})")
+            if job["batch"]:
+                summary = {"stats": result["stats"]}
+            else:
+                summary = {"word_count": result.get("word_count"), "mean_confidence": result.get("mean_confidence"),
+                           "pages": result.get("pages", [])}
+            report_event("job", "completed", message=result["message"], seconds=round(time.time() - started_at, 3),
+                         download_url=job_download_url(job), **summary)
+        else:
+            if job["batch"] and os.path.exists(batch_manifest_path(job_id)):
+                store_file(batch_manifest_path(job_id))
+            job_store.update(job_id, state="failed", message=f"All OCR methods failed: {result['message']}",
+                             finished_at=time.time())
+            logger.warning(f"❌ Job {job_id} failed: {result['message']}")
+            report_event("job", "failed", message=f"All OCR methods failed: {result['message']}",
+                         seconds=round(time.time() - started_at, 3))
+        return result
         
     except Exception as e:
-        logger.error(f"Text layer method failed: {str(e)}")
-        return False, f"Text layer method failed: {str(e)}"
+        logger.error(f"💥 Job {job_id} crashed: {str(e)}")
+        job_store.update(job_id, state="failed", message=f"Processing failed: {str(e)}", finished_at=time.time())
+        job_store.add_event(job_id, "job", "failed", message=f"Processing failed: {str(e)}",
+                            seconds=round(time.time() - started_at, 3))
+        return {"success": False, "message": str(e)}
     finally:
-        if doc:
-            doc.close()
+        try:
+            if job["input_path"]:
+                input_name = os.path.basename(job["input_path"])
+                _remove_local(job["input_path"])
+                storage.delete("uploads", input_name)
+                storage_index.forget(job["input_path"])
+                storage_index.forget(storage.locator("uploads", input_name))
+        except:
+            pass
+        # Text, hOCR and JSON readers that started mid-run still read the page store; the storage janitor expires it
+        if (job["output_format"] or "pdf") == "pdf":
+            remove_job_pages(job_id)
 
-def create_searchable_pdf_fallback(input_pdf_path: str, output_pdf_path: str) -> tuple[bool, str]:
-    """Fallback method using PyMuPDF with completely invisible text overlays"""
-    doc = None
+if celery_app is not None:
+    celery_run_ocr_job = celery_app.task(name="pdf_ocr.run_ocr_job")(run_ocr_job)
+
+async def _run_local_job(job_id: str, pages: int):
+    """Run a claimed job on the local worker pool and free its slot and pages afterwards"""
     try:
-        logger.info("Using PyMuPDF fallback method with invisible overlays...")
-        doc = fitz.open(input_pdf_path)
-        total_pages = len(doc)
-        
-        for page_num in range(total_pages):
-            try:
-                page = doc[page_num]
-                existing_text = page.get_text().strip()
-                
-                if not existing_text or len(existing_text) < 50:
-                    # Extract text using OCR with higher DPI
-                    mat = fitz.Matrix(3.0, 3.0)  # Higher resolution for better accuracy
-                    pix = page.get_pixmap(matrix=mat)
-                    img_data = pix.tobytes("png")
-                    image = Image.open(io.BytesIO(img_data)).convert('RGB')
-                    
-                    # Get OCR data with improved settings
-                    ocr_data = pytesseract.image_to_data(
-                        image, 
-                        lang='eng', 
-                        config='--oem 3 --psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,!?:;-()[]{}"\' ',
-                        output_type=pytesseract.Output.DICT
-                    )
-                    
-                    # Calculate precise scaling factors
-                    img_w, img_h = image.size
-                    pdf_rect = page.rect
-                    x_scale = pdf_rect.width / (img_w / 3.0)  # Account for 3x matrix scaling
-                    y_scale = pdf_rect.height / (img_h / 3.0)
-                    
-                    # Create invisible text overlays
-                    n_boxes = len(ocr_data['level'])
-                    for i in range(n_boxes):
-                        text = ocr_data['text'][i].strip()
-                        confidence = int(ocr_data['conf'][i]) if ocr_data['conf'][i] != '-1' else 0
-                        
-                        if text and confidence > 40:  # Higher confidence threshold
-                            (x, y, w, h) = (
-                                ocr_data['left'][i], 
-                                ocr_data['top'][i], 
-                                ocr_data['width'][i], 
-                                ocr_data['height'][i]
-                            )
-                            
-                            # Scale coordinates to PDF space
-                            rect = fitz.Rect(
-                                x * x_scale,
-                                y * y_scale,
-                                (x + w) * x_scale,
-                                (y + h) * y_scale
-                            )
-                            
-                            # Calculate font size to match original exactly
-                            original_height = h * y_scale
-                            font_size = original_height * 0.85
-                            font_size = max(min(font_size, 72), 4)
-                            
-                            try:
-                                # Method 1: Create invisible text widget (BEST APPROACH)
-                                text_widget = fitz.Widget()
-                                text_widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
-                                text_widget.rect = rect
-                                text_widget.field_value = text
-                                text_widget.text_fontsize = font_size
-                                text_widget.fill_color = None  # No background
-                                text_widget.border_color = None  # No border
-                                text_widget.text_color = (1, 1, 1, 0)  # Completely transparent text
-                                
-                                # Add the invisible widget to the page
-                                page.add_widget(text_widget)
-                                
-                            except Exception as widget_error:
-                                try:
-                                    # Method 2: Use text annotation with invisible appearance
-                                    text_annot = page.add_text_annot(
-                                        fitz.Point(rect.x0, rect.y0), 
-                                        text
-                                    )
-                                    text_annot.set_info(content=text)
-                                    text_annot.set_rect(rect)
-                                    text_annot.set_colors({"stroke": (1, 1, 1, 0), "fill": (1, 1, 1, 0)})
-                                    text_annot.update()
-                                    
-                                except Exception as annot_error:
-                                    try:
-                                        # Method 3: Create invisible text layer using PDF operators
-                                        # Insert text with rendering mode 3 (invisible)
-                                        shape = page.new_shape()
-                                        
-                                        # Set text rendering mode to invisible (3)
-                                        shape.insert_text(
-                                            fitz.Point(rect.x0, rect.y1 - (original_height * 0.2)),
-                                            text,
-                                            fontsize=font_size,
-                                            fontname="helv",
-                                            render_mode=3  # Invisible text mode
-                                        )
-                                        
-                                        # Commit the invisible text
-                                        shape.commit()
-                                        
-                                    except Exception as shape_error:
-                                        # Method 4: Last resort - create overlay without visible text
-                                        try:
-                                            # Create a completely transparent overlay
-                                            overlay_rect = fitz.Rect(rect.x0, rect.y0, rect.x1, rect.y1)
-                                            
-                                            # Add text to document structure but make it invisible
-                                            page.insert_textbox(
-                                                overlay_rect,
-                                                text,
-                                                fontsize=font_size,
-                                                fontname="helv",
-                                                color=None,  # No color
-                                                fill=None,   # No fill
-                                                border_width=0,  # No border
-                                                align=0
-                                            )
-                                            
-                                        except:
-                                            # Skip this text if all methods fail
-                                            continue
-                                            
-            except Exception as page_error:
-                logger.warning(f"Error processing page {page_num + 1}: {str(page_error)}")
-                continue
-        
-        # Save with optimization
-        doc.save(
-            output_pdf_path, 
-            garbage=4, 
-            deflate=True, 
-            clean=True,
-            pretty=True,
-            linearize=True
-        )
-        
-        logger.info("PyMuPDF fallback completed with invisible text overlays")
-        return True, "Success using invisible text overlays"
-        
+        await ocr_pool.run(run_ocr_job, job_id)
     except Exception as e:
-        logger.error(f"Invisible overlay method failed: {str(e)}")
-        return False, f"Invisible overlay method failed: {str(e)}"
+        logger.error(f"Job {job_id} could not be run: {e}")
+        job_store.update(job_id, state="failed", message=f"Processing failed: {str(e)}", finished_at=time.time())
+        job_store.add_event(job_id, "job", "failed", message=f"Processing failed: {str(e)}")
     finally:
-        if doc:
-            doc.close()
+        ocr_pool.release(pages)
+
+async def job_dispatcher():
+    """Feed queued jobs from the shared job store to idle local workers"""
+    while True:
+        try:
+            job_id = None
+            if ocr_pool.idle_workers() > 0 and ocr_pool.try_admit():
+                job_id = await asyncio.to_thread(job_store.claim_next, INSTANCE_ID)
+                if job_id:
+                    job = await asyncio.to_thread(job_store.get, job_id)
+                    try:
+                        await asyncio.to_thread(storage.materialize, "uploads", os.path.basename(job["input_path"]),
+                                                job["input_path"])
+                    except Exception as e:
+                        # The job retries the fetch when it runs and fails with the error then
+                        logger.warning(f"Could not fetch the upload of job {job_id}: {e}")
+                    pages = await asyncio.to_thread(count_pdf_pages, job["input_path"])
+                    ocr_pool.add_pages(pages)
+                    logger.info(f"Dispatching job {job_id} ({pages} pages)")
+                    asyncio.create_task(_run_local_job(job_id, pages))
+                else:
+                    ocr_pool.release()
+            if not job_id:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job dispatcher error: {e}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
 
+def job_download_url(job: dict) -> str:
+    """Where a finished job's output is served: the PDF download, the text/hOCR/JSON result or a batch archive"""
+    if job["batch"]:
+        return f"/batches/{job['job_id']}/archive"
+    if (job["output_format"] or "pdf") == "pdf":
+        return f"/download/{job['job_id']}"
+    return f"/jobs/{job['job_id']}/result"
+
+def job_status(job: dict) -> dict:
+    """Public view of a job row"""
+    now = time.time()
+    started_at, finished_at = job["started_at"], job["finished_at"]
+    pages_total = job["pages_total"] or 0
+    status = {
+        "job_id": job["job_id"],
+        "state": job["state"],
+        "output_format": job["output_format"] or "pdf",
+        "language": job["language"] or OCR_LANGUAGE,
+        "original_filename": job["original_filename"],
+        "message": job["message"],
+        "progress": {
+            "pages_done": job["pages_done"] or 0,
+            "pages_total": pages_total,
+            "percent": round(100.0 * (job["pages_done"] or 0) / pages_total, 1) if pages_total else 0.0
+        },
+        "timing": {
+            "created_at": job["created_at"],
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "queue_seconds": round(max(0.0, (started_at or now) - job["created_at"]), 3),
+            "processing_seconds": round((finished_at or now) - started_at, 3) if started_at else 0.0
+        }
+    }
+    if job["incremental"]:
+        status["partial_url"] = f"/jobs/{job['job_id']}/partial"
+    if job["batch"]:
+        status["manifest_url"] = f"/batches/{job['job_id']}"
+    elif (job["output_format"] or "pdf") != "pdf":
+        # Streams pages as they finish while the job runs
+        status["result_url"] = f"/jobs/{job['job_id']}/result"
+    if job["state"] == "running" and (job["incremental"] or "result_url" in status):
+        status["progress"]["pages_ready"] = len(ready_job_pages(job["job_id"]))
+    if job["state"] == "completed":
+        status.update({
+            "download_url": job_download_url(job),
+            "has_selectable_text": bool(job["has_selectable_text"]),
+            "character_count": job["character_count"]
+        })
+    return status
 
-def verify_pdf_has_selectable_text(pdf_path: str) -> tuple[bool, int]:
-    """Verify that the PDF has selectable text and count characters"""
+def parse_byte_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """First and last byte of a single "bytes=" range; None (serve everything) for multiple or malformed ranges"""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, dash, last = header[len("bytes="):].strip().partition("-")
+    if not dash:
+        return None
     try:
-        doc = fitz.open(pdf_path)
-        total_chars = 0
-        
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = page.get_text().strip()
-            total_chars += len(text)
-        
-        doc.close()
-        
-        has_text = total_chars > 50
-        logger.info(f"PDF verification: {total_chars} characters found, selectable: {has_text}")
-        
-        return has_text, total_chars
-        
-    except Exception as e:
-        logger.error(f"Error verifying PDF: {str(e)}")
-        return False, 0
+        if first:
+            start = int(first)
+            end = int(last) if last else max(start, size - 1)
+            if end < start:
+                return None
+        else:
+            # Suffix range: the last n bytes
+            suffix = int(last)
+            if suffix <= 0:
+                start, end = size, size
+            else:
+                start, end = max(0, size - suffix), size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison; weak validators compare equal to their strong form"""
+    if header.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+def is_not_modified(request: Request, stat: dict) -> bool:
+    """Conditional GET: If-None-Match wins over If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, stat["etag"])
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat["modified"]) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class StoredFileResponse(StreamingResponse):
+    """Stored file body, streamed in chunks; servers offering the ASGI pathsend extension send local files themselves"""
+
+    def __init__(self, content, path: Optional[str] = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if self.path is None or "http.response.pathsend" not in scope.get("extensions", {}):
+            await super().__call__(scope, receive, send)
+            return
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.pathsend", "path": self.path})
+
+
+async def stored_file_response(request: Request, area: str, name: str, media_type: str,
+                               headers: Optional[dict] = None) -> Response:
+    """Serve a stored file from any replica with ETag/Last-Modified validators, conditional GET and byte ranges
+
+    Local files go out through the fronting nginx (X-Accel-Redirect, sendfile) when DOWNLOAD_ACCEL_PREFIX is set;
+    objects are streamed from the store in DOWNLOAD_CHUNK_SIZE pieces, fetching only the requested range.
+    """
+    stat = await asyncio.to_thread(storage.stat, area, name)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="File not found or has expired")
+    await asyncio.to_thread(storage_index.touch, storage.locator(area, name))
+    
+    validators = {"ETag": stat["etag"], "Last-Modified": formatdate(stat["modified"], usegmt=True)}
+    if is_not_modified(request, stat):
+        return Response(status_code=304, headers=validators)
+    headers = {**(headers or {}), **validators, "Accept-Ranges": "bytes"}
+    
+    local_path = storage.local_path(area, name)
+    if local_path is not None and DOWNLOAD_ACCEL_PREFIX and area == "outputs":
+        # nginx answers ranges and conditional requests for the redirected file itself
+        headers["X-Accel-Redirect"] = f"{DOWNLOAD_ACCEL_PREFIX}{name}"
+        return Response(headers=headers, media_type=media_type)
+    
+    size = stat["size"]
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    # A stale If-Range means the client's partial copy is outdated: send the whole file instead
+    if if_range is None or if_range in (stat["etag"], validators["Last-Modified"]):
+        byte_range = parse_byte_range(request.headers.get("range"), size)
+    status_code, start, end = 200, 0, size - 1
+    if byte_range is not None:
+        status_code, (start, end) = 206, byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    
+    if request.method == "HEAD" or size == 0:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StoredFileResponse(storage.iter_bytes(area, name, start, end),
+                              path=local_path if byte_range is None else None,
+                              status_code=status_code, headers=headers, media_type=media_type)
+
+# Request body schema for the streaming upload endpoints, which read the body themselves
+PDF_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}}
+                }
+            }
+        }
+    }
+}
+
+async def receive_multipart_files(request: Request, accept_file: Callable[[str], Path], max_bytes: int) -> dict:
+    """Stream every multipart "file" part to the path accept_file picks for its filename, hashing each on the way
+
+    max_bytes bounds all files together. Returns {"files": [{filename, path, size, sha256}], "fields": {...}}.
+    """
+    max_mb = max_bytes // (1024 * 1024)
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + MAX_FORM_FIELD_SIZE:
+        raise HTTPException(status_code=413, detail=f"File size must be less than {max_mb}MB")
+    
+    received = {"files": [], "fields": {}}
+    total = 0
+    part = {"headers": {}, "field": b"", "value": b"", "name": None, "file": None, "digest": None}
+    out = None
+    
+    def on_part_begin():
+        part.update(headers={}, field=b"", value=b"", name=None, file=None, digest=None)
+    
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+    
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+    
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+    
+    def on_headers_finished():
+        nonlocal out
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = disposition.get(b"name", b"").decode("utf-8", errors="replace")
+        if part["name"] == "file" and b"filename" in disposition:
+            filename = disposition[b"filename"].decode("utf-8", errors="replace")
+            path = accept_file(filename)
+            part["file"] = {"filename": filename, "path": path, "size": 0, "sha256": None}
+            part["digest"] = hashlib.sha256()
+            received["files"].append(part["file"])
+            out = open(path, "wb")
+    
+    def on_part_data(data, start, end):
+        nonlocal total
+        chunk = data[start:end]
+        if part["file"] is not None:
+            part["file"]["size"] += len(chunk)
+            total += len(chunk)
+            if total > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File size must be less than {max_mb}MB")
+            part["digest"].update(chunk)
+            out.write(chunk)
+        else:
+            part["value"] += chunk
+            if len(part["value"]) > MAX_FORM_FIELD_SIZE:
+                raise HTTPException(status_code=413, detail="Form field too large")
+    
+    def on_part_end():
+        nonlocal out
+        if part["file"] is not None:
+            out.close()
+            out = None
+            part["file"]["sha256"] = part["digest"].hexdigest()
+        elif part["name"]:
+            received["fields"][part["name"]] = part["value"].decode("utf-8", errors="replace")
+    
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+    
+    try:
+        with stage("upload"):
+            async for chunk in request.stream():
+                parser.write(chunk)
+            parser.finalize()
+    except BaseException:
+        if out is not None:
+            out.close()
+        for file in received["files"]:
+            try:
+                os.remove(file["path"])
+            except FileNotFoundError:
+                pass
+        raise
+    
+    return received
+
+async def receive_pdf_upload(request: Request, input_path: Path) -> dict:
+    """Stream the multipart "file" field to input_path, hashing it on the way and enforcing MAX_FILE_SIZE"""
+    def accept_file(filename: str) -> Path:
+        if not filename.lower().endswith('.pdf'):
+            raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+        return input_path
+    
+    received = await receive_multipart_files(request, accept_file, MAX_FILE_SIZE)
+    if not received["files"]:
+        raise HTTPException(status_code=400, detail="No PDF file found in the upload")
+    
+    file = received["files"][-1]
+    await asyncio.to_thread(storage_index.track, input_path, "uploads", size=file["size"])
+    return {"filename": file["filename"], "size": file["size"], "sha256": file["sha256"],
+            "fields": received["fields"]}
 
 @app.get("/", response_class=HTMLResponse)
 async def serve_frontend():
@@ -437,37 +3950,143 @@ async def serve_frontend():
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Frontend file not found. Please ensure static/index.html exists.")
 
-@app.post("/upload-pdf/")
-async def upload_pdf(file: UploadFile = File(...)):
-    """Upload PDF and convert to searchable PDF with perfect text selection"""
+def requested_output_format(upload: dict, input_path: Optional[Path] = None) -> str:
+    """The "format" form field of an upload (pdf by default); unknown formats are rejected"""
+    output_format = upload["fields"].get("format", "pdf").strip().lower() or "pdf"
+    if output_format not in OUTPUT_FORMATS:
+        try:
+            if input_path is not None:
+                os.remove(input_path)
+        except:
+            pass
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown output format, expected one of: {', '.join(OUTPUT_FORMATS)}")
+    return output_format
+
+def requested_language(upload: dict, input_path: Optional[Path] = None) -> str:
+    """The "lang" form field of an upload ("eng+fra", "eng,fra" or "auto"; OCR_LANGUAGE by default)"""
+    try:
+        return parse_language_spec(upload["fields"].get("lang"))
+    except ValueError as e:
+        try:
+            if input_path is not None:
+                os.remove(input_path)
+        except:
+            pass
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def admit_upload(input_path: Path) -> int:
+    """Reserve a worker slot and page budget for an uploaded PDF, or fail with 503; returns its page count"""
+    pages = await asyncio.to_thread(count_pdf_pages, str(input_path))
+    if not ocr_pool.try_admit(pages):
+        try:
+            os.remove(input_path)
+        except:
+            pass
+        raise HTTPException(
+            status_code=503,
+            detail="OCR workers are busy, please retry later",
+            headers={"Retry-After": str(OCR_RETRY_AFTER)}
+        )
+    return pages
+
+async def stream_upload_output(upload: dict, input_path: Path, file_id: str, output_format: str, lang: str):
+    """Recognize an upload without building a PDF and stream its text, hOCR or JSON output as pages finish"""
+    pages = await admit_upload(input_path)
+    task = asyncio.ensure_future(ocr_pool.run(run_traced, file_id, "upload", extract_pages, str(input_path), file_id,
+                                              None, None, lang))
+    stream_closed = False
+    
+    def on_done(finished: asyncio.Future):
+        ocr_pool.release(pages)
+        try:
+            os.remove(input_path)
+        except:
+            pass
+        if not finished.cancelled() and finished.exception() is not None:
+            logger.error(f"Error processing upload {file_id}: {finished.exception()}")
+        if stream_closed:
+            remove_job_pages(file_id)
+    
+    task.add_done_callback(on_done)
+    
+    # Fail with a proper status if nothing can be recognized; once streaming starts the status is sent
+    while not task.done() and not await asyncio.to_thread(load_job_page, file_id, 0):
+        await asyncio.sleep(JOB_EVENT_POLL_INTERVAL)
+    if task.done() and task.exception() is not None:
+        remove_job_pages(file_id)
+        raise HTTPException(status_code=500, detail=f"Processing failed: {task.exception()}")
+    
+    async def stream():
+        nonlocal stream_closed
+        try:
+            async for chunk in stream_document_output(output_format, file_id, pages, task.done):
+                yield chunk
+        finally:
+            stream_closed = True
+            if task.done():
+                remove_job_pages(file_id)
+    
+    logger.info(f"Streaming {output_format} output of {upload['filename']} ({pages} pages)")
+    extension = OUTPUT_FORMATS[output_format]["extension"]
+    return StreamingResponse(
+        stream(),
+        media_type=OUTPUT_FORMATS[output_format]["media_type"],
+        headers={"Content-Disposition": f"inline; filename=ocr_{file_id}.{extension}", "X-Pages-Total": str(pages)}
+    )
+
+@app.post("/upload-pdf/", openapi_extra=PDF_UPLOAD_OPENAPI)
+async def upload_pdf(request: Request):
+    """Upload PDF and convert to searchable PDF with perfect text selection, or stream its text/hOCR/JSON"""
+    
+    file_id = str(uuid.uuid4())[:8]
+    input_filename = f"{file_id}_input.pdf"
+    input_path = UPLOAD_DIR / input_filename
+    output_path = OUTPUT_DIR / f"{file_id}_searchable.pdf"
     
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    upload = await receive_pdf_upload(request, input_path)
+    output_format = requested_output_format(upload, input_path)
+    lang = requested_language(upload, input_path)
     
-    content = await file.read()
-    if len(content) > 20 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File size must be less than 20MB")
+    logger.info(f"File uploaded: {input_filename} ({upload['size']} bytes)")
+    if output_format != "pdf":
+        return await stream_upload_output(upload, input_path, file_id, output_format, lang)
+    
+    cache_key = result_cache_key(upload["sha256"], {**OCR_SETTINGS, "language": lang})
+    
+    cached = await asyncio.to_thread(result_cache.get, cache_key)
+    if cached is not None:
+        try:
+            await asyncio.to_thread(result_cache.materialize, cache_key, str(output_path))
+            await asyncio.to_thread(store_file, output_path)
+            os.remove(input_path)
+            logger.info(f"Cache hit for {upload['filename']}: {cache_key[:12]}")
+            return {
+                "message": f"PDF processed successfully with perfect text selection ({cached['message']})",
+                "file_id": file_id,
+                "original_filename": upload["filename"],
+                "download_url": f"/download/{file_id}",
+                "file_size": upload["size"],
+                "has_selectable_text": cached["has_selectable_text"],
+                "character_count": cached["character_count"],
+                "word_count": cached.get("word_count"),
+                "mean_confidence": cached.get("mean_confidence"),
+                "pages": cached.get("pages", []),
+                "processing_method": "OCRmyPDF",
+                "strategy_used": cached["message"],
+                "cache_hit": True
+            }
+        except Exception as e:
+            logger.warning(f"Cached result {cache_key[:12]} unavailable, reprocessing: {e}")
+    
+    pages = await admit_upload(input_path)
     
     try:
-        file_id = str(uuid.uuid4())[:8]
-        input_filename = f"{file_id}_input.pdf"
-        output_filename = f"{file_id}_searchable.pdf"
-        
-        input_path = UPLOAD_DIR / input_filename
-        output_path = OUTPUT_DIR / output_filename
+        result = await ocr_pool.run(run_traced, file_id, "upload", process_pdf, str(input_path), str(output_path),
+                                    None, None, None, lang)
+        error_msg = result["message"]
         
-        with open(input_path, "wb") as f:
-            f.write(content)
-        
-        logger.info(f"File uploaded: {input_filename} ({len(content)} bytes)")
-        
-        success, error_msg = create_searchable_pdf_with_ocrmypdf(str(input_path), str(output_path))
-        
-        if not success:
-            logger.info("Trying pure text layer method...")
-            success, error_msg = create_invisible_text_layer(str(input_path), str(output_path))
-        
-        if not success:
+        if not result["success"]:
             try:
                 os.remove(input_path)
             except:
@@ -481,23 +4100,30 @@ async def upload_pdf(file: UploadFile = File(...)):
                 pass
             raise HTTPException(status_code=500, detail="Processing completed but output file not found")
         
-        has_selectable_text, char_count = verify_pdf_has_selectable_text(str(output_path))
-        
         try:
             os.remove(input_path)
         except:
             pass
         
+        await asyncio.to_thread(result_cache.put, cache_key, str(output_path), cached_result_meta(result))
+        await asyncio.to_thread(store_file, output_path)
+        
         return {
             "message": f"PDF processed successfully with perfect text selection ({error_msg})",
             "file_id": file_id,
-            "original_filename": file.filename,
+            "original_filename": upload["filename"],
             "download_url": f"/download/{file_id}",
-            "file_size": len(content),
-            "has_selectable_text": has_selectable_text,
-            "character_count": char_count,
+            "file_size": upload["size"],
+            "has_selectable_text": result["has_selectable_text"],
+            "character_count": result["character_count"],
+            "word_count": result["word_count"],
+            "mean_confidence": result["mean_confidence"],
+            "pages": result["pages"],
+            "verification": result["verification"],
             "processing_method": "OCRmyPDF",
-            "strategy_used": error_msg
+            "strategy_used": error_msg,
+            "page_classification": result["page_classification"],
+            "cache_hit": False
         }
         
     except HTTPException:
@@ -505,35 +4131,336 @@ async def upload_pdf(file: UploadFile = File(...)):
     except Exception as e:
         logger.error(f"Error processing upload: {str(e)}")
         try:
-            if 'input_path' in locals() and input_path.exists():
+            if input_path.exists():
                 os.remove(input_path)
-            if 'output_path' in locals() and output_path.exists():
+            if output_path.exists():
                 os.remove(output_path)
         except:
             pass
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+    finally:
+        ocr_pool.release(pages)
 
-@app.get("/download/{file_id}")
-async def download_pdf(file_id: str):
-    """Download the processed searchable PDF"""
+@app.post("/jobs", status_code=202, openapi_extra=PDF_UPLOAD_OPENAPI)
+async def create_job(request: Request):
+    """Queue a PDF for OCR and return a job id immediately"""
     
-    output_filename = f"{file_id}_searchable.pdf"
-    output_path = OUTPUT_DIR / output_filename
+    job_id = str(uuid.uuid4())[:8]
+    input_path = UPLOAD_DIR / f"{job_id}_input.pdf"
     
-    if not output_path.exists():
-        raise HTTPException(status_code=404, detail="File not found or has expired")
+    upload_started = time.monotonic()
+    upload = await receive_pdf_upload(request, input_path)
+    upload_seconds = round(time.monotonic() - upload_started, 3)
+    output_format = requested_output_format(upload, input_path)
+    lang = requested_language(upload, input_path)
+    
+    # Incremental jobs OCR page by page with the page engine so finished pages can be served early
+    incremental = upload["fields"].get("incremental", "").lower() in ("1", "true", "yes", "on")
+    settings = {**OCR_SETTINGS, "language": lang}
+    if incremental:
+        settings["strategy"] = "page_engine"
+    if output_format == "pdf":
+        output_path = OUTPUT_DIR / f"{job_id}_searchable.pdf"
+        cache_key = result_cache_key(upload["sha256"], settings)
+    else:
+        # The result cache holds PDFs; text, hOCR and JSON are cheap to rebuild from the page cache
+        output_path = OUTPUT_DIR / f"{job_id}_output.{OUTPUT_FORMATS[output_format]['extension']}"
+        cache_key = None
+    
+    cached = await asyncio.to_thread(result_cache.get, cache_key) if cache_key else None
+    if cached is not None:
+        def record_cached_job():
+            now = time.time()
+            job_store.create(job_id, upload["filename"], "", str(output_path), upload["size"], cache_key,
+                             incremental, language=lang)
+            job_store.update(
+                job_id, state="completed", message=cached["message"],
+                pages_done=cached["pages_total"], pages_total=cached["pages_total"],
+                has_selectable_text=int(cached["has_selectable_text"]),
+                character_count=cached["character_count"], started_at=now, finished_at=now
+            )
+            job_store.add_event(job_id, "upload", "completed", bytes=upload["size"], seconds=upload_seconds)
+            job_store.add_event(job_id, "job", "completed", message=cached["message"], cache_hit=True,
+                                seconds=0.0, download_url=f"/download/{job_id}")
+        
+        try:
+            await asyncio.to_thread(result_cache.materialize, cache_key, str(output_path))
+            await asyncio.to_thread(store_file, output_path)
+            os.remove(input_path)
+            await asyncio.to_thread(record_cached_job)
+            logger.info(f"Job {job_id} served from cache: {cache_key[:12]}")
+            return {
+                "job_id": job_id,
+                "state": "completed",
+                "status_url": f"/jobs/{job_id}",
+                "events_url": f"/jobs/{job_id}/events",
+                "download_url": f"/download/{job_id}",
+                "cache_hit": True
+            }
+        except Exception as e:
+            logger.warning(f"Cached result {cache_key[:12]} unavailable, reprocessing: {e}")
+    
+    # Any replica, or a Celery worker, may run the job
+    await asyncio.to_thread(store_file, input_path, "uploads", upload["size"], True)
+    await asyncio.to_thread(job_store.create, job_id, upload["filename"], str(input_path), str(output_path),
+                            upload["size"], cache_key, incremental, output_format, language=lang)
+    await asyncio.to_thread(job_store.add_event, job_id, "upload", "completed", bytes=upload["size"],
+                            seconds=upload_seconds)
+    if celery_app is not None:
+        celery_run_ocr_job.delay(job_id)
+    
+    logger.info(f"Job {job_id} queued: {upload['filename']} ({upload['size']} bytes, {output_format}, {lang})")
+    
+    return {
+        "job_id": job_id,
+        "state": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        "download_url": f"/download/{job_id}" if output_format == "pdf" else f"/jobs/{job_id}/result",
+        "cache_hit": False
+    }
+
+@app.post("/batches", status_code=202, openapi_extra=PDF_UPLOAD_OPENAPI)
+async def create_batch(request: Request):
+    """Queue many PDFs, or ZIP/tar archives of PDFs, as one batch job"""
+    
+    batch_id = str(uuid.uuid4())[:8]
+    batch_dir = UPLOAD_DIR / f"{batch_id}_batch"
+    batch_dir.mkdir()
+    
+    def accept_file(filename: str) -> Path:
+        lower_name = filename.lower()
+        if not lower_name.endswith(".pdf") and not lower_name.endswith(BATCH_ARCHIVE_SUFFIXES):
+            raise HTTPException(status_code=400, detail="Only PDF files and ZIP/tar archives are allowed")
+        return batch_dir / f"upload_{uuid.uuid4().hex[:8]}"
+    
+    upload_started = time.monotonic()
+    try:
+        received = await receive_multipart_files(request, accept_file, MAX_BATCH_SIZE)
+        if not received["files"]:
+            raise HTTPException(status_code=400, detail="No files found in the upload")
+        output_format = requested_output_format(received)
+        lang = requested_language(received)
+        documents = await asyncio.to_thread(expand_batch_upload, batch_dir, received["files"])
+        if not documents:
+            raise HTTPException(status_code=400, detail="No PDF files found in the upload")
+    except BaseException:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise
+    await asyncio.to_thread(store_file, batch_dir, "uploads", sum(document["size"] for document in documents), True)
+    upload_seconds = round(time.monotonic() - upload_started, 3)
+    
+    output_path = OUTPUT_DIR / f"{batch_id}_results.zip"
+    total_size = sum(document["size"] for document in documents)
+    await asyncio.to_thread(job_store.create, batch_id, f"{len(documents)} documents", str(batch_dir),
+                            str(output_path), total_size, output_format=output_format, batch=True, language=lang)
+    await asyncio.to_thread(job_store.add_event, batch_id, "upload", "completed", bytes=total_size,
+                            documents=len(documents), seconds=upload_seconds)
+    if celery_app is not None:
+        celery_run_ocr_job.delay(batch_id)
+    
+    logger.info(f"Batch {batch_id} queued: {len(documents)} documents ({total_size} bytes, {output_format})")
+    
+    return {
+        "batch_id": batch_id,
+        "state": "queued",
+        "documents": len(documents),
+        "status_url": f"/jobs/{batch_id}",
+        "events_url": f"/jobs/{batch_id}/events",
+        "manifest_url": f"/batches/{batch_id}",
+        "archive_url": f"/batches/{batch_id}/archive"
+    }
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """Per-document manifest of a batch with pages/sec and docs/sec throughput"""
+    job = await asyncio.to_thread(job_store.get, batch_id)
+    if job is None or not job["batch"]:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    status = await asyncio.to_thread(job_status, job)
+    try:
+        manifest = await asyncio.to_thread(storage.read_bytes, "outputs", batch_manifest_path(batch_id).name)
+        status.update(json.loads(manifest))
+    except (OSError, ValueError):
+        # Not started yet: list the queued documents
+        try:
+            documents = json.loads(await asyncio.to_thread(storage.read_bytes, "uploads",
+                                                           f"{Path(job['input_path']).name}/batch.json"))
+            status["documents"] = [{"name": document["name"], "status": "queued"} for document in documents]
+        except (OSError, ValueError):
+            status["documents"] = []
+    return status
+
+@app.api_route("/batches/{batch_id}/archive", methods=["GET", "HEAD"])
+async def download_batch_archive(batch_id: str, request: Request):
+    """ZIP of every document's output plus manifest.json, once the batch is done"""
+    job = await asyncio.to_thread(job_store.get, batch_id)
+    if job is None or not job["batch"]:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if job["state"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Batch failed: {job['message']}")
+    if job["state"] != "completed":
+        raise HTTPException(status_code=409, detail="Batch is not finished yet", headers={"Retry-After": "5"})
+    
+    return await stored_file_response(request, "outputs", os.path.basename(job["output_path"]), "application/zip",
+                                      {"Content-Disposition": f"attachment; filename=batch_{batch_id}.zip"})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Report job state, page progress and timing"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return await asyncio.to_thread(job_status, job)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Stream a job's stage transitions and per-page progress as Server-Sent Events"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    # Reconnecting EventSource clients resume after the last event they saw
+    try:
+        last_id = int(request.headers.get("last-event-id") or request.query_params.get("after") or 0)
+    except ValueError:
+        last_id = 0
+    
+    async def stream():
+        nonlocal last_id
+        created_at = job["created_at"]
+        idle_since = time.monotonic()
+        while True:
+            events = await asyncio.to_thread(job_store.events, job_id, last_id)
+            for event in events:
+                last_id = event["id"]
+                event["elapsed"] = round(event.pop("created_at") - created_at, 3)
+                yield f"id: {last_id}\ndata: {json.dumps(event)}\n\n"
+                if event["stage"] == "job" and event["status"] in ("completed", "failed"):
+                    return
+            
+            if events:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since > 15:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                idle_since = time.monotonic()
+                current = await asyncio.to_thread(job_store.get, job_id)
+                if current is None or current["state"] in ("completed", "failed"):
+                    return
+            
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(JOB_EVENT_POLL_INTERVAL)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def load_job_page_content(job_id: str, page_number: int) -> dict:
+    """Resolve a 1-based page of a job, or fail with 404 (no such job/page) or 409 (not processed yet)"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["state"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job['message']}")
+    if job["pages_total"] and not 1 <= page_number <= job["pages_total"]:
+        raise HTTPException(status_code=404, detail=f"Page {page_number} does not exist")
     
-    return FileResponse(
-        path=str(output_path),
-        filename=f"searchable_{file_id}.pdf",
+    content = None
+    if job["pages_total"]:
+        content = await asyncio.to_thread(job_page_content, job, page_number - 1)
+    if content is None:
+        raise HTTPException(status_code=409, detail=f"Page {page_number} is not processed yet",
+                            headers={"Retry-After": "2"})
+    return content
+
+@app.get("/jobs/{job_id}/pages/{page_number}/text")
+async def job_page_text(job_id: str, page_number: int):
+    """Plain text of one page, available as soon as that page is done"""
+    content = await load_job_page_content(job_id, page_number)
+    return PlainTextResponse(content["text"])
+
+@app.get("/jobs/{job_id}/pages/{page_number}/hocr")
+async def job_page_hocr(job_id: str, page_number: int):
+    """hOCR (words with bounding boxes and confidences) of one page, available as soon as that page is done"""
+    content = await load_job_page_content(job_id, page_number)
+    hocr = build_hocr(page_number - 1, content["width"], content["height"], content["dpi"], content["lines"])
+    return Response(content=hocr, media_type="application/xhtml+xml")
+
+@app.get("/jobs/{job_id}/partial")
+async def job_partial_pdf(job_id: str, request: Request):
+    """Searchable PDF of the pages finished so far (the whole result once the job is done)"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if job["state"] == "completed":
+        return await stored_file_response(
+            request, "outputs", os.path.basename(job["output_path"]), "application/pdf",
+            {"Content-Disposition": f"attachment; filename=searchable_{job_id}.pdf",
+             "X-Pages-Ready": str(job["pages_total"]), "X-Pages-Total": str(job["pages_total"])}
+        )
+    if job["state"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job['message']}")
+    if not job["incremental"]:
+        raise HTTPException(status_code=409, detail="Partial results are only kept for incremental jobs")
+    
+    try:
+        content, pages_ready = await asyncio.to_thread(assemble_partial_pdf, job)
+    except Exception as e:
+        # The job may have finished and removed its input meanwhile
+        logger.warning(f"Partial PDF for job {job_id} unavailable: {e}")
+        pages_ready = 0
+    if not pages_ready:
+        raise HTTPException(status_code=409, detail="No pages are finished yet", headers={"Retry-After": "2"})
+    
+    return Response(
+        content=content,
         media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=searchable_{file_id}.pdf"}
+        headers={"Content-Disposition": f"attachment; filename=partial_{job_id}.pdf",
+                 "X-Pages-Ready": str(pages_ready), "X-Pages-Total": str(job["pages_total"])}
+    )
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str, request: Request):
+    """Output of a job in its requested format; text, hOCR and JSON stream page by page while the job runs"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    output_format = job["output_format"] or "pdf"
+    media_type = OUTPUT_FORMATS[output_format]["media_type"]
+    filename = f"ocr_{job_id}.{OUTPUT_FORMATS[output_format]['extension']}"
+    if job["state"] == "completed":
+        return await stored_file_response(request, "outputs", os.path.basename(job["output_path"]), media_type,
+                                          {"Content-Disposition": f"inline; filename={filename}"})
+    if job["state"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job['message']}")
+    if output_format == "pdf" or job["state"] != "running" or not job["pages_total"]:
+        raise HTTPException(status_code=409, detail="Job is not finished yet", headers={"Retry-After": "2"})
+    
+    def is_finished() -> bool:
+        current = job_store.get(job_id)
+        return current is None or current["state"] in ("completed", "failed")
+    
+    return StreamingResponse(
+        stream_document_output(output_format, job_id, job["pages_total"], is_finished),
+        media_type=media_type,
+        headers={"Content-Disposition": f"inline; filename={filename}", "X-Pages-Total": str(job["pages_total"])}
     )
 
+@app.api_route("/download/{file_id}", methods=["GET", "HEAD"])
+async def download_pdf(file_id: str, request: Request):
+    """Download the processed searchable PDF; supports Range, If-Range and conditional GET"""
+    
+    return await stored_file_response(request, "outputs", f"{file_id}_searchable.pdf", "application/pdf",
+                                      {"Content-Disposition": f"attachment; filename=searchable_{file_id}.pdf"})
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint with dependency verification"""
-    missing_deps = check_dependencies()
+    """Liveness check; dependency status comes from the last background check"""
+    missing_deps = dependency_status["missing"]
     
     status = "healthy" if not missing_deps else "degraded"
     message = "PDF OCR service is running" if not missing_deps else f"Missing dependencies: {', '.join(missing_deps)}"
@@ -546,24 +4473,91 @@ async def health_check():
             "tesseract": "tesseract" not in missing_deps,
             "ghostscript": "ghostscript" not in missing_deps
         },
+        "dependencies_checked_at": dependency_status["checked_at"],
         "upload_dir": str(UPLOAD_DIR),
-        "output_dir": str(OUTPUT_DIR)
+        "output_dir": str(OUTPUT_DIR),
+        "storage": storage.describe()
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check: 503 while tesseract is missing, new uploads would be refused or disk space is low"""
+    pool = ocr_pool.stats()
+    headroom = disk_headroom()
+    saturated = not ocr_pool.has_capacity()
+    low_disk = [name for name, free in headroom.items() if free < READY_MIN_FREE_BYTES]
+    
+    reasons = []
+    if "tesseract" in dependency_status["missing"]:
+        reasons.append("tesseract is missing")
+    if saturated:
+        reasons.append("OCR workers and queue are full")
+    if low_disk:
+        reasons.append(f"low disk space on {', '.join(low_disk)}")
+    
+    body = {
+        "ready": not reasons,
+        "reasons": reasons,
+        "queue": {
+            "active": pool["active"],
+            "queued": pool["queued"],
+            "max_workers": pool["max_workers"],
+            "max_queued": pool["max_queued"],
+            "pages_in_flight": pool["pages_in_flight"],
+            "max_pages_in_flight": pool["max_pages_in_flight"]
+        },
+        "saturation": round((pool["active"] + pool["queued"]) / (pool["max_workers"] + pool["max_queued"]), 3),
+        "disk_free_bytes": headroom,
+        "missing_dependencies": dependency_status["missing"]
+    }
+    if reasons:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/stats")
+async def service_stats():
+    """Worker pool concurrency and throughput metrics"""
+    return {
+        "worker_pool": ocr_pool.stats(),
+        "result_cache": result_cache.stats(),
+        "page_cache": dict(page_cache_stats),
+        "dpi_profile": dpi_profile_stats(),
+        "ocr_strategies": strategy_stats.summary(),
+        "ocrmypdf": {**ocrmypdf_runner.stats(), **core_budget.stats()},
+        "jobs": {"backend": JOB_BACKEND, "states": await asyncio.to_thread(job_store.counts)},
+        "storage": await asyncio.to_thread(storage_index.stats)
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics: per-stage durations, pages, strategy outcomes, queue wait and in-flight work"""
+    pool = ocr_pool.stats()
+    IN_FLIGHT_DOCUMENTS.set(pool["active"] + pool["queued"])
+    IN_FLIGHT_PAGES.set(pool["pages_in_flight"])
+    counts = await asyncio.to_thread(job_store.counts)
+    for state in ("queued", "running", "completed", "failed"):
+        JOBS_BY_STATE.labels(state).set(counts.get(state, 0))
+    
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(content=generate_latest(registry), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
 @app.delete("/cleanup/{file_id}")
 async def cleanup_file(file_id: str):
     """Clean up processed files"""
     
     output_filename = f"{file_id}_searchable.pdf"
-    output_path = OUTPUT_DIR / output_filename
     
-    if output_path.exists():
-        try:
-            os.remove(output_path)
+    try:
+        if await asyncio.to_thread(storage.stat, "outputs", output_filename) is not None:
+            await asyncio.to_thread(storage.delete, "outputs", output_filename)
+            await asyncio.to_thread(storage_index.forget, storage.locator("outputs", output_filename))
             return {"message": "File cleaned up successfully"}
-        except Exception as e:
-            logger.error(f"Error cleaning up file: {e}")
-            return {"message": "Error cleaning up file", "error": str(e)}
+    except Exception as e:
+        logger.error(f"Error cleaning up file: {e}")
+        return {"message": "Error cleaning up file", "error": str(e)}
     
     return {"message": "File not found or already cleaned up"}
 
@@ -577,7 +4571,7 @@ async def startup_event():
         logger.info("Creating static directory...")
         static_dir.mkdir(exist_ok=True)
     
-    missing_deps = check_dependencies()
+    missing_deps = await asyncio.to_thread(refresh_dependency_status, True)
     
     if missing_deps:
         logger.warning(f"Missing dependencies: {', '.join(missing_deps)}")
@@ -587,8 +4581,27 @@ async def startup_event():
     
     logger.info(f"Upload directory: {UPLOAD_DIR}")
     logger.info(f"Output directory: {OUTPUT_DIR}")
+    logger.info(f"Storage backend: {storage.name}")
     
-    cleanup_old_files()
+    await asyncio.to_thread(reconcile_storage)
+    await asyncio.to_thread(run_storage_janitor)
+    ocr_pool.start()
+    
+    if JOB_BACKEND == "local":
+        app.state.job_dispatcher = asyncio.create_task(job_dispatcher())
+    app.state.dependency_monitor = asyncio.create_task(dependency_monitor())
+    app.state.storage_janitor = asyncio.create_task(storage_janitor())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the background tasks and the OCR worker pool"""
+    for name in ("job_dispatcher", "dependency_monitor", "storage_janitor"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    ocr_pool.shutdown()
+    shutdown_page_pool()
+    ocrmypdf_runner.shutdown()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,87 @@
+"""Per-page tesseract overhead: temp files vs a process per page on stdin vs a warm in-process engine
+
+Each input mode runs in a fresh process. A blank 64x64 image shows the fixed cost every
+page pays (process start and model load) apart from recognition; the scanned pages show
+what that adds up to on real work. The api mode needs tesserocr.
+
+    python benchmarks/bench_engine.py                   # synthetic scanned pages
+    python benchmarks/bench_engine.py scan.pdf --lang eng+fra
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+os.chdir(REPO_ROOT)
+
+import fitz  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import app  # noqa: E402
+from bench_render import make_scanned_pdf  # noqa: E402
+
+MODES = ("file", "stdin", "api")
+CONFIG = "--oem 3 --psm 6"
+
+
+def run_mode(mode: str, pdf_path: str, zoom: float, lang: str, blanks: int, queue):
+    app.TESSERACT_INPUT = mode
+    try:
+        blank = Image.new("L", (64, 64), 255)
+        blank_timings = []
+        for _ in range(blanks):
+            started = time.perf_counter()
+            app.tesseract_image_to_data(blank, lang, CONFIG)
+            blank_timings.append(time.perf_counter() - started)
+        page_timings, words = [], 0
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                pix = app.render_page(page, zoom)
+                started = time.perf_counter()
+                data = app.tesseract_image_to_data(pix, lang, CONFIG)
+                page_timings.append(time.perf_counter() - started)
+                words += sum(1 for text in data["text"] if str(text).strip())
+        queue.put((mode, blank_timings, page_timings, words, None))
+    except Exception as e:
+        queue.put((mode, [], [], 0, str(e)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdf", nargs="?", help="PDF to OCR (default: synthetic scanned pages)")
+    parser.add_argument("--zoom", type=float, default=3.0)
+    parser.add_argument("--pages", type=int, default=5, help="pages in the synthetic PDF")
+    parser.add_argument("--blanks", type=int, default=20, help="blank images OCRed to measure fixed overhead")
+    parser.add_argument("--lang", default="eng")
+    parser.add_argument("--modes", default=",".join(MODES))
+    args = parser.parse_args()
+
+    pdf_path = args.pdf
+    if pdf_path is None:
+        pdf_path = os.path.join(tempfile.mkdtemp(), "synthetic_scan.pdf")
+        make_scanned_pdf(pdf_path, args.pages)
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'mode':<6} {'first blank ms':>15} {'blank ms':>9} {'pages':>6} {'ms/page':>8} {'words':>7}")
+    for mode in args.modes.split(","):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_mode, args=(mode, pdf_path, args.zoom, args.lang, args.blanks, queue))
+        proc.start()
+        mode, blank_timings, page_timings, words, error = queue.get()
+        proc.join()
+        if error:
+            print(f"{mode:<6} failed: {error}")
+            continue
+        # The first call of the api mode includes loading the model; later calls show the warm cost
+        print(f"{mode:<6} {1000 * blank_timings[0]:>15.1f} {1000 * statistics.median(blank_timings[1:] or blank_timings):>9.1f} "
+              f"{len(page_timings):>6} {1000 * statistics.mean(page_timings):>8.1f} {words:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""End-to-end pipeline benchmark on a synthetic scanned-PDF corpus with known ground truth
+
+Generates scanned-style PDFs offline (varying page counts, DPI, noise, skew and
+born-digital/scanned mixes), runs them through each searchable-PDF writer and the
+HTTP upload endpoint, and reports throughput, latency, peak RSS, output size and
+how much of the ground-truth text the output PDFs give back. The same --seed always
+produces the same corpus, so runs are comparable across commits.
+
+    python benchmarks/bench_pipeline.py                          # default corpus, every target
+    python benchmarks/bench_pipeline.py --docs 20 --pages 1-12 --concurrency 8
+    python benchmarks/bench_pipeline.py --targets fallback,http --corpus /tmp/corpus
+"""
+import argparse
+import difflib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+os.chdir(REPO_ROOT)
+
+# Keep uploads, caches and job pages of the benchmark away from a running service (and away from earlier
+# runs, so nothing is served from the result or page cache). Spawned workers inherit the directory.
+if "PDF_BENCH_DIR" not in os.environ:
+    os.environ["PDF_BENCH_DIR"] = tempfile.mkdtemp(prefix="pdf_bench_")
+os.environ["TMPDIR"] = os.environ["PDF_BENCH_DIR"]
+tempfile.tempdir = os.environ["PDF_BENCH_DIR"]
+
+import fitz  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import app  # noqa: E402
+
+WORDS = ("the quick brown fox jumps over lazy dog invoice total amount due payment account number "
+         "customer service order date shipping address report summary quarter revenue growth market "
+         "analysis results meeting agenda project schedule budget review approved signed contract "
+         "section page table figure reference request response delivery office manager department").split()
+
+TARGETS = {
+    "ocrmypdf": lambda src, dst: app.create_searchable_pdf_with_ocrmypdf(src, dst),
+    "text_layer": lambda src, dst: app.create_invisible_text_layer(src, dst),
+    "fallback": lambda src, dst: app.create_searchable_pdf_fallback(src, dst),
+}
+
+
+def page_text(rng: random.Random, words: int) -> str:
+    """Sentences of common words, so the recognizer is measured rather than its dictionary"""
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(6, 14))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(length))
+        sentences.append(sentence.capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def scanned_image(text: str, dpi: int, noise: float, angle: float, rng: random.Random) -> Image.Image:
+    """Render text like a scanner would: rasterized at dpi, slightly skewed, with salt-and-pepper speckle"""
+    source = fitz.open()
+    page = source.new_page()
+    page.insert_textbox(page.rect + (60, 60, -60, -60), text, fontsize=11)
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=fitz.csGRAY)
+    source.close()
+    image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    if angle:
+        image = image.rotate(angle, resample=Image.BICUBIC, fillcolor=255)
+    if noise:
+        speckle = Image.frombytes("L", image.size, rng.randbytes(image.width * image.height))
+        threshold = int(noise * 128)
+        image.paste(0, mask=speckle.point(lambda v: 255 if v < threshold else 0))
+        image.paste(255, mask=speckle.point(lambda v: 255 if v >= 255 - threshold else 0))
+    return image
+
+
+def build_corpus(corpus_dir: Path, args) -> list[dict]:
+    """Write the synthetic documents and their ground truth; the seed fully determines the output"""
+    rng = random.Random(args.seed)
+    min_pages, _, max_pages = args.pages.partition("-")
+    min_pages, max_pages = int(min_pages), int(max_pages or min_pages)
+    dpis = [int(dpi) for dpi in args.dpi.split(",")]
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    documents = []
+    for doc_num in range(args.docs):
+        dpi = rng.choice(dpis)
+        noise = round(rng.uniform(0, args.noise), 4)
+        doc = fitz.open()
+        pages = []
+        for _ in range(rng.randint(min_pages, max_pages)):
+            text = page_text(rng, args.words)
+            kind = "digital" if rng.random() < args.digital else "scanned"
+            angle = round(rng.uniform(-args.rotate, args.rotate), 2)
+            page = doc.new_page()
+            if kind == "digital":
+                page.insert_textbox(page.rect + (60, 60, -60, -60), text, fontsize=11)
+            else:
+                image = scanned_image(text, dpi, noise, angle, rng)
+                page.insert_image(page.rect, pixmap=fitz.Pixmap(fitz.csGRAY, image.width, image.height,
+                                                               image.tobytes(), False))
+            pages.append({"kind": kind, "angle": angle if kind == "scanned" else 0, "text": text})
+        path = corpus_dir / f"doc{doc_num:03d}.pdf"
+        doc.save(str(path), garbage=3, deflate=True)
+        doc.close()
+        documents.append({"name": path.name, "path": str(path), "dpi": dpi, "noise": noise, "pages": pages,
+                          "size": path.stat().st_size})
+    with open(corpus_dir / "ground_truth.json", "w") as f:
+        json.dump({"seed": args.seed, "documents": documents}, f, indent=2)
+    return documents
+
+
+def text_recall(pdf_path: str, document: dict) -> float:
+    """Share of ground-truth words recovered in order from the output's text layer"""
+    truth = [word.strip(".").lower() for page in document["pages"] for word in page["text"].split()]
+    with fitz.open(pdf_path) as doc:
+        found = [word.strip(".").lower() for page in doc for word in page.get_text().split()]
+    matcher = difflib.SequenceMatcher(None, truth, found, autojunk=False)
+    return sum(block.size for block in matcher.get_matching_blocks()) / max(len(truth), 1)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile, defined for any number of samples"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+def run_target(name: str, documents: list[dict], output_dir: str, queue):
+    """Run one writer over the corpus in this (fresh) process, so its peak RSS stands alone"""
+    runs = []
+    for document in documents:
+        output_path = os.path.join(output_dir, f"{name}_{document['name']}")
+        started = time.perf_counter()
+        try:
+            success, message = TARGETS[name](document["path"], output_path)
+        except Exception as e:
+            success, message = False, str(e)
+        runs.append({"seconds": time.perf_counter() - started, "success": success and os.path.exists(output_path),
+                     "message": message, "output": output_path})
+    queue.put((runs, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def post_pdf(url: str, path: str) -> dict:
+    """POST one PDF as the multipart "file" field, the way the web UI does"""
+    boundary = uuid.uuid4().hex
+    with open(path, "rb") as f:
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; "
+                f"filename=\"{os.path.basename(path)}\"\r\nContent-Type: application/pdf\r\n\r\n").encode()
+        body += f.read() + f"\r\n--{boundary}--\r\n".encode()
+    request = urllib.request.Request(url, data=body, method="POST",
+                                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    with urllib.request.urlopen(request, timeout=3600) as response:
+        return json.load(response)
+
+
+def run_http(documents: list[dict], output_dir: str, concurrency: int) -> tuple[list[dict], float, int]:
+    """Start the service under uvicorn and upload the corpus from concurrent clients"""
+    port = free_port()
+    server_tmp = os.path.join(os.environ["PDF_BENCH_DIR"], "server")
+    os.makedirs(server_tmp, exist_ok=True)
+    env = dict(os.environ, TMPDIR=server_tmp, TRACE_DIR="")
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port),
+                               "--log-level", "warning"], cwd=REPO_ROOT, env=env)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(300):
+            try:
+                urllib.request.urlopen(f"{base}/health", timeout=60).read()
+                break
+            except OSError:
+                time.sleep(0.2)
+        else:
+            raise RuntimeError("Server did not come up")
+
+        def upload(document: dict) -> dict:
+            output_path = os.path.join(output_dir, f"http_{document['name']}")
+            started = time.perf_counter()
+            try:
+                result = post_pdf(f"{base}/upload-pdf/", document["path"])
+                urllib.request.urlretrieve(base + result["download_url"], output_path)
+                success, message = True, result.get("strategy_used", "")
+            except Exception as e:
+                success, message = False, str(e)
+            return {"seconds": time.perf_counter() - started, "success": success, "message": message,
+                    "output": output_path}
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            runs = list(pool.map(upload, documents))
+        wall = time.perf_counter() - started
+        peak_kb = 0
+        try:
+            with open(f"/proc/{server.pid}/status") as f:
+                peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+        except (OSError, StopIteration):
+            pass
+        return runs, wall, peak_kb
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def report(name: str, documents: list[dict], runs: list[dict], wall: float, peak_kb: int):
+    ok = [(document, run) for document, run in zip(documents, runs) if run["success"]]
+    if not ok:
+        print(f"{name:<11} failed on every document: {runs[0]['message'][:80]}")
+        return
+    latencies = [run["seconds"] for _, run in ok]
+    pages = sum(len(document["pages"]) for document, _ in ok)
+    output_bytes = sum(os.path.getsize(run["output"]) for _, run in ok)
+    input_bytes = sum(document["size"] for document, _ in ok)
+    recall = statistics.mean(text_recall(run["output"], document) for document, run in ok)
+    print(f"{name:<11} {len(ok):>3}/{len(runs):<3} {pages / wall:>8.2f} {1000 * percentile(latencies, 50):>9.0f} "
+          f"{1000 * percentile(latencies, 99):>9.0f} {peak_kb / 1024 if peak_kb else float('nan'):>8.1f} "
+          f"{output_bytes / 1024:>10.0f} {output_bytes / input_bytes:>6.2f} {100 * recall:>7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=6, help="documents in the corpus")
+    parser.add_argument("--pages", default="1-6", help="page count per document, N or MIN-MAX")
+    parser.add_argument("--words", type=int, default=150, help="words per page")
+    parser.add_argument("--dpi", default="150,200,300", help="scan resolutions to pick from")
+    parser.add_argument("--noise", type=float, default=0.03, help="maximum share of speckled pixels")
+    parser.add_argument("--rotate", type=float, default=1.5, help="maximum skew in degrees")
+    parser.add_argument("--digital", type=float, default=0.2, help="share of born-digital pages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", help="keep the corpus and ground truth in this directory")
+    parser.add_argument("--targets", default=",".join([*TARGETS, "http"]))
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel clients for the http target")
+    args = parser.parse_args()
+
+    work_dir = Path(os.environ["PDF_BENCH_DIR"])
+    documents = build_corpus(Path(args.corpus) if args.corpus else work_dir / "corpus", args)
+    output_dir = str(work_dir / "outputs")
+    os.makedirs(output_dir, exist_ok=True)
+    total_pages = sum(len(document["pages"]) for document in documents)
+    scanned = sum(page["kind"] == "scanned" for document in documents for page in document["pages"])
+    print(f"corpus: {len(documents)} documents, {total_pages} pages ({scanned} scanned), seed {args.seed}")
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'target':<11} {'ok':>7} {'pages/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'RSS MB':>8} "
+          f"{'output KB':>10} {'ratio':>6} {'recall':>8}")
+    for name in args.targets.split(","):
+        if name == "http":
+            runs, wall, peak_kb = run_http(documents, output_dir, args.concurrency)
+        else:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_target, args=(name, documents, output_dir, queue))
+            started = time.perf_counter()
+            proc.start()
+            runs, peak_kb = queue.get()
+            wall = time.perf_counter() - started
+            proc.join()
+        report(name, documents, runs, wall, peak_kb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Micro-benchmark: rasterize -> tesseract input, PNG round-trip vs raw pixmap samples
+
+Each variant runs in a fresh process so peak RSS is measured independently. The raw
+variant pins TESSERACT_INPUT=stdin so both compare the render path against the same
+tesseract CLI; bench_engine.py compares the input modes.
+
+    python benchmarks/bench_render.py                   # synthetic scanned page
+    python benchmarks/bench_render.py scan.pdf --ocr    # also run tesseract
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+os.chdir(REPO_ROOT)
+
+import fitz  # noqa: E402
+import pytesseract  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import app  # noqa: E402
+
+
+def make_scanned_pdf(path: str, pages: int = 3):
+    """Build a PDF whose pages are images of text, like a 200 DPI scan"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        source = fitz.open()
+        text_page = source.new_page()
+        text = f"Page {page_num + 1}. " + "The quick brown fox jumps over the lazy dog. " * 40
+        text_page.insert_textbox(text_page.rect + (50, 50, -50, -50), text, fontsize=11)
+        pix = text_page.get_pixmap(matrix=fitz.Matrix(200 / 72, 200 / 72), colorspace=fitz.csGRAY)
+        page = doc.new_page(width=text_page.rect.width, height=text_page.rect.height)
+        page.insert_image(page.rect, pixmap=pix)
+    doc.save(path)
+
+
+def png_roundtrip(page, zoom: float, ocr: bool):
+    """Previous path: RGB render, PNG encode, PNG decode, then pytesseract's temp PNG"""
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    img_data = pix.tobytes("png")
+    image = Image.open(io.BytesIO(img_data)).convert('RGB')
+    if ocr:
+        pytesseract.image_to_data(image, lang='eng', config='--oem 3 --psm 6', output_type=pytesseract.Output.DICT)
+    else:
+        image.save(io.BytesIO(), format="PNG")  # what pytesseract writes to its temp file
+
+
+def raw_samples(page, zoom: float, ocr: bool):
+    """Current path: grayscale render, samples streamed to tesseract as PNM"""
+    pix = app.render_page(page, zoom)
+    if ocr:
+        app.tesseract_image_to_data(pix, 'eng', '--oem 3 --psm 6')
+    else:
+        with open(os.devnull, "wb") as sink:
+            sink.write(b"P5\n%d %d\n255\n" % (pix.width, pix.height))
+            sink.write(pix.samples_mv)
+
+
+VARIANTS = {"png": png_roundtrip, "raw": raw_samples}
+
+
+def run_variant(name: str, pdf_path: str, zoom: float, ocr: bool, queue):
+    app.TESSERACT_INPUT = "stdin"
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            started = time.perf_counter()
+            VARIANTS[name](page, zoom, ocr)
+            timings.append(time.perf_counter() - started)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((name, timings, baseline_kb, peak_kb))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdf", nargs="?", help="PDF to render (default: synthetic scanned pages)")
+    parser.add_argument("--zoom", type=float, default=3.0)
+    parser.add_argument("--pages", type=int, default=3, help="pages in the synthetic PDF")
+    parser.add_argument("--ocr", action="store_true", help="include the tesseract run in the timing")
+    args = parser.parse_args()
+
+    pdf_path = args.pdf
+    if pdf_path is None:
+        pdf_path = os.path.join(tempfile.mkdtemp(), "synthetic_scan.pdf")
+        make_scanned_pdf(pdf_path, args.pages)
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'variant':<8} {'pages':>5} {'ms/page':>9} {'min ms':>8} {'peak RSS MB':>12} {'RSS growth MB':>14}")
+    for name in VARIANTS:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_variant, args=(name, pdf_path, args.zoom, args.ocr, queue))
+        proc.start()
+        name, timings, baseline_kb, peak_kb = queue.get()
+        proc.join()
+        print(f"{name:<8} {len(timings):>5} {1000 * sum(timings) / len(timings):>9.1f} "
+              f"{1000 * min(timings):>8.1f} {peak_kb / 1024:>12.1f} {(peak_kb - baseline_kb) / 1024:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Benchmark text-layer writers: per-word widgets, hand-built content stream, batched writer
+
+Uses synthetic tesseract word boxes, so no OCR engine is needed.
+
+    python benchmarks/bench_text_layer.py --pages 10 --words 1500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+os.chdir(REPO_ROOT)
+
+import fitz  # noqa: E402
+
+import app  # noqa: E402
+
+ZOOM = 3.0
+
+
+def synthetic_page_result(page_num: int, words: int, width: int, height: int) -> dict:
+    """Word boxes laid out like a dense page of text, in tesseract image_to_data DICT layout"""
+    data = {key: [] for key in ("level", "block_num", "par_num", "line_num", "word_num",
+                                "left", "top", "width", "height", "conf", "text")}
+    per_line = 12
+    for i in range(words):
+        line, column = divmod(i, per_line)
+        data["level"].append(5)
+        data["block_num"].append(1)
+        data["par_num"].append(1 + line // 10)
+        data["line_num"].append(line)
+        data["word_num"].append(column + 1)
+        data["left"].append(120 + column * 140)
+        data["top"].append(150 + line * 45)
+        data["width"].append(120)
+        data["height"].append(32)
+        data["conf"].append(90)
+        data["text"].append(f"word{i}(x)")
+    return {"page": page_num, "zoom": ZOOM, "width": width, "height": height, "data": data}
+
+
+def legacy_widgets(doc, page, page_result):
+    """Previous create_searchable_pdf_fallback: one invisible form field per word
+
+    The old code never set field_name, so PyMuPDF rejected every widget and the
+    per-word textbox fallback ran instead; a name is added here to measure the
+    intended path.
+    """
+    data = page_result["data"]
+    x_scale = page.rect.width / page_result["width"]
+    y_scale = page.rect.height / page_result["height"]
+    for i in range(len(data["text"])):
+        x, y, w, h = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
+        widget = fitz.Widget()
+        widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+        widget.field_name = f"ocr_{page.number}_{i}"
+        widget.rect = fitz.Rect(x * x_scale, y * y_scale, (x + w) * x_scale, (y + h) * y_scale)
+        widget.field_value = data["text"][i]
+        widget.text_fontsize = max(min(h * y_scale * 0.85, 72), 4)
+        widget.fill_color = None
+        widget.border_color = None
+        widget.text_color = (1, 1, 1, 0)
+        page.add_widget(widget)
+
+
+def legacy_content_stream(doc, page, page_result):
+    """Previous create_invisible_text_layer: hand-concatenated, unescaped Td/Tj operators
+
+    The old code handed bytes to page.set_contents(), which expects an xref and
+    raised "bad xref"; the stream is written with update_stream() here instead.
+    """
+    data = page_result["data"]
+    x_scale = page.rect.width / page_result["width"]
+    y_scale = page.rect.height / page_result["height"]
+    stream = ["BT", "3 Tr", "/Helv 12 Tf"]
+    for i in range(len(data["text"])):
+        x, y, h = data["left"][i], data["top"][i], data["height"][i]
+        font_size = max(min(h * y_scale * 0.85, 72), 4)
+        stream.append(f"{font_size} TL")
+        stream.append(f"{x * x_scale} {page.rect.height - y * y_scale} Td")
+        stream.append(f"({data['text'][i]}) Tj")
+    stream.append("ET")
+    page.wrap_contents()
+    content = page.read_contents().decode('utf-8', errors='ignore') + "\n" + "\n".join(stream)
+    doc.update_stream(page.get_contents()[0], content.encode('utf-8'))
+
+
+WRITERS = {
+    "widgets (old fallback)": legacy_widgets,
+    "content stream (old)": legacy_content_stream,
+    "batched writer": app.write_text_layer,
+}
+
+
+def make_base_pdf(path: str, pages: int):
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), "scanned page placeholder")
+    doc.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--words", type=int, default=1500, help="recognized words per page")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    base_pdf = os.path.join(workdir, "base.pdf")
+    make_base_pdf(base_pdf, args.pages)
+
+    print(f"{'writer':<24} {'write s':>8} {'save s':>8} {'size KB':>9} {'words found':>12}")
+    for name, writer in WRITERS.items():
+        doc = fitz.open(base_pdf)
+        width, height = int(doc[0].rect.width * ZOOM), int(doc[0].rect.height * ZOOM)
+        started = time.perf_counter()
+        for page in doc:
+            writer(doc, page, synthetic_page_result(page.number, args.words, width, height))
+        write_seconds = time.perf_counter() - started
+
+        output = os.path.join(workdir, "out.pdf")
+        started = time.perf_counter()
+        doc.save(output, garbage=4, deflate=True, clean=True)
+        save_seconds = time.perf_counter() - started
+        doc.close()
+
+        with fitz.open(output) as result:
+            found = sum(len(page.get_text("words")) for page in result)
+        print(f"{name:<24} {write_seconds:>8.2f} {save_seconds:>8.2f} "
+              f"{os.path.getsize(output) / 1024:>9.1f} {found:>12}")
+
+
+if __name__ == "__main__":
+    main()